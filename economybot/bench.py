@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import gc
+import random
+import tempfile
+import time
+import tracemalloc
+
+from harness import FakeChannel, FakeGuild, FakeInteraction, FakeMember, invoke, load_bot, press, total_money
+
+MIX = {
+    "bal": 35,
+    "coinflip": 15,
+    "transfer": 20,
+    "baltop": 15,
+    "blackjack": 15
+}
+LAG_TICK = 0.001
+# lag beyond this is counted as the loop being blocked rather than timer jitter
+BLOCKING_MS = 5
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+class LoopMonitor:
+    # a task that asks to wake every LAG_TICK; how late it wakes is how long the loop was busy
+    def __init__(self):
+        self.lags = []
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_TICK)
+            self.lags.append(max(0.0, time.perf_counter() - start - LAG_TICK) * 1000)
+
+class Bench:
+    def __init__(self, bot, args):
+        self.bot = bot
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.members = [FakeMember(100000000000000000 + i) for i in range(args.users)]
+        self.guild = FakeGuild(self.members)
+        self.latencies = {}
+
+    def interaction(self, member):
+        return FakeInteraction(member, self.bot.ALLOWED_CHANNEL_ID, self.guild, self.args.delay / 1000)
+
+    def seed(self):
+        self.bot.load_users()
+        for member in self.members:
+            self.bot.users[member.id] = self.bot.Account(balance=self.rng.randint(0, 5000), bank_balance=self.rng.randint(0, 500))
+        self.bot.storage.write(self.bot.storage.snapshot(self.bot.users, list(self.bot.users)))
+        self.bot.leaderboard.rebuild(self.bot.users)
+
+    async def timed(self, name, coro):
+        start = time.perf_counter()
+        response = await coro
+        self.latencies.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+        return response
+
+    async def run_one(self, command):
+        member = self.rng.choice(self.members)
+        if command == "bal":
+            await self.timed("bal", invoke(self.bot.bal, self.interaction(member)))
+        elif command == "coinflip":
+            await self.timed("coinflip", invoke(self.bot.coinflip, self.interaction(member), self.rng.randint(1, 50)))
+        elif command == "transfer":
+            recipient = self.rng.choice(self.members)
+            await self.timed("transfer", invoke(self.bot.transfer, self.interaction(member), recipient, self.rng.randint(1, 100)))
+        elif command == "baltop":
+            # most people only look at the first page
+            page = 1 if self.rng.random() < 0.7 else self.rng.randint(1, 20)
+            await self.timed("baltop", invoke(self.bot.baltop, self.interaction(member), page))
+        elif command == "blackjack":
+            response = await self.timed("blackjack", invoke(self.bot.blackjack, self.interaction(member), self.rng.randint(1, 50)))
+            view = response.view
+            if view is None:
+                return
+            while self.rng.random() < 0.4 and not view.game_over:
+                await self.timed("blackjack:hit", press(view, view.hit_button, self.interaction(member)))
+            if not view.game_over:
+                await self.timed("blackjack:stand", press(view, view.stand_button, self.interaction(member)))
+
+    async def worker(self, index, commands, start):
+        for i, command in enumerate(commands):
+            if self.args.rate:
+                # interaction n starts no earlier than n / rate
+                await asyncio.sleep(max(0, start + (i * self.args.concurrency + index) / self.args.rate - time.perf_counter()))
+            else:
+                # each interaction arrives as its own gateway event, so let the loop run in between
+                await asyncio.sleep(0)
+            await self.run_one(command)
+
+    async def run(self):
+        self.seed()
+        commands = self.rng.choices(list(MIX), weights=list(MIX.values()), k=self.args.interactions)
+        # deal the commands out round-robin so every worker stays busy until the end
+        workers = [commands[i::self.args.concurrency] for i in range(self.args.concurrency)]
+
+        self.bot.persistence.start()
+        monitor = LoopMonitor()
+        monitor.start()
+        start = time.perf_counter()
+        await asyncio.gather(*(self.worker(index, chunk, start) for index, chunk in enumerate(workers)))
+        elapsed = time.perf_counter() - start
+        await monitor.stop()
+
+        flush_start = time.perf_counter()
+        await self.bot.persistence.stop()
+        flush_ms = (time.perf_counter() - flush_start) * 1000
+
+        self.report(elapsed, monitor.lags, flush_ms)
+
+    def report(self, elapsed, lags, flush_ms):
+        total = sum(len(samples) for samples in self.latencies.values())
+        offered = f"{self.args.rate}/s offered" if self.args.rate else "closed loop"
+        print(f"{total} interactions from {self.args.users} users in {elapsed:.2f}s ({total / elapsed:.0f}/s, {offered}, concurrency {self.args.concurrency})")
+        print()
+        print(f"{'command':<16}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for name in sorted(self.latencies):
+            samples = self.latencies[name]
+            print(f"{name:<16}{len(samples):>8}{percentile(samples, 50):>10.3f}{percentile(samples, 99):>10.3f}{max(samples):>10.3f}")
+        print()
+        print(f"event loop lag: p50 {percentile(lags, 50):.3f} ms, p99 {percentile(lags, 99):.3f} ms, max {max(lags, default=0):.3f} ms, blocked {sum(lag for lag in lags if lag > BLOCKING_MS):.1f} ms of {elapsed * 1000:.0f} ms")
+        stats = self.bot.persistence.stats
+        print(f"flusher: {stats['flushes']} flushes, {stats['records_flushed']} records from {stats['mutations']} mutations, max batch {stats['max_batch_size']}, max flush {stats['max_flush_ms']:.1f} ms, shutdown flush {flush_ms:.1f} ms")
+        stats = self.bot.user_locks.stats
+        print(f"locks: {stats['acquisitions']} acquisitions, {stats['contended']} contended, max wait {stats['max_wait_ms']:.3f} ms")
+
+async def bench_transfers(bot, args):
+    # thousands of transfers, deposits and withdrawals among a few users, all in flight at once; every
+    # reply takes a millisecond, so handlers hold their locks across an await
+    rng = random.Random(args.seed)
+    members = [FakeMember(100000000000000000 + i) for i in range(args.hot_users)]
+    guild = FakeGuild(members)
+    bot.load_users()
+    for member in members:
+        bot.users[member.id] = bot.Account(balance=rng.randint(0, 5000), bank_balance=rng.randint(0, 500))
+    bot.storage.write(bot.storage.snapshot(bot.users, list(bot.users)))
+    before = total_money(bot, members)
+
+    def interaction(member):
+        return FakeInteraction(member, bot.ALLOWED_CHANNEL_ID, guild, 0.001)
+
+    calls = []
+    for _ in range(args.interactions):
+        member = rng.choice(members)
+        roll = rng.random()
+        if roll < 0.8:
+            calls.append(invoke(bot.transfer, interaction(member), rng.choice(members), rng.randint(1, 500)))
+        elif roll < 0.9:
+            calls.append(invoke(bot.deposit, interaction(member), rng.randint(1, 50)))
+        else:
+            calls.append(invoke(bot.withdraw, interaction(member), rng.randint(1, 50)))
+
+    bot.persistence.start()
+    start = time.perf_counter()
+    responses = await asyncio.gather(*calls)
+    elapsed = time.perf_counter() - start
+    await bot.persistence.stop()
+
+    after = total_money(bot, members)
+    negative = sum(1 for member in members if bot.users[member.id]["balance"] < 0 or bot.users[member.id]["bank_balance"] < 0)
+    stored = bot.storage.load()
+    on_disk = sum(stored[member.id]["balance"] + stored[member.id]["bank_balance"] for member in members)
+    refused = sum(1 for response in responses if response.ephemeral)
+    stats = bot.user_locks.stats
+    print(f"{args.interactions} concurrent transfers, deposits and withdrawals among {args.hot_users} users in {elapsed:.2f}s, {refused} refused")
+    print(f"total money: {before} before, {after} after, {on_disk} on disk -> {'conserved' if before == after == on_disk else 'NOT CONSERVED'}; {negative} negative balances")
+    print(f"locks: {stats['acquisitions']} acquisitions, {stats['contended']} contended, max wait {stats['max_wait_ms']:.1f} ms, {len(bot.user_locks.locks)} left held")
+
+    # a command from the wrong channel gets the channel error, not a cooldown reply
+    gambler = FakeMember(200000000000000000)
+    wrong = FakeInteraction(gambler, bot.ALLOWED_CHANNEL_ID + 1, guild)
+    bot.cooldowns.trigger("bank", str(gambler.id))
+    await invoke(bot.slots, wrong, 10)
+    print(f"/slots from the wrong channel while on cooldown -> {wrong.response.content!r}")
+    bot.cooldowns.expiries.pop(("bank", str(gambler.id)))
+
+    # blackjack games left open side by side: the stakes must come out of the wallet, however the games end
+    bot.users[gambler.id] = bot.Account(balance=100)
+    views = []
+    for _ in range(5):
+        response = await invoke(bot.blackjack, interaction(gambler), 100)
+        if response.view is not None:
+            views.append(response.view)
+    for i, view in enumerate(views):
+        await view.end_game(interaction(gambler), i > 0, "")
+    expected = 100 + sum(100 if i > 0 else -100 for i in range(len(views)))
+    balance = bot.users[gambler.id]["balance"]
+    print(f"blackjack: {len(views)} of 5 games opened on a wallet of 100, one lost and the rest won -> {balance} francs "
+          f"({'ok' if len(views) * 100 <= 100 and balance == expected else 'stakes exceed the wallet'})")
+
+def bench_cooldowns(bot, args):
+    # millions of triggers from a large pool of users, each cooldown a few ms long so they keep expiring;
+    # the service should hold only what is live, where the old per-command dicts kept every user forever
+    rng = random.Random(args.seed)
+    buckets = list(bot.COOLDOWNS)
+    triggers = [(rng.choice(buckets), str(100000000000000000 + rng.randrange(args.users * 100)), rng.uniform(0.001, 0.02)) for _ in range(args.triggers)]
+    checkpoint = max(1, args.triggers // 10)
+
+    tracemalloc.start()
+    cooldowns = bot.Cooldowns("bench_cooldowns.json")
+    baseline = tracemalloc.get_traced_memory()[0]
+    print(f"{args.triggers} cooldown triggers from {args.users * 100} users, each 1-20 ms long")
+    print(f"{'triggers':>10}{'live':>10}{'heap':>10}{'KiB':>10}")
+    start = time.perf_counter()
+    for i, (bucket, user_id, seconds) in enumerate(triggers, start=1):
+        cooldowns.trigger(bucket, user_id, seconds)
+        if i % checkpoint == 0:
+            print(f"{i:>10}{len(cooldowns.expiries):>10}{len(cooldowns.heap):>10}{(tracemalloc.get_traced_memory()[0] - baseline) / 1024:>10.0f}")
+    elapsed = time.perf_counter() - start
+    del cooldowns
+
+    # what the handlers did before: one dict per command, written and never cleaned
+    baseline = tracemalloc.get_traced_memory()[0]
+    legacy = {bucket: {} for bucket in buckets}
+    for bucket, user_id, seconds in triggers:
+        legacy[bucket][user_id] = time.time() + seconds
+    legacy_kib = (tracemalloc.get_traced_memory()[0] - baseline) / 1024
+    tracemalloc.stop()
+    print(f"Cooldowns.trigger: {elapsed / args.triggers * 1e6:.2f} us each (with tracemalloc on)")
+    print(f"per-command dicts: {sum(len(entries) for entries in legacy.values())} entries, {legacy_kib:.0f} KiB after the same triggers")
+
+def traced(build):
+    # bytes still allocated by whatever build() returns
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+def bench_memory(bot, args):
+    rng = random.Random(args.seed)
+    jobs = [None] + list(bot.JOBS)
+    rows = [(100000000000000000 + i, rng.randint(0, 50000), rng.randint(0, 500), rng.choice(jobs), rng.randint(0, 1000), rng.choice([500, 1000, 5000]))
+            for i in range(args.accounts)]
+
+    def legacy():
+        # the old layout: a dict per account under its stringified id
+        return {str(user_id): {"balance": balance, "bank_balance": bank_balance, "job": job, "xp": xp, "bank_space": bank_space}
+                for user_id, balance, bank_balance, job, xp, bank_space in rows}
+
+    def table():
+        accounts = bot.AccountTable()
+        for user_id, balance, bank_balance, job, xp, bank_space in rows:
+            accounts.accounts[user_id] = bot.Account(balance, bank_balance, job, xp, bank_space)
+        return accounts
+
+    old, old_size = traced(legacy)
+    del old
+    accounts, new_size = traced(table)
+    print(f"{args.accounts} accounts")
+    print(f"dict of dicts keyed by str: {old_size / 1024 / 1024:8.1f} MiB, {old_size / args.accounts:.0f} bytes per account")
+    print(f"AccountTable of Account:    {new_size / 1024 / 1024:8.1f} MiB, {new_size / args.accounts:.0f} bytes per account")
+
+    # looking up users who never played leaves nothing behind
+    lookups = [200000000000000000 + i for i in range(args.accounts // 10)]
+    _, lookup_size = traced(lambda: sum(accounts[user_id]["balance"] for user_id in lookups))
+    print(f"{len(lookups)} lookups of unknown users: {len(accounts) - args.accounts} accounts added, {lookup_size / 1024:.0f} KiB held")
+
+    # names of every user ever shown on /baltop, against the LRU that replaced fetching them each time
+    names = [(str(user_id), f"user{user_id}") for user_id, *_ in rows]
+    _, dict_size = traced(lambda: dict(names))
+    def fill():
+        cache = bot.NameCache(bot.NAME_CACHE_SIZE, bot.NAME_CACHE_TTL)
+        for user_id, name in names:
+            cache.put(user_id, name)
+        return cache
+    cache, cache_size = traced(fill)
+    print(f"{len(names)} distinct names: plain dict {dict_size / 1024 / 1024:.1f} MiB, NameCache {len(cache.entries)} entries in {cache_size / 1024 / 1024:.1f} MiB (cap {bot.NAME_CACHE_SIZE})")
+
+async def bench_lootbox(bot, args):
+    # lootboxes spawned in many channels at once, each mobbed by concurrent clicks, some from the same user
+    rng = random.Random(args.seed)
+    members = [FakeMember(100000000000000000 + i) for i in range(args.users)]
+    guild = FakeGuild(members)
+    bot.load_users()
+    channels = {channel_id: FakeChannel(channel_id) for channel_id in range(1, args.lootboxes + 1)}
+    bot.client.get_channel = channels.get
+    scheduler = bot.LootboxScheduler(channels)
+    await asyncio.gather(*(scheduler.spawn(channel_id) for channel_id in channels))
+    boxes = [channel.sent[0][2].children[0].callback.__self__ for channel in channels.values()]
+    before = {member.id: bot.users[member.id]["balance"] for member in members}
+
+    clicks = []
+    for box in boxes:
+        # a handful of people each clicking several times, so double clicks race the claimer cap
+        pool = rng.sample(members, bot.LOOTBOX_MAX_CLAIMERS + 2)
+        clickers = [rng.choice(pool) for _ in range(args.clicks)]
+        clicks += [press(box.view, box.button, FakeInteraction(member, bot.ALLOWED_CHANNEL_ID, guild, 0.001)) for member in clickers]
+    rng.shuffle(clicks)
+    bot.persistence.start()
+    start = time.perf_counter()
+    responses = await asyncio.gather(*clicks)
+    elapsed = time.perf_counter() - start
+    await bot.persistence.stop()
+
+    credited = {}
+    for box in boxes:
+        for winner_id in box.winners:
+            credited[int(winner_id)] = credited.get(int(winner_id), 0) + box.amount
+    overfull = sum(1 for box in boxes if len(box.winners) > bot.LOOTBOX_MAX_CLAIMERS)
+    repeated = sum(len(box.winners) - len(set(box.winners)) for box in boxes)
+    still_open = sum(1 for box in boxes if len(box.winners) == bot.LOOTBOX_MAX_CLAIMERS and not box.button.disabled)
+    wrong = sum(1 for member in members if bot.users[member.id]["balance"] - before[member.id] != credited.get(member.id, 0))
+    stored = bot.storage.load()
+    unsaved = sum(1 for user_id, amount in credited.items() if stored[user_id]["balance"] != before[user_id] + amount)
+    turned_away = sum(1 for response in responses if response.ephemeral)
+    print(f"{len(clicks)} concurrent clicks on {len(boxes)} lootboxes from {args.users} users in {elapsed * 1000:.0f} ms")
+    print(f"{sum(len(box.winners) for box in boxes)} claims, {turned_away} clicks turned away; {overfull} boxes over {bot.LOOTBOX_MAX_CLAIMERS} claimers, "
+          f"{repeated} repeat claims, {still_open} full boxes with the button still enabled")
+    print(f"{wrong} balances differ from the claims they won, {unsaved} not on disk after the flush; "
+          f"flusher wrote {bot.persistence.stats['records_flushed']} records in {bot.persistence.stats['flushes']} flushes")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a mix of economybot commands against fake interactions.")
+    parser.add_argument("scenario", nargs="?", default="mix", choices=["mix", "transfers", "cooldowns", "memory", "lootbox"],
+                        help="mix: the weighted command replay; transfers: checks money is conserved under contention; "
+                             "cooldowns: memory under millions of cooldown triggers; memory: account and name cache footprint; "
+                             "lootbox: concurrent claim clicks")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--interactions", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--rate", type=int, default=2000, help="commands started per second; 0 runs as fast as the loop allows")
+    parser.add_argument("--delay", type=float, default=0, help="simulated Discord API round trip per reply, in ms")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--hot-users", type=int, default=500, help="users sharing the transfers scenario")
+    parser.add_argument("--triggers", type=int, default=2000000, help="cooldown triggers in the cooldowns scenario")
+    parser.add_argument("--accounts", type=int, default=200000, help="accounts in the memory scenario")
+    parser.add_argument("--lootboxes", type=int, default=200, help="lootboxes spawned at once in the lootbox scenario")
+    parser.add_argument("--clicks", type=int, default=50, help="claim clicks per lootbox")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = load_bot(workdir)
+        if args.scenario == "transfers":
+            asyncio.run(bench_transfers(bot, args))
+        elif args.scenario == "cooldowns":
+            bench_cooldowns(bot, args)
+        elif args.scenario == "memory":
+            bench_memory(bot, args)
+        elif args.scenario == "lootbox":
+            asyncio.run(bench_lootbox(bot, args))
+        else:
+            asyncio.run(Bench(bot, args).run())
+
+if __name__ == "__main__":
+    main()
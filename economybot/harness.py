@@ -0,0 +1,103 @@
+import asyncio
+import importlib
+import os
+import sys
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_bot(workdir):
+    # main.py keeps its users.db/users.json relative to the working directory; storage is opened
+    # here the way setup_hook opens it, since the benches never start the client
+    os.chdir(workdir)
+    if BOT_DIR not in sys.path:
+        sys.path.insert(0, BOT_DIR)
+    bot = importlib.import_module("main")
+    bot.storage = bot.persistence.storage = bot.open_storage()
+    return bot
+
+class FakeMember:
+    def __init__(self, user_id, name=None):
+        self.id = user_id
+        self.name = name or f"user{user_id}"
+        self.display_name = self.name
+        self.bot = False
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    def __repr__(self):
+        return f"<FakeMember id={self.id}>"
+
+class FakeGuild:
+    def __init__(self, members=()):
+        self.members = {member.id: member for member in members}
+
+    def add_member(self, member):
+        self.members[member.id] = member
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.sent = []
+
+    async def send(self, content=None, *, embed=None, view=None, **kwargs):
+        self.sent.append((content, embed, view))
+
+class FakeResponse:
+    # stands in for discord.InteractionResponse; keeps the last reply so button views can be pressed
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.done = False
+        self.content = None
+        self.embed = None
+        self.view = None
+        self.ephemeral = False
+
+    def is_done(self):
+        return self.done
+
+    async def reply(self, content=None, embed=None, view=None, ephemeral=False):
+        if self.done:
+            raise RuntimeError("This interaction has already been responded to before")
+        self.done = True
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.content = content
+        self.embed = embed
+        self.view = view
+        self.ephemeral = ephemeral
+
+    async def send_message(self, content=None, *, embed=None, view=None, ephemeral=False, **kwargs):
+        await self.reply(content, embed, view, ephemeral)
+
+    async def edit_message(self, *, content=None, embed=None, view=None, **kwargs):
+        await self.reply(content, embed, view)
+
+    async def defer(self, *, ephemeral=False, **kwargs):
+        await self.reply(ephemeral=ephemeral)
+
+class FakeInteraction:
+    def __init__(self, user, channel_id, guild=None, delay=0):
+        self.user = user
+        self.channel_id = channel_id
+        self.guild = guild
+        self.response = FakeResponse(delay)
+
+def total_money(bot, members):
+    # wallet plus bank over the given members; a member with no stored account counts its defaults
+    return sum(bot.users[str(member.id)]["balance"] + bot.users[str(member.id)]["bank_balance"] for member in members)
+
+async def invoke(command, interaction, *args, **kwargs):
+    # app_commands.Command keeps the undecorated coroutine (cooldown wrapper included) in .callback
+    await command.callback(interaction, *args, **kwargs)
+    return interaction.response
+
+async def press(view, item, interaction):
+    # discord.py runs the view's interaction_check before dispatching to the button
+    if await view.interaction_check(interaction):
+        await item.callback(interaction)
+    return interaction.response
@@ -4,24 +4,161 @@ from discord import app_commands
 import random
 import json
 import asyncio
+import contextlib
+import functools
+import heapq
+import math
 import os
+import sqlite3
 import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from typing import Optional
 
 ALLOWED_CHANNEL_ID = 0
+LOOTBOX_CHANNEL_IDS = [ALLOWED_CHANNEL_ID]
+LOOTBOX_INTERVAL = (30, 60)
+LOOTBOX_MAX_CLAIMERS = 3
+STORAGE_BACKEND = "sqlite" # "sqlite" or "json"
+USERS_FILE = "users.json"
+USERS_DB = "users.db"
+COOLDOWNS_FILE = "cooldowns.json"
+DURABILITY = "batched" # "batched" coalesces writes in the background, "immediate" writes on every command
+FLUSH_INTERVAL_MS = 500
+FLUSH_MAX_PENDING = 200
+BALTOP_PAGE_SIZE = 5
+BALTOP_CACHED_PAGES = 5
+BALTOP_CACHE_TTL = 30
+NAME_CACHE_SIZE = 10000
+NAME_CACHE_TTL = 3600
 
 intents = discord.Intents.default()
 intents.message_content = True
 
 activity = discord.Activity(type=discord.ActivityType.playing, name="Lorem Ipsum")
-client = discord.Client(intents=intents, activity=activity)
+
+class EconomyClient(discord.Client):
+    async def setup_hook(self):
+        global storage
+        storage = persistence.storage = open_storage()
+        load_users()
+        cooldowns.load()
+        persistence.start()
+        lootboxes.start()
+
+    async def close(self):
+        await lootboxes.stop()
+        await persistence.stop()
+        await super().close()
+
+client = EconomyClient(intents=intents, activity=activity)
 tree = app_commands.CommandTree(client)
 
-users = {}
-rob_cooldowns = {}
-coinflip_cooldowns = {}
-job_cooldowns = {}
-bank_cooldowns = {}
+class Account:
+    __slots__ = ('balance', 'bank_balance', 'job', 'xp', 'bank_space')
+
+    def __init__(self, balance=100, bank_balance=0, job=None, xp=0, bank_space=500):
+        self.balance = balance
+        self.bank_balance = bank_balance
+        self.job = job
+        self.xp = xp
+        self.bank_space = bank_space
+
+    # dict-style access so handlers can keep using user_data['balance']
+    def __getitem__(self, key):
+        if key not in Account.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in Account.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        if key not in Account.__slots__:
+            return default
+        return getattr(self, key)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in Account.__slots__}
+
+DEFAULT_ACCOUNT = Account()
+
+class VirtualAccount:
+    # stands in for an account that was never stored; it only joins the table once a field diverges
+    __slots__ = ('table', 'user_id', 'account')
+
+    def __init__(self, table, user_id):
+        self.table = table
+        self.user_id = user_id
+        self.account = None
+
+    def __getitem__(self, key):
+        return (self.account or DEFAULT_ACCOUNT)[key]
+
+    def __setitem__(self, key, value):
+        if self.account is None:
+            if value == DEFAULT_ACCOUNT[key]:
+                return
+            self.account = self.table.materialize(self.user_id)
+        self.account[key] = value
+
+    def get(self, key, default=None):
+        return (self.account or DEFAULT_ACCOUNT).get(key, default)
+
+class AccountTable:
+    # accounts keyed by integer snowflake; accepts and yields the old string ids.
+    # looking up an unknown id gives a VirtualAccount with the defaults instead of raising
+    def __init__(self, records=None):
+        self.accounts = {}
+        for user_id, data in (records or {}).items():
+            self[user_id] = data
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def __contains__(self, user_id):
+        return int(user_id) in self.accounts
+
+    def __getitem__(self, user_id):
+        account = self.accounts.get(int(user_id))
+        if account is None:
+            return VirtualAccount(self, int(user_id))
+        return account
+
+    def __setitem__(self, user_id, account):
+        if not isinstance(account, Account):
+            account = Account(**account)
+        self.accounts[int(user_id)] = account
+
+    def materialize(self, user_id):
+        account = self.accounts.get(user_id)
+        if account is None:
+            account = self.accounts[user_id] = Account()
+        return account
+
+    def __delitem__(self, user_id):
+        del self.accounts[int(user_id)]
+
+    def __iter__(self):
+        return (str(user_id) for user_id in self.accounts)
+
+    def items(self):
+        return ((str(user_id), account) for user_id, account in self.accounts.items())
+
+    def to_dict(self):
+        return {str(user_id): account.to_dict() for user_id, account in self.accounts.items()}
+
+users = AccountTable()
+
+COOLDOWNS = {
+    "rob": 60,
+    "coinflip": 30,
+    "work": 3600,
+    "bank": 30
+}
+PERSISTENT_COOLDOWNS = {"work"}
 
 JOBS = {
     "Peasant": {"salary": 50, "xp_required": 0},
@@ -30,35 +167,527 @@ JOBS = {
     "Noble": {"salary": 500, "xp_required": 250}
 }
 
-def save_users():
-    with open('users.json', 'w') as f:
-        json.dump(users, f)
+def write_atomic(path, payload):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class JSONStorage:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return AccountTable(json.load(f))
+        except FileNotFoundError:
+            return AccountTable()
+
+    def snapshot(self, users, user_ids):
+        # the json file can only be rewritten as a whole; only the plain rows are copied on the event
+        # loop, the encoding is left to write() in the flusher's thread
+        return [(user_id, account.balance, account.bank_balance, account.job, account.xp, account.bank_space)
+                for user_id, account in users.accounts.items()]
+
+    def write(self, rows):
+        write_atomic(self.path, json.dumps({str(row[0]): dict(zip(Account.__slots__, row[1:])) for row in rows}))
+
+class SQLiteStorage:
+    def __init__(self, path):
+        # writes are serialized by the flusher, which runs them off the event loop
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL" if DURABILITY == "immediate" else "PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id INTEGER PRIMARY KEY, "
+            "balance INTEGER NOT NULL, "
+            "bank_balance INTEGER NOT NULL, "
+            "job TEXT, "
+            "xp INTEGER NOT NULL, "
+            "bank_space INTEGER NOT NULL)"
+        )
+        self.conn.commit()
+
+    def load(self):
+        users = AccountTable()
+        for user_id, balance, bank_balance, job, xp, bank_space in self.conn.execute("SELECT * FROM users"):
+            users.accounts[user_id] = Account(balance, bank_balance, job, xp, bank_space)
+        return users
+
+    def snapshot(self, users, user_ids):
+        rows = []
+        for user_id in user_ids:
+            data = users[user_id]
+            rows.append((int(user_id), data["balance"], data["bank_balance"], data["job"], data["xp"], data["bank_space"]))
+        return rows
+
+    def write(self, rows):
+        # one transaction per batch, so both sides of a transfer land together
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO users (user_id, balance, bank_balance, job, xp, bank_space) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET balance=excluded.balance, bank_balance=excluded.bank_balance, "
+                "job=excluded.job, xp=excluded.xp, bank_space=excluded.bank_space",
+                rows
+            )
+
+    def import_json(self, path):
+        if self.conn.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+            return 0
+        legacy = JSONStorage(path).load()
+        if not legacy:
+            return 0
+        self.write(self.snapshot(legacy, list(legacy)))
+        return len(legacy)
+
+def open_storage():
+    if STORAGE_BACKEND == "sqlite":
+        sqlite_storage = SQLiteStorage(USERS_DB)
+        imported = sqlite_storage.import_json(USERS_FILE)
+        if imported:
+            print(f'Imported {imported} users from {USERS_FILE} into {USERS_DB}.')
+        return sqlite_storage
+    return JSONStorage(USERS_FILE)
+
+class WriteBehind:
+    def __init__(self, storage):
+        self.storage = storage
+        self.dirty = set()
+        self.pending = 0
+        self.wakeup = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.stopping = False
+        self.stats = {
+            "flushes": 0,
+            "mutations": 0,
+            "records_flushed": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0
+        }
+
+    def mark_dirty(self, user_ids):
+        self.dirty.update(user_ids)
+        self.pending += 1
+        self.stats["mutations"] += 1
+        if self.pending >= FLUSH_MAX_PENDING:
+            self.wakeup.set()
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            # let the flusher finish its current batch and exit rather than cancelling it mid-write
+            self.stopping = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+            self.stopping = False
+        await self.flush()
+        await cooldowns.save()
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), FLUSH_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+                await cooldowns.save()
+            except Exception as e:
+                print(f'Failed to flush users: {e}')
+
+    async def flush(self):
+        async with self.lock:
+            if not self.dirty:
+                return
+            user_ids, self.dirty = self.dirty, set()
+            self.pending = 0
+            payload = self.storage.snapshot(users, user_ids)
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.storage.write, payload)
+            except Exception:
+                self.dirty |= user_ids
+                raise
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.stats["flushes"] += 1
+            self.stats["records_flushed"] += len(user_ids)
+            self.stats["last_batch_size"] = len(user_ids)
+            self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(user_ids))
+            self.stats["last_flush_ms"] = elapsed_ms
+            self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], elapsed_ms)
+            self.stats["total_flush_ms"] += elapsed_ms
+
+class SkipNode:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        # width[i] is how many entries next[i] is ahead of this node
+        self.width = [1] * level
+
+class SkipList:
+    MAX_LEVEL = 32
+
+    def __init__(self):
+        self.head = SkipNode(None, self.MAX_LEVEL)
+        self.level = 1
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def random_level(self):
+        level = 1
+        while level < self.MAX_LEVEL and random.getrandbits(1):
+            level += 1
+        return level
+
+    def insert(self, key):
+        update = [self.head] * self.MAX_LEVEL
+        positions = [0] * self.MAX_LEVEL
+        node = self.head
+        position = 0
+        for i in reversed(range(self.level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                position += node.width[i]
+                node = node.next[i]
+            update[i] = node
+            positions[i] = position
+
+        level = self.random_level()
+        self.level = max(self.level, level)
+        new_node = SkipNode(key, level)
+        for i in range(level):
+            prev = update[i]
+            new_node.next[i] = prev.next[i]
+            new_node.width[i] = prev.width[i] + positions[i] - position
+            prev.next[i] = new_node
+            prev.width[i] = position + 1 - positions[i]
+        for i in range(level, self.level):
+            update[i].width[i] += 1
+        self.size += 1
+
+    def remove(self, key):
+        update = [self.head] * self.MAX_LEVEL
+        node = self.head
+        for i in reversed(range(self.level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for i in range(self.level):
+            if update[i].next[i] is target:
+                update[i].width[i] += target.width[i] - 1
+                update[i].next[i] = target.next[i]
+            else:
+                update[i].width[i] -= 1
+        self.size -= 1
+
+    def index(self, key):
+        node = self.head
+        position = 0
+        for i in reversed(range(self.level)):
+            while node.next[i] is not None and node.next[i].key < key:
+                position += node.width[i]
+                node = node.next[i]
+        if node.next[0] is None or node.next[0].key != key:
+            raise KeyError(key)
+        return position
+
+    def slice(self, start, count):
+        node = self.head
+        position = 0
+        for i in reversed(range(self.level)):
+            while node.next[i] is not None and position + node.width[i] <= start:
+                position += node.width[i]
+                node = node.next[i]
+        keys = []
+        node = node.next[0]
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+class Leaderboard:
+    def __init__(self, watched=0):
+        self.ranking = SkipList()
+        self.keys = {}
+        # bumped whenever one of the top `watched` entries changes
+        self.watched = watched
+        self.version = 0
+
+    def __len__(self):
+        return len(self.ranking)
+
+    def update(self, user_id, data):
+        # richest first, ties broken by the older (smaller) snowflake
+        key = (-(data["balance"] + data.get("bank_balance", 0)), int(user_id))
+        old_key = self.keys.get(user_id)
+        if old_key is not None:
+            if self.watched and self.ranking.index(old_key) < self.watched:
+                self.version += 1
+            if old_key == key:
+                return
+            self.ranking.remove(old_key)
+        self.ranking.insert(key)
+        self.keys[user_id] = key
+        if self.watched and self.ranking.index(key) < self.watched:
+            self.version += 1
+
+    def rebuild(self, users):
+        self.ranking = SkipList()
+        self.keys = {}
+        for user_id, data in users.items():
+            self.update(user_id, data)
+        self.version += 1
+
+    def rank(self, user_id):
+        key = self.keys.get(user_id)
+        if key is None:
+            return None
+        return self.ranking.index(key) + 1
+
+    def page(self, start, count):
+        return [(str(user_id), -wealth) for wealth, user_id in self.ranking.slice(start, count)]
+
+class NameCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, user_id):
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        name, expires = entry
+        if expires < time.monotonic():
+            del self.entries[user_id]
+            return None
+        self.entries.move_to_end(user_id)
+        return name
+
+    def put(self, user_id, name):
+        self.entries[user_id] = (name, time.monotonic() + self.ttl)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def resolve(self, user_ids, guild=None):
+        names = {}
+        missing = []
+        for user_id in user_ids:
+            user = (guild and guild.get_member(int(user_id))) or client.get_user(int(user_id))
+            if user is not None:
+                names[user_id] = user.name
+                continue
+            name = self.get(user_id)
+            if name is not None:
+                names[user_id] = name
+                continue
+            missing.append(user_id)
+
+        results = await asyncio.gather(*(client.fetch_user(int(user_id)) for user_id in missing), return_exceptions=True)
+        for user_id, result in zip(missing, results):
+            if isinstance(result, Exception):
+                names[user_id] = f"Unknown user ({user_id})"
+            else:
+                names[user_id] = result.name
+                self.put(user_id, result.name)
+        return names
+
+class UserLocks:
+    def __init__(self):
+        # user_id -> [lock, holders]; dropped once nobody holds or waits on it
+        self.locks = {}
+        self.stats = {
+            "acquisitions": 0,
+            "contended": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0
+        }
+
+    @contextlib.asynccontextmanager
+    async def hold(self, *user_ids):
+        # always lock in id order so two-party commands can't deadlock each other
+        keys = sorted({str(user_id) for user_id in user_ids}, key=int)
+        entries = []
+        for key in keys:
+            entry = self.locks.get(key)
+            if entry is None:
+                entry = self.locks[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            entries.append((key, entry))
+
+        acquired = []
+        try:
+            start = time.perf_counter()
+            contended = False
+            for key, entry in entries:
+                if entry[0].locked():
+                    contended = True
+                await entry[0].acquire()
+                acquired.append(entry[0])
+            wait_ms = (time.perf_counter() - start) * 1000
+            self.stats["acquisitions"] += 1
+            if contended:
+                self.stats["contended"] += 1
+            self.stats["total_wait_ms"] += wait_ms
+            self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], wait_ms)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            for key, entry in entries:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.locks[key]
+
+class Cooldowns:
+    def __init__(self, path, persistent=()):
+        self.path = path
+        self.persistent = set(persistent)
+        self.expiries = {}
+        # min-heap of (expiry, bucket, user_id); entries made stale by a re-trigger are skipped on pop
+        self.heap = []
+        self.running = set()
+        self.dirty = False
+
+    def __len__(self):
+        self.evict()
+        return len(self.expiries)
+
+    def evict(self):
+        now = time.time()
+        while self.heap and self.heap[0][0] <= now:
+            expiry, bucket, user_id = heapq.heappop(self.heap)
+            if self.expiries.get((bucket, user_id)) == expiry:
+                del self.expiries[(bucket, user_id)]
+
+    def remaining(self, bucket, user_id):
+        self.evict()
+        expiry = self.expiries.get((bucket, user_id))
+        if expiry is None:
+            return 0
+        return max(0, expiry - time.time())
+
+    def trigger(self, bucket, user_id, seconds=None):
+        expiry = time.time() + (COOLDOWNS[bucket] if seconds is None else seconds)
+        self.expiries[(bucket, user_id)] = expiry
+        heapq.heappush(self.heap, (expiry, bucket, user_id))
+        if bucket in self.persistent:
+            self.dirty = True
+        self.evict()
+        if len(self.heap) > 2 * len(self.expiries) + 64:
+            self.heap = [(expiry, bucket, user_id) for (bucket, user_id), expiry in self.expiries.items()]
+            heapq.heapify(self.heap)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        now = time.time()
+        for bucket, entries in saved.items():
+            for user_id, expiry in entries.items():
+                if expiry > now:
+                    self.expiries[(bucket, user_id)] = expiry
+                    self.heap.append((expiry, bucket, user_id))
+        heapq.heapify(self.heap)
+
+    async def save(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        self.evict()
+        saved = {bucket: {} for bucket in self.persistent}
+        for (bucket, user_id), expiry in self.expiries.items():
+            if bucket in self.persistent:
+                saved[bucket][user_id] = expiry
+        try:
+            await asyncio.to_thread(write_atomic, self.path, json.dumps(saved))
+        except Exception:
+            self.dirty = True
+            raise
+
+def format_cooldown(seconds):
+    seconds = int(seconds)
+    hours, minutes, seconds = seconds // 3600, (seconds % 3600) // 60, seconds % 60
+    if hours:
+        return f"{hours}h {minutes}m {seconds}s"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+def cooldown(bucket, message="You are on cooldown."):
+    # the handler calls cooldowns.trigger() once the action went through;
+    # a second invocation while the first is still running counts as on cooldown.
+    # the channel check runs first, so the handler itself doesn't repeat it
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(interaction: discord.Interaction, *args, **kwargs):
+            if not await check_channel(interaction):
+                return
+            user_id = str(interaction.user.id)
+            remaining = cooldowns.remaining(bucket, user_id)
+            if remaining > 0 or (bucket, user_id) in cooldowns.running:
+                await interaction.response.send_message(message.format(time=format_cooldown(remaining or COOLDOWNS[bucket])), ephemeral=True)
+                return
+            cooldowns.running.add((bucket, user_id))
+            try:
+                return await func(interaction, *args, **kwargs)
+            finally:
+                cooldowns.running.discard((bucket, user_id))
+        return wrapper
+    return decorator
+
+storage = None # opened in setup_hook, so importing the module touches no files
+cooldowns = Cooldowns(COOLDOWNS_FILE, PERSISTENT_COOLDOWNS)
+persistence = WriteBehind(storage)
+user_locks = UserLocks()
+leaderboard = Leaderboard(watched=BALTOP_PAGE_SIZE * BALTOP_CACHED_PAGES)
+name_cache = NameCache(NAME_CACHE_SIZE, NAME_CACHE_TTL)
+baltop_cache = {}
+
+def save_users(*user_ids):
+    # accounts still on their defaults are virtual and have nothing to persist
+    user_ids = [user_id for user_id in user_ids if user_id in users] if user_ids else list(users)
+    if not user_ids:
+        return
+    for user_id in user_ids:
+        leaderboard.update(user_id, users[user_id])
+    if DURABILITY == "immediate":
+        storage.write(storage.snapshot(users, user_ids))
+    else:
+        persistence.mark_dirty(user_ids)
 
 def load_users():
     global users
-    try:
-        with open('users.json', 'r') as f:
-            users = json.load(f)
-    except FileNotFoundError:
-        users = {}
-
-def initialize_user(user_id):
-    if str(user_id) not in users:
-        users[str(user_id)] = {
-            "balance": 100,
-            "bank_balance": 0,
-            "job": None,
-            "xp": 0,
-            "bank_space": 500
-        }
-        save_users()
+    users = storage.load()
+    leaderboard.rebuild(users)
 
 @client.event
 async def on_ready():
     await tree.sync()
     print(f'Logged in as {client.user}!')
-    load_users()
-    client.loop.create_task(lootbox_loop())
 
 async def check_channel(interaction: discord.Interaction) -> bool:
     if interaction.channel_id != ALLOWED_CHANNEL_ID:
@@ -72,7 +701,6 @@ async def bal(interaction: discord.Interaction):
         return
 
     user_id = str(interaction.user.id)
-    initialize_user(user_id)
 
     user_data = users[user_id]
     embed = discord.Embed(title=f"{interaction.user.name}'s Financial Status", color=discord.Color.green())
@@ -91,28 +719,27 @@ async def deposit(interaction: discord.Interaction, amount: int):
         return
 
     user_id = str(interaction.user.id)
-    initialize_user(user_id)
-
-    user_data = users[user_id]
+    async with user_locks.hold(user_id):
+        user_data = users[user_id]
 
-    if amount <= 0:
-        await interaction.response.send_message("You must deposit a positive amount.", ephemeral=True)
-        return
+        if amount <= 0:
+            await interaction.response.send_message("You must deposit a positive amount.", ephemeral=True)
+            return
 
-    if amount > user_data['balance']:
-        await interaction.response.send_message("You don't have enough francs in your wallet.", ephemeral=True)
-        return
+        if amount > user_data['balance']:
+            await interaction.response.send_message("You don't have enough francs in your wallet.", ephemeral=True)
+            return
 
-    total_bank_balance = user_data['bank_balance'] + amount
-    if total_bank_balance > user_data['bank_space']:
-        await interaction.response.send_message(f"Your deposit would exceed your bank capacity of {user_data['bank_space']} francs.", ephemeral=True)
-        return
+        total_bank_balance = user_data['bank_balance'] + amount
+        if total_bank_balance > user_data['bank_space']:
+            await interaction.response.send_message(f"Your deposit would exceed your bank capacity of {user_data['bank_space']} francs.", ephemeral=True)
+            return
 
-    user_data['balance'] -= amount
-    user_data['bank_balance'] += amount
-    save_users()
+        user_data['balance'] -= amount
+        user_data['bank_balance'] += amount
+        save_users(user_id)
 
-    await interaction.response.send_message(f"Deposited {amount} francs. Bank balance: {user_data['bank_balance']} francs.")
+        await interaction.response.send_message(f"Deposited {amount} francs. Bank balance: {user_data['bank_balance']} francs.")
 
 @tree.command(name="withdraw", description="Withdraw money from your bank.")
 async def withdraw(interaction: discord.Interaction, amount: int):
@@ -120,40 +747,30 @@ async def withdraw(interaction: discord.Interaction, amount: int):
         return
 
     user_id = str(interaction.user.id)
-    initialize_user(user_id)
-
-    user_data = users[user_id]
-
-    if amount <= 0:
-        await interaction.response.send_message("You must withdraw a positive amount.", ephemeral=True)
-        return
-
-    if amount > user_data['bank_balance']:
-        await interaction.response.send_message("You don't have enough francs in your bank.", ephemeral=True)
-        return
-
-    user_data['balance'] += amount
-    user_data['bank_balance'] -= amount
-    save_users()
+    async with user_locks.hold(user_id):
+        user_data = users[user_id]
 
-    await interaction.response.send_message(f"Withdrew {amount} francs. Wallet balance: {user_data['balance']} francs.")
+        if amount <= 0:
+            await interaction.response.send_message("You must withdraw a positive amount.", ephemeral=True)
+            return
 
-    @tree.command(name="slots", description="Play the slot machine!")
-    async def slots(interaction: discord.Interaction, bet: int):
-        if not await check_channel(interaction):
+        if amount > user_data['bank_balance']:
+            await interaction.response.send_message("You don't have enough francs in your bank.", ephemeral=True)
             return
 
-        user_id = str(interaction.user.id)
-        initialize_user(user_id)
+        user_data['balance'] += amount
+        user_data['bank_balance'] -= amount
+        save_users(user_id)
 
+        await interaction.response.send_message(f"Withdrew {amount} francs. Wallet balance: {user_data['balance']} francs.")
+
+@tree.command(name="slots", description="Play the slot machine!")
+@cooldown("bank", "Hold your horses! Wait {time} before spinning again.")
+async def slots(interaction: discord.Interaction, bet: int):
+    user_id = str(interaction.user.id)
+    async with user_locks.hold(user_id):
         user_data = users[user_id]
 
-        current_time = asyncio.get_event_loop().time()
-        if user_id in bank_cooldowns and bank_cooldowns[user_id] > current_time:
-            remaining_time = int(bank_cooldowns[user_id] - current_time)
-            seconds = remaining_time % 60
-            await interaction.response.send_message(f"Hold your horses! Wait {seconds}s before spinning again.", ephemeral=True)
-            return
         if bet <= 0:
             await interaction.response.send_message("Listen here, you got to bet more than zero!", ephemeral=True)
             return
@@ -175,9 +792,9 @@ async def withdraw(interaction: discord.Interaction, amount: int):
             result_message = f"😢 No match. Lost {bet} francs. Better luck next time!"
 
         user_data['balance'] += winnings
-        save_users()
+        save_users(user_id)
 
-        bank_cooldowns[user_id] = current_time + 30
+        cooldowns.trigger("bank", user_id)
 
         embed = discord.Embed(title="🎰 Slot Machine 🎰", color=discord.Color.gold())
         embed.description = f"{spin_results[0]} | {spin_results[1]} | {spin_results[2]}\n\n{result_message}"
@@ -185,29 +802,22 @@ async def withdraw(interaction: discord.Interaction, amount: int):
         await interaction.response.send_message(embed=embed)
 
 @tree.command(name="blackjack", description="Play a game of Blackjack!")
+@cooldown("bank", "Hold your horses! Wait {time} before playing again.")
 async def blackjack(interaction: discord.Interaction, bet: int):
-    if not await check_channel(interaction):
-        return
-
     user_id = str(interaction.user.id)
-    initialize_user(user_id)
-
-    user_data = users[user_id]
-
-    current_time = asyncio.get_event_loop().time()
-    if user_id in bank_cooldowns and bank_cooldowns[user_id] > current_time:
-        remaining_time = int(bank_cooldowns[user_id] - current_time)
-        seconds = remaining_time % 60
-        await interaction.response.send_message(f"Hold your horses! Wait {seconds}s before playing again.", ephemeral=True)
-        return
 
     if bet <= 0:
         await interaction.response.send_message("Listen here, you must bet more than zero!", ephemeral=True)
         return
 
-    if bet > user_data['balance']:
-        await interaction.response.send_message("Well, well... looks like your wallet's lighter than a feather!", ephemeral=True)
-        return
+    async with user_locks.hold(user_id):
+        # the bet is held back for as long as the game runs, so it can't be spent or staked twice
+        user_data = users[user_id]
+        if bet > user_data['balance']:
+            await interaction.response.send_message("Well, well... looks like your wallet's lighter than a feather!", ephemeral=True)
+            return
+        user_data['balance'] -= bet
+        save_users(user_id)
 
     cards = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
     card_values = {'2': 2, '3': 3, '4': 4, '5': 5, '6': 6, '7': 7, '8': 8, '9': 9, '10': 10, 'J': 10, 'Q': 10, 'K': 10, 'A': 11}
@@ -282,15 +892,26 @@ async def blackjack(interaction: discord.Interaction, bet: int):
                 winnings = -self.bet
             else:
                 winnings = 0
-            user_data = users[self.user_id]
-            user_data['balance'] += winnings
-            save_users()
-            bank_cooldowns[self.user_id] = asyncio.get_event_loop().time() + 30
+            await self.pay_out(self.bet + winnings)
+            cooldowns.trigger("bank", self.user_id)
             embed = create_blackjack_embed(self.player_hand, self.dealer_hand, True)
             embed.description = f"{message}\n\n{'Won' if winnings > 0 else 'Lost' if winnings < 0 else 'Pushed'} {abs(winnings)} francs."
 
             await interaction.response.edit_message(embed=embed, view=self)
 
+        async def pay_out(self, amount):
+            if amount == 0:
+                return
+            async with user_locks.hold(self.user_id):
+                users[self.user_id]['balance'] += amount
+                save_users(self.user_id)
+
+        async def on_timeout(self):
+            # an abandoned game gives the bet back, as it did before the bet was held
+            if not self.game_over:
+                self.game_over = True
+                await self.pay_out(self.bet)
+
     def create_blackjack_embed(player_hand, dealer_hand, game_over):
         embed = discord.Embed(title="🃏 Blackjack 🃏", color=discord.Color.blue())
 
@@ -321,38 +942,26 @@ async def blackjack(interaction: discord.Interaction, bet: int):
     await interaction.response.send_message(embed=embed, view=view)
 
 @tree.command(name="work", description="Work at your current job to earn money and gain XP.")
+@cooldown("work", "You're tired from your last shift. Wait {time} before working again.")
 async def work(interaction: discord.Interaction):
-    if not await check_channel(interaction):
-        return
-
     user_id = str(interaction.user.id)
-    initialize_user(user_id)
-
-    user_data = users[user_id]
+    async with user_locks.hold(user_id):
+        user_data = users[user_id]
 
-    if not user_data['job']:
-        await interaction.response.send_message("You need to get a job first! Use /jobs to see available jobs.", ephemeral=True)
-        return
-    current_time = asyncio.get_event_loop().time()
-    if user_id in job_cooldowns and job_cooldowns[user_id] > current_time:
-        remaining_time = int(job_cooldowns[user_id] - current_time)
-        hours = remaining_time // 3600
-        minutes = (remaining_time % 3600) // 60
-        seconds = remaining_time % 60
-
-        await interaction.response.send_message(f"You're tired from your last shift. Wait {hours}h {minutes}m {seconds}s before working again.", ephemeral=True)
-        return
+        if not user_data['job']:
+            await interaction.response.send_message("You need to get a job first! Use /jobs to see available jobs.", ephemeral=True)
+            return
 
-    job_details = JOBS[user_data['job']]
-    salary = job_details['salary']
+        job_details = JOBS[user_data['job']]
+        salary = job_details['salary']
 
-    user_data['balance'] += salary
-    user_data['xp'] += 10
-    job_cooldowns[user_id] = current_time + 3600
+        user_data['balance'] += salary
+        user_data['xp'] += 10
+        cooldowns.trigger("work", user_id)
 
-    save_users()
+        save_users(user_id)
 
-    await interaction.response.send_message(f"You worked as a {user_data['job']} and earned {salary} francs!")
+        await interaction.response.send_message(f"You worked as a {user_data['job']} and earned {salary} francs!")
 
 @tree.command(name="jobs", description="View available jobs and their requirements.")
 async def jobs(interaction: discord.Interaction):
@@ -360,7 +969,6 @@ async def jobs(interaction: discord.Interaction):
         return
 
     user_id = str(interaction.user.id)
-    initialize_user(user_id)
 
     user_data = users[user_id]
 
@@ -384,23 +992,22 @@ async def setjob(interaction: discord.Interaction, job: str):
         return
 
     user_id = str(interaction.user.id)
-    initialize_user(user_id)
-
-    user_data = users[user_id]
+    async with user_locks.hold(user_id):
+        user_data = users[user_id]
 
-    job = job.capitalize()
-    if job not in JOBS:
-        await interaction.response.send_message("Invalid job. Use /jobs to see available jobs.", ephemeral=True)
-        return
+        job = job.capitalize()
+        if job not in JOBS:
+            await interaction.response.send_message("Invalid job. Use /jobs to see available jobs.", ephemeral=True)
+            return
 
-    if user_data['xp'] < JOBS[job]['xp_required']:
-        await interaction.response.send_message(f"You don't have enough XP to become a {job}.", ephemeral=True)
-        return
+        if user_data['xp'] < JOBS[job]['xp_required']:
+            await interaction.response.send_message(f"You don't have enough XP to become a {job}.", ephemeral=True)
+            return
 
-    user_data['job'] = job
-    save_users()
+        user_data['job'] = job
+        save_users(user_id)
 
-    await interaction.response.send_message(f"You are now working as a {job}!")
+        await interaction.response.send_message(f"You are now working as a {job}!")
 
 @tree.command(name="transfer", description="Transfer money to another user.")
 async def transfer(interaction: discord.Interaction, recipient: discord.Member, amount: int):
@@ -410,81 +1017,105 @@ async def transfer(interaction: discord.Interaction, recipient: discord.Member,
     sender_id = str(interaction.user.id)
     recipient_id = str(recipient.id)
 
-    initialize_user(sender_id)
-    initialize_user(recipient_id)
-
-    if interaction.user == recipient:
-        await interaction.response.send_message("You cannot transfer money to yourself!", ephemeral=True)
-        return
+    async with user_locks.hold(sender_id, recipient_id):
+        if interaction.user == recipient:
+            await interaction.response.send_message("You cannot transfer money to yourself!", ephemeral=True)
+            return
 
-    if amount <= 0:
-        await interaction.response.send_message("Transfer amount must be positive.", ephemeral=True)
-        return
+        if amount <= 0:
+            await interaction.response.send_message("Transfer amount must be positive.", ephemeral=True)
+            return
 
-    sender_data = users[sender_id]
+        sender_data = users[sender_id]
 
-    if amount > sender_data['balance']:
-        await interaction.response.send_message("You don't have enough francs to transfer.", ephemeral=True)
-        return
+        if amount > sender_data['balance']:
+            await interaction.response.send_message("You don't have enough francs to transfer.", ephemeral=True)
+            return
 
-    sender_data['balance'] -= amount
-    users[recipient_id]['balance'] += amount
+        sender_data['balance'] -= amount
+        users[recipient_id]['balance'] += amount
 
-    save_users()
+        save_users(sender_id, recipient_id)
 
-    await interaction.response.send_message(f"Transferred {amount} francs to {recipient.mention}.")
+        await interaction.response.send_message(f"Transferred {amount} francs to {recipient.mention}.")
 
-@tree.command(name="baltop", description="Show the top 5 richest users.")
-async def baltop(interaction: discord.Interaction):
+@tree.command(name="baltop", description="Show the richest users.")
+async def baltop(interaction: discord.Interaction, page: int = 1):
     if not await check_channel(interaction):
         return
 
-    top_users = sorted(users.items(), key=lambda x: x[1]["balance"] + x[1].get("bank_balance", 0), reverse=True)[:5]
+    total_pages = max(1, math.ceil(len(leaderboard) / BALTOP_PAGE_SIZE))
+    if page < 1 or page > total_pages:
+        await interaction.response.send_message(f"Invalid page. Please pick a page between 1 and {total_pages}.", ephemeral=True)
+        return
+
+    cached = baltop_cache.get(page)
+    if cached is not None:
+        cached_version, cached_pages, expires, embed = cached
+        if cached_version == leaderboard.version and cached_pages == total_pages and expires > time.monotonic():
+            await interaction.response.send_message(embed=embed)
+            return
+
+    version = leaderboard.version
+    start = (page - 1) * BALTOP_PAGE_SIZE
+    top_users = leaderboard.page(start, BALTOP_PAGE_SIZE)
+    names = await name_cache.resolve([user_id for user_id, _ in top_users], interaction.guild)
+
+    embed = discord.Embed(title="Richest Users", color=discord.Color.gold())
+    for position, (user_id, total_wealth) in enumerate(top_users, start=start + 1):
+        data = users[user_id]
+        embed.add_field(name=f"#{position} {names[user_id]}", value=f"Total: {total_wealth} francs (Wallet: {data['balance']}, Bank: {data.get('bank_balance', 0)})", inline=False)
+    embed.set_footer(text=f"Page {page}/{total_pages}")
 
-    embed = discord.Embed(title="Top 5 Richest Users", color=discord.Color.gold())
-    for user_id, data in top_users:
-        user = await client.fetch_user(int(user_id))
-        total_wealth = data["balance"] + data.get("bank_balance", 0)
-        embed.add_field(name=user.name, value=f"Total: {total_wealth} francs (Wallet: {data['balance']}, Bank: {data.get('bank_balance', 0)})", inline=False)
+    if page <= BALTOP_CACHED_PAGES:
+        baltop_cache[page] = (version, total_pages, time.monotonic() + BALTOP_CACHE_TTL, embed)
 
     await interaction.response.send_message(embed=embed)
 
-@tree.command(name="coinflip", description="Bet an amount of francs and flip a coin.")
-async def coinflip(interaction: discord.Interaction, amount: int):
+@tree.command(name="rank", description="Show your position on the leaderboard.")
+async def rank(interaction: discord.Interaction, member: Optional[discord.Member] = None):
     if not await check_channel(interaction):
         return
 
-    user_id = str(interaction.user.id)
-    initialize_user(user_id)
+    member = member or interaction.user
+    user_id = str(member.id)
+    position = leaderboard.rank(user_id)
 
-    if amount <= 0:
-        await interaction.response.send_message("You must bet a positive amount.", ephemeral=True)
+    if position is None:
+        await interaction.response.send_message(f"{member.display_name} is not on the leaderboard yet.", ephemeral=True)
         return
 
-    if users[user_id]["balance"] < amount:
-        await interaction.response.send_message("You don't have enough francs to make this bet.", ephemeral=True)
-        return
+    data = users[user_id]
+    total_wealth = data["balance"] + data.get("bank_balance", 0)
+    await interaction.response.send_message(f"{member.display_name} is ranked #{position} of {len(leaderboard)} with {total_wealth} francs.")
 
-    if user_id in coinflip_cooldowns and coinflip_cooldowns[user_id] > asyncio.get_event_loop().time():
-        await interaction.response.send_message("You are on cooldown.", ephemeral=True)
-        return
+@tree.command(name="coinflip", description="Bet an amount of francs and flip a coin.")
+@cooldown("coinflip")
+async def coinflip(interaction: discord.Interaction, amount: int):
+    user_id = str(interaction.user.id)
+    async with user_locks.hold(user_id):
+        if amount <= 0:
+            await interaction.response.send_message("You must bet a positive amount.", ephemeral=True)
+            return
 
-    result = random.choice(['heads', 'tails'])
-    if result == 'heads':
-        users[user_id]["balance"] += amount
-        await interaction.response.send_message(f"🎉 You won {amount} francs!")
-    else:
-        users[user_id]["balance"] -= amount
-        await interaction.response.send_message(f"😢 You lost {amount} francs.")
+        if users[user_id]["balance"] < amount:
+            await interaction.response.send_message("You don't have enough francs to make this bet.", ephemeral=True)
+            return
+
+        result = random.choice(['heads', 'tails'])
+        if result == 'heads':
+            users[user_id]["balance"] += amount
+            await interaction.response.send_message(f"🎉 You won {amount} francs!")
+        else:
+            users[user_id]["balance"] -= amount
+            await interaction.response.send_message(f"😢 You lost {amount} francs.")
 
-    coinflip_cooldowns[user_id] = asyncio.get_event_loop().time() + 30
-    save_users()
+        cooldowns.trigger("coinflip", user_id)
+        save_users(user_id)
     
 @tree.command(name="rob", description="Rob another user for francs.")
+@cooldown("rob")
 async def rob(interaction: discord.Interaction, target: discord.Member):
-    if not await check_channel(interaction):
-        return
-
     if interaction.user == target:
         await interaction.response.send_message("You cannot rob yourself!", ephemeral=True)
         return
@@ -492,77 +1123,142 @@ async def rob(interaction: discord.Interaction, target: discord.Member):
     user_id = str(interaction.user.id)
     target_id = str(target.id)
 
-    initialize_user(user_id)
-    initialize_user(target_id)
+    async with user_locks.hold(user_id, target_id):
+        if random.randint(1, 100) <= 10:
+            stolen_amount = random.randint(30, 100)
+            stolen_amount = min(stolen_amount, users[target_id]["balance"])
 
-    if user_id in rob_cooldowns and rob_cooldowns[user_id] > asyncio.get_event_loop().time():
-        await interaction.response.send_message("You are on cooldown.", ephemeral=True)
-        return
-
-    if random.randint(1, 100) <= 10:
-        stolen_amount = random.randint(30, 100)
-        stolen_amount = min(stolen_amount, users[target_id]["balance"])
-
-        users[target_id]["balance"] -= stolen_amount
-        users[user_id]["balance"] += stolen_amount
-
-        await interaction.response.send_message(f"Successful robbery! You stole {stolen_amount} francs from {target.mention}.")
-    else:
-        loss = int(users[user_id]["balance"] * 0.10)
-        users[user_id]["balance"] -= loss
-        await interaction.response.send_message(f"Robbery failed! You lost {loss} francs.")
-
-    rob_cooldowns[user_id] = asyncio.get_event_loop().time() + 60
-    save_users()
-
-async def lootbox_loop():
-    while True:
-        await asyncio.sleep(random.randint(30, 60))
-        await spawn_lootbox()
-
-async def spawn_lootbox():
-    channel = client.get_channel(ALLOWED_CHANNEL_ID)
-    if channel is None:
-        return 
+            users[target_id]["balance"] -= stolen_amount
+            users[user_id]["balance"] += stolen_amount
 
-    lootbox_amount = random.randint(30, 100)
-    embed = discord.Embed(title="Lootbox Available!",
-                          description=f"Claim the lootbox to get {lootbox_amount} francs!",
-                          color=0xFFD700)
-
-    view = discord.ui.View()
-    button = discord.ui.Button(label="Claim", style=discord.ButtonStyle.primary)
-    view.add_item(button)
-
-    winners = set()
-
-    async def claim_button_callback(interaction: discord.Interaction):
+            await interaction.response.send_message(f"Successful robbery! You stole {stolen_amount} francs from {target.mention}.")
+        else:
+            loss = int(users[user_id]["balance"] * 0.10)
+            users[user_id]["balance"] -= loss
+            await interaction.response.send_message(f"Robbery failed! You lost {loss} francs.")
+
+        cooldowns.trigger("rob", user_id)
+        save_users(user_id, target_id)
+
+class Lootbox:
+    def __init__(self, amount):
+        self.amount = amount
+        self.winners = []
+        self.embed = discord.Embed(title="Lootbox Available!",
+                                   description=f"Claim the lootbox to get {amount} francs!",
+                                   color=0xFFD700)
+        self.view = discord.ui.View()
+        self.button = discord.ui.Button(label="Claim", style=discord.ButtonStyle.primary)
+        self.button.callback = self.claim
+        self.view.add_item(self.button)
+
+    async def claim(self, interaction: discord.Interaction):
         user_id = str(interaction.user.id)
-        initialize_user(user_id)
 
-        if user_id in winners:
+        # check and record the claim before the first await so the claimer cap can't be overrun
+        if user_id in self.winners:
             await interaction.response.send_message("You have already claimed this lootbox!", ephemeral=True)
             return
 
-        if len(winners) >= 3:
-            await interaction.response.send_message("The lootbox has already been claimed by 3 users.", ephemeral=True)
+        if len(self.winners) >= LOOTBOX_MAX_CLAIMERS:
+            await interaction.response.send_message(f"The lootbox has already been claimed by {LOOTBOX_MAX_CLAIMERS} users.", ephemeral=True)
             return
 
-        users[user_id]["balance"] += lootbox_amount
-        save_users()
-
-        winners.add(user_id)
-        winners_list = "\n".join(f"<@{user_id}>" for user_id in winners)
-        embed.description = f"Claim the lootbox to get {lootbox_amount} francs!\n\n**Winners so far:**\n{winners_list}"
-        await interaction.response.edit_message(embed=embed, view=view)
-
-        if len(winners) >= 3:
-            button.disabled = True
-            await interaction.edit_original_message(embed=embed, view=view)
+        self.winners.append(user_id)
+        if len(self.winners) >= LOOTBOX_MAX_CLAIMERS:
+            self.button.disabled = True
+
+        async with user_locks.hold(user_id):
+            users[user_id]["balance"] += self.amount
+            save_users(user_id)
+
+        winners_list = "\n".join(f"<@{winner_id}>" for winner_id in self.winners)
+        self.embed.description = f"Claim the lootbox to get {self.amount} francs!\n\n**Winners so far:**\n{winners_list}"
+        await interaction.response.edit_message(embed=self.embed, view=self.view)
+
+class LootboxScheduler:
+    def __init__(self, channel_ids):
+        self.channel_ids = set()
+        # min-heap of (next spawn time, channel_id) across every lootbox channel
+        self.deadlines = []
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.spawning = set()
+        for channel_id in channel_ids:
+            self.add_channel(channel_id)
+
+    def add_channel(self, channel_id):
+        if channel_id in self.channel_ids:
+            return
+        self.channel_ids.add(channel_id)
+        heapq.heappush(self.deadlines, (time.monotonic() + random.randint(*LOOTBOX_INTERVAL), channel_id))
+        self.wakeup.set()
+
+    def remove_channel(self, channel_id):
+        # its heap entry is dropped when it comes due
+        self.channel_ids.discard(channel_id)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.supervise())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def supervise(self):
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f'Lootbox scheduler failed, restarting: {e}')
+                await asyncio.sleep(5)
+
+    async def run(self):
+        await client.wait_until_ready()
+        while True:
+            self.wakeup.clear()
+            if not self.deadlines:
+                await self.wakeup.wait()
+                continue
+
+            deadline, channel_id = self.deadlines[0]
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self.deadlines)
+            if channel_id not in self.channel_ids:
+                continue
+            heapq.heappush(self.deadlines, (time.monotonic() + random.randint(*LOOTBOX_INTERVAL), channel_id))
+            task = asyncio.create_task(self.spawn(channel_id))
+            self.spawning.add(task)
+            task.add_done_callback(self.spawning.discard)
+
+    async def spawn(self, channel_id):
+        channel = client.get_channel(channel_id)
+        if channel is None:
+            return
 
-    button.callback = claim_button_callback
+        lootbox = Lootbox(random.randint(30, 100))
+        try:
+            await channel.send(embed=lootbox.embed, view=lootbox.view)
+        except discord.HTTPException as e:
+            print(f'Could not spawn a lootbox in {channel_id}: {e}')
 
-    await channel.send(embed=embed, view=view)
+lootboxes = LootboxScheduler(LOOTBOX_CHANNEL_IDS)
 
-token = os.environ['TOKEN']
-client.run(token)
+if __name__ == "__main__":
+    token = os.environ['TOKEN']
+    client.run(token)
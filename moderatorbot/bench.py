@@ -0,0 +1,648 @@
+import argparse
+import asyncio
+import aiohttp
+import json
+import logging
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from harness import FakeChannel, FakeGuild, FakeInteraction, FakeMember, FakeMessage, FakeReaction, FakeRole, invoke, load_bot
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def report(name, samples):
+    print(f"{name:<28}{len(samples):>8}{percentile(samples, 50):>10.3f}{percentile(samples, 99):>10.3f}{max(samples):>10.3f}")
+
+def report_header():
+    print(f"{'':<28}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+
+async def bench_whois(bot, args):
+    rng = random.Random(args.seed)
+    roles = [FakeRole(1000 + i) for i in range(20)]
+    members = [FakeMember(200000000000000000 + i, roles=rng.sample(roles, 3)) for i in range(args.members)]
+    guild = FakeGuild(members=members)
+    moderator = FakeMember(1, moderator=True)
+
+    warnings_data = {}
+    notes_data = {}
+    for member in members:
+        warnings_data[str(member.id)] = [f"spam in #general | <t:{1700000000 + i}:R>" for i in range(rng.randint(1, 3))]
+        if rng.random() < 0.1:
+            notes_data[str(member.id)] = ["watch this one - mod#0"]
+    with open(bot.WARNINGS_FILE, "w") as f:
+        json.dump(warnings_data, f, indent=4)
+    with open(bot.NOTES_FILE, "w") as f:
+        json.dump(notes_data, f, indent=4)
+    bot.store.load()
+    bot.modlog.load()
+    # write out the imported legacy entries so they don't count towards the /warn flush below
+    await bot.modlog.flush()
+
+    before = []
+    uncached = []
+    cached = []
+    for _ in range(args.lookups):
+        member = rng.choice(members)
+
+        # what every /whois paid before the store: two full json parses, then the same embed
+        start = time.perf_counter()
+        bot.load_data(bot.WARNINGS_FILE)
+        bot.load_data(bot.NOTES_FILE)
+        bot.render_profile(guild, member)
+        before.append((time.perf_counter() - start) * 1000)
+
+        bot.profiles.invalidate(member.id)
+        start = time.perf_counter()
+        await invoke(bot.whois, FakeInteraction(moderator, guild), member)
+        uncached.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await invoke(bot.whois, FakeInteraction(moderator, guild), member)
+        cached.append((time.perf_counter() - start) * 1000)
+
+    print(f"/whois with {args.members} warned members")
+    report_header()
+    report("before (reload json files)", before)
+    report("in-memory store, rendered", uncached)
+    report("profile cache hit", cached)
+
+    # incident triage: a handful of members looked up over and over while they keep getting warned
+    hot = rng.sample(members, args.hot)
+    stats_before = dict(bot.profiles.stats)
+    triage = []
+    for i in range(args.triage):
+        member = rng.choice(hot)
+        if i % 10 == 0:
+            await invoke(bot.warn, FakeInteraction(moderator, guild), member, "still at it")
+        start = time.perf_counter()
+        response = await invoke(bot.whois, FakeInteraction(moderator, guild), member)
+        triage.append((time.perf_counter() - start) * 1000)
+        if i % 10 == 0 and "still at it" not in response.embed.fields[3].value:
+            print("STALE embed served after /warn")
+    report("triage", triage)
+    hits = bot.profiles.stats["hits"] - stats_before["hits"]
+    misses = bot.profiles.stats["misses"] - stats_before["misses"]
+    print(f"triage over {args.hot} members: {hits} hits, {misses} misses, {bot.profiles.stats['invalidations'] - stats_before['invalidations']} invalidations")
+    print()
+
+    start = time.perf_counter()
+    for member in members[:args.lookups]:
+        await invoke(bot.warn, FakeInteraction(moderator, guild), member, "benchmark")
+    warn_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    await bot.modlog.flush()
+    flush_ms = (time.perf_counter() - start) * 1000
+    print(f"{args.lookups} /warn calls took {warn_ms:.1f} ms on the loop; appending them to the log took {flush_ms:.1f} ms")
+
+def random_word(rng):
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 10)))
+
+async def bench_automod(bot, args):
+    rng = random.Random(args.seed)
+    banned = list({random_word(rng) for _ in range(args.words)})
+    with open(bot.BANNED_WORDS, "w") as f:
+        json.dump(banned, f)
+    start = time.perf_counter()
+    bot.word_filter.load()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    messages = []
+    for _ in range(args.messages):
+        words = [random_word(rng) for _ in range(rng.randint(3, 30))]
+        if rng.random() < 0.01:
+            words.insert(rng.randrange(len(words)), rng.choice(banned).upper())
+        messages.append(" ".join(words))
+
+    start = time.perf_counter()
+    hits = sum(1 for message in messages if bot.word_filter.search(message))
+    elapsed = time.perf_counter() - start
+    print(f"{bot.word_filter.words} banned words compiled in {build_ms:.1f} ms")
+    print(f"combined pattern: {len(messages)} messages in {elapsed * 1000:.1f} ms ({len(messages) / elapsed:.0f}/s), {hits} hits")
+
+    # the old approach, one pattern per word, on a sample since it is orders of magnitude slower
+    patterns = [re.compile(rf'\b{re.escape(word)}\b', re.IGNORECASE) for word in banned]
+    sample = messages[:args.legacy_sample]
+    start = time.perf_counter()
+    legacy_hits = [any(pattern.search(message) for pattern in patterns) for message in sample]
+    elapsed = time.perf_counter() - start
+    print(f"one pattern per word: {len(sample)} messages in {elapsed * 1000:.1f} ms ({len(sample) / elapsed:.0f}/s)")
+    if legacy_hits != [bool(bot.word_filter.search(message)) for message in sample]:
+        print("MISMATCH between the combined pattern and per-word patterns")
+
+async def bench_spam(bot, args):
+    rng = random.Random(args.seed)
+    guard = bot.SpamGuard()
+    spammers = set(rng.sample(range(args.members), 20))
+    channels = list(range(50))
+    # synthetic clock: args.rate messages per second from random members, plus a few spammers
+    events = []
+    for i in range(args.events):
+        member_id = rng.choice(tuple(spammers)) if rng.random() < 0.05 else rng.randrange(args.members)
+        events.append((member_id, rng.choice(channels), i / args.rate))
+
+    verdicts = {}
+    start = time.perf_counter()
+    for member_id, channel_id, now in events:
+        verdict = guard.message(member_id, channel_id, now)
+        verdicts[verdict] = verdicts.get(verdict, 0) + 1
+    elapsed = time.perf_counter() - start
+
+    # one join every two seconds, then a raid of 50 joins a second
+    join_times = [i * 2.0 for i in range(args.joins)] + [args.joins * 2.0 + i / 50 for i in range(args.joins)]
+    flagged = 0
+    start = time.perf_counter()
+    for now in join_times:
+        flagged += guard.join(0, now) is not None
+    joins_elapsed = time.perf_counter() - start
+
+    print(f"{len(events)} messages from {args.members} members at {args.rate}/s simulated")
+    print(f"SpamGuard.message: {elapsed / len(events) * 1e6:.2f} us/event ({len(events) / elapsed:.0f}/s), verdicts {verdicts}")
+    print(f"SpamGuard.join: {joins_elapsed / len(join_times) * 1e6:.2f} us/event, {flagged} of {args.joins} raid joins flagged")
+    print(f"tracked keys: {len(guard.members.buckets)} members (cap {bot.RATE_TRACKED_KEYS}), {len(guard.channels.buckets)} channels")
+
+    # a channel that keeps flooding gets one slowmode edit, and one more to turn it off when it runs out
+    channel = FakeChannel(20)
+    channel.guild = FakeGuild(0)
+    bot.client.get_channel = {20: channel}.get
+    for _ in range(50):
+        await bot.handle_flood(channel)
+    edits = channel.calls.get("edit", 0)
+    due = [entry for entry in bot.expiries.heap if bot.expiries.current(*entry[1:], entry[0])]
+    await bot.expiries.expire(due)
+    print(f"50 floods in one channel: {edits} slowmode edit, {len(due)} revert scheduled; slowmode {channel.slowmode_delay}s after it ran out")
+
+class StarPayload:
+    def __init__(self, channel_id, message_id):
+        self.emoji = type("Emoji", (), {"name": "⭐"})()
+        self.channel_id = channel_id
+        self.message_id = message_id
+
+async def bench_starboard(bot, args):
+    rng = random.Random(args.seed)
+    channel = FakeChannel(1)
+    starboard_channel = FakeChannel(2)
+    channels = {1: channel, 2: starboard_channel}
+    bot.client.get_channel = channels.get
+    bot.STARBOARD_CHANNEL_ID = 2
+    bot.STAR_DEBOUNCE = args.debounce / 1000
+    bot.STARBOARD_KEPT = args.kept
+
+    author = FakeMember(3)
+    for message_id in range(args.messages):
+        message = FakeMessage(message_id, author, f"message {message_id}", channel)
+        message.reactions.append(FakeReaction("⭐", 0))
+        channel.messages[message_id] = message
+
+    # a few messages get most of the stars, as on a real server
+    weights = [1 / (rank + 1) for rank in range(args.messages)]
+    targets = rng.choices(range(args.messages), weights=weights, k=args.reactions)
+    start = time.perf_counter()
+    for i, message_id in enumerate(targets):
+        channel.messages[message_id].reactions[0].count += 1
+        await bot.on_raw_reaction_add(StarPayload(1, message_id))
+        if i % 100 == 0:
+            # reactions arrive over time, not all in one loop iteration
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    while bot.starboard.pending:
+        await asyncio.sleep(args.debounce / 1000)
+
+    rest = sum(channel.calls.values())
+    stats = bot.starboard.stats
+    print(f"{args.reactions} star reactions over {args.messages} messages in {elapsed * 1000:.1f} ms")
+    print(f"{stats['fetches']} message fetches, {stats['posts']} starboard posts, {rest / args.reactions:.4f} fetches per reaction")
+    print(f"before: every reaction fetched its message, {args.reactions} fetches")
+    print(f"{len(bot.store.get(bot.STARBOARD_FILE))} posted ids kept in {bot.STARBOARD_FILE} (cap {args.kept})")
+
+    # a post that fails is not recorded, so the next star tries it again
+    message = FakeMessage(args.messages, author, "missed", channel)
+    message.reactions.append(FakeReaction("⭐", 0))
+    channel.messages[message.id] = message
+    posts = []
+    for channel_id in (99, 2):
+        bot.STARBOARD_CHANNEL_ID = channel_id
+        sent = len(starboard_channel.sent)
+        for _ in range(bot.STAR_THRESHOLD):
+            message.reactions[0].count += 1
+            await bot.on_raw_reaction_add(StarPayload(1, message.id))
+        while bot.starboard.pending:
+            await asyncio.sleep(args.debounce / 1000)
+        posts.append((len(starboard_channel.sent) - sent, bot.starboard.starred(message.id)))
+    print(f"starboard channel missing: posted {posts[0][0]}, recorded {posts[0][1]}; once it is back: posted {posts[1][0]}, recorded {posts[1][1]}")
+
+async def bench_logs(bot, args):
+    bot.LOG_RETENTION = args.retention
+    bot.log_capture.levels.clear()
+    levels = [logging.INFO] * 90 + [logging.WARNING] * 8 + [logging.ERROR] * 2
+    records = [logging.LogRecord("bench", random.choice(levels), __file__, 0, f"event {i}", None, None) for i in range(args.records)]
+
+    start = time.perf_counter()
+    for record in records:
+        bot.log_handler.handle(record)
+    elapsed = time.perf_counter() - start
+
+    # what LogHandler did before: one list trimmed with pop(0), rescanned by /serverstatus
+    legacy = []
+
+    class LegacyHandler(logging.Handler):
+        def emit(self, record):
+            legacy.append(self.format(record))
+            if len(legacy) > args.retention:
+                legacy.pop(0)
+
+    legacy_handler = LegacyHandler()
+    legacy_handler.setFormatter(bot.log_handler.formatter)
+    start = time.perf_counter()
+    for record in records:
+        legacy_handler.handle(record)
+    legacy_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        bot.log_capture.rates("ERROR")
+        bot.log_capture.rates("WARNING")
+        bot.log_capture.recent("ERROR", 5)
+        bot.log_capture.recent("WARNING", 5)
+    status_us = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        [log for log in legacy if 'ERROR' in log]
+        [log for log in legacy if 'WARNING' in log]
+    legacy_status_us = (time.perf_counter() - start) * 1000
+
+    print(f"{args.records} records, {args.retention} kept")
+    print(f"ring buffers: {elapsed / args.records * 1e6:.2f} us/record, status lookup {status_us:.2f} us")
+    print(f"list + pop(0): {legacy_elapsed / args.records * 1e6:.2f} us/record, status scan {legacy_status_us:.2f} us")
+
+    # with the windows renamed, /serverstatus still judges "recent" by the shortest one
+    bot.LOG_RATE_WINDOWS = {"10m": (600, 1), "1d": (86400, 600)}
+    bot.log_capture.levels.clear()
+    bot.log_handler.handle(logging.LogRecord("bench", logging.ERROR, __file__, 0, "one error", None, None))
+    interaction = FakeInteraction(FakeMember(1, moderator=True), FakeGuild(0))
+    await invoke(bot.serverstatus, interaction)
+    print(f"/serverstatus with windows {', '.join(bot.LOG_RATE_WINDOWS)}: {interaction.response.embed.fields[0].value}")
+
+class FakeHTTPResponse:
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+async def bench_bulk(bot, args):
+    rng = random.Random(args.seed)
+    bot.store.load()
+    bot.modlog.load()
+    now = datetime.now(timezone.utc)
+    members = [FakeMember(300000000000000000 + i, joined_at=now - timedelta(days=rng.randint(1, 900))) for i in range(args.members)]
+    raiders = [FakeMember(400000000000000000 + i, joined_at=now - timedelta(seconds=rng.randint(0, 600))) for i in range(args.raiders)]
+    guild = FakeGuild(members=members + raiders, delay=args.delay / 1000)
+    moderator = FakeMember(1, moderator=True)
+    role = FakeRole(5000, "quarantine")
+
+    def rate_limit(name):
+        if rng.random() < args.broken:
+            raise RuntimeError("not a REST error")
+        if rng.random() < args.forbidden:
+            raise bot.discord.Forbidden(FakeHTTPResponse(403, "Forbidden"), "Missing Permissions")
+        if rng.random() < args.rate_limited:
+            error = bot.discord.HTTPException(FakeHTTPResponse(429, "Too Many Requests"), "rate limited")
+            error.retry_after = args.delay / 1000
+            raise error
+    guild.fail = rate_limit
+
+    print(f"{args.raiders} raiders among {args.members} members, {args.delay:.0f} ms per request, {args.rate_limited:.0%} rate limited, "
+          f"{args.forbidden:.1%} forbidden, {args.broken:.1%} failing with other errors")
+
+    class FailureCount(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.failed = 0
+
+        def emit(self, record):
+            self.failed += " failed for " in record.getMessage()
+
+    failure_log = FailureCount()
+    logging.getLogger().addHandler(failure_log)
+    for label, command, extra in [
+        ("massrole", bot.massrole, (role,)),
+        ("masstimeout", bot.masstimeout, ()),
+        ("massban", bot.massban, ()),
+    ]:
+        calls = sum(guild.calls.values())
+        failure_log.failed = 0
+        interaction = FakeInteraction(moderator, guild)
+        edit = interaction.edit_original_response
+
+        async def flaky_edit(*, content=None, **kwargs):
+            # progress edits fail now and then; the final summary must still arrive
+            if content.endswith("Working...") and rng.random() < 0.5:
+                raise bot.discord.HTTPException(FakeHTTPResponse(500, "Internal Server Error"), "edit failed")
+            await edit(content=content, **kwargs)
+        interaction.edit_original_response = flaky_edit
+        start = time.perf_counter()
+        await invoke(command, interaction, *extra, joined_within=15)
+        elapsed = time.perf_counter() - start
+        requests = sum(guild.calls.values()) - calls
+        print(f"{label:<12} {elapsed * 1000:8.0f} ms for {requests} requests (one at a time: ~{requests * args.delay:.0f} ms) -> "
+              f"{interaction.edits[-1].splitlines()[0]} {failure_log.failed} failures logged")
+
+    start = time.perf_counter()
+    pending = len(bot.modlog.pending)
+    await bot.modlog.flush()
+    print(f"{pending} moderation events written in one append, {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # the raid's temp-bans run out while unbans keep failing: a record may only go once the unban went
+    # through, or after a few refusals for missing permissions
+    banned = sorted(guild.bans)
+    forbidden = set(rng.sample(banned, min(10, len(banned))))
+    lift = guild.unban
+
+    async def unban(user, *, reason=None):
+        if user.id in forbidden:
+            raise bot.discord.Forbidden(FakeHTTPResponse(403, "Forbidden"), "Missing Permissions")
+        if rng.random() < 0.3:
+            raise rng.choice([aiohttp.ClientOSError("connection reset"), asyncio.TimeoutError()])
+        await lift(user, reason=reason)
+    guild.unban = unban
+    guild.fail = None
+    bot.client.get_guild = {guild.id: guild}.get
+    for user_id in banned:
+        bot.expiries.schedule("ban", guild.id, user_id, datetime.now().astimezone())
+    rounds = 0
+    while bot.expiries.heap and rounds < 20:
+        # every retry is treated as due straight away
+        entries, bot.expiries.heap = bot.expiries.heap, []
+        await bot.expiries.expire([entry for entry in entries if bot.expiries.current(*entry[1:], entry[0])])
+        rounds += 1
+    lost = sum(1 for user_id in banned if user_id in guild.bans and user_id not in forbidden and not bot.expiries.scheduled("ban", guild.id, user_id))
+    retrying = sum(1 for user_id in forbidden if bot.expiries.scheduled("ban", guild.id, user_id))
+    print(f"{len(banned)} bans expiring with 30% of unbans failing: {len(banned) - len(guild.bans)} lifted in {rounds} rounds, "
+          f"{lost} records dropped while still banned, {len(forbidden) - retrying} of {len(forbidden)} forbidden dropped")
+
+async def bench_purge(bot, args):
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    members = [FakeMember(500000000000000000 + i, bot=i < args.members // 10) for i in range(args.members)]
+    moderator = FakeMember(1, moderator=True)
+    guild = FakeGuild(members=members + [moderator])
+
+    def build_channel():
+        channel = FakeChannel(10, "general", delay=args.delay / 1000)
+        for i in range(args.messages):
+            # spread over --days, so the oldest part of the history is past the bulk delete limit
+            created_at = now - timedelta(seconds=args.days * 86400 * i / args.messages)
+            content = f"message {i}"
+            if rng.random() < 0.05:
+                content += " https://example.com/free-nitro"
+            message = FakeMessage(bot.discord.utils.time_snowflake(created_at) + i % 4096, rng.choice(members), content, created_at=created_at)
+            channel.add_message(message)
+        return channel
+
+    print(f"{args.messages} messages over {args.days} days, {args.delay:.0f} ms per request")
+    author = members[-1]
+    for label, kwargs in [
+        ("latest 1000", {"number_of_messages": 1000}),
+        ("bots only", {"number_of_messages": args.messages, "bots_only": True}),
+        ("links", {"number_of_messages": args.messages, "contains_links": True}),
+        ("author", {"number_of_messages": args.messages, "author": author}),
+        ("regex", {"number_of_messages": args.messages, "pattern": r"message \d*7$"}),
+        ("after", {"number_of_messages": 1000}),
+    ]:
+        channel = build_channel()
+        if label == "after":
+            # the newest 1000 messages after one halfway back, not the oldest 1000 after it
+            kwargs = {**kwargs, "after": str(channel.ids[len(channel.ids) // 2])}
+        before = set(channel.messages)
+        interaction = FakeInteraction(moderator, guild, channel)
+        start = time.perf_counter()
+        await invoke(bot.purge, interaction, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        check = bot.purge_filter(kwargs.get("author"), kwargs.get("bots_only"), kwargs.get("contains_links"),
+                                 re.compile(kwargs["pattern"], re.IGNORECASE) if "pattern" in kwargs else None)
+        lower = int(kwargs.get("after", 0))
+        scanned = sorted((message_id for message_id in before if message_id > lower), reverse=True)[:kwargs["number_of_messages"]]
+        removed = before - set(channel.messages)
+        leftover = sum(1 for message_id in scanned if message_id in channel.messages and check(channel.messages[message_id]))
+        requests = sum(channel.calls.values())
+        calls = ", ".join(f"{count} {name}" for name, count in sorted(channel.calls.items()))
+        print(f"{label:<12} {elapsed * 1000:8.0f} ms, {len(removed)} deleted ({calls}); fetching and deleting in turn: ~{requests * args.delay:.0f} ms")
+        if leftover or not removed <= set(scanned):
+            print(f"  MISMATCH: {leftover} matching messages left, {len(removed - set(scanned))} deleted outside the range")
+        print(f"  {interaction.edits[-1]} ({len(interaction.edits) - 1} progress edits)")
+
+def tear(bot, args):
+    # makes the writer kill itself partway through one kind of write once it reaches generation --tear-at
+    def die():
+        os.kill(os.getpid(), signal.SIGKILL)
+
+    def due():
+        return bot.store.get(bot.ROLES_FILE).get("generation", 0) >= args.tear_at
+
+    if args.tear == "store":
+        write_atomic = bot.write_atomic
+        def torn_store(path, payload):
+            if path == bot.ROLES_FILE and due():
+                with open(path + ".tmp", "w") as f:
+                    f.write(payload[:len(payload) // 2])
+                    f.flush()
+                    os.fsync(f.fileno())
+                die()
+            write_atomic(path, payload)
+        bot.write_atomic = torn_store
+    elif args.tear == "log":
+        write = bot.modlog.write
+        def torn_log(records):
+            if due():
+                payload = "".join(json.dumps(record) + "\n" for record in records)
+                with open(os.path.join(bot.modlog.path, f"{bot.modlog.segment:08d}.jsonl"), "a") as f:
+                    f.write(payload[:len(payload) // 2])
+                    f.flush()
+                    os.fsync(f.fileno())
+                die()
+            write(records)
+        bot.modlog.write = torn_log
+    elif args.tear == "compact":
+        # the fresh segment is in place but only the first old segment gets removed
+        remove = os.remove
+        def torn_remove(path):
+            remove(path)
+            die()
+        bot.os.remove = torn_remove
+
+async def crash_writer(bot, args):
+    # the child side of the crash scenario: writes generation after generation until it is killed,
+    # printing each one once it is on disk
+    bot.COMPACT_MIN_DEAD = 20
+    bot.store.load()
+    bot.modlog.load()
+    tear(bot, args)
+    roles = bot.store.get(bot.ROLES_FILE)
+    # the log is written after the roles file, so it has the last generation that made it to both
+    generation = max((event.member_id for event in bot.modlog.events.values()), default=0)
+    while True:
+        generation += 1
+        roles["generation"] = generation
+        roles["members"] = {str(member_id): [generation, member_id] for member_id in range(args.members)}
+        bot.store.mark_dirty(bot.ROLES_FILE)
+        bot.modlog.append("warn", 0, generation, 0, f"generation {generation}")
+        # keeps only the last five generations in the log, so compaction runs too
+        for event in [event for event in bot.modlog.events.values() if event.member_id <= generation - 5]:
+            bot.modlog.delete(event.id)
+        await bot.store.flush()
+        await bot.modlog.flush()
+        print(generation, flush=True)
+
+def check_recovered(bot, acked, members):
+    # returns what is wrong with the files on disk after a crash, given the last generation the writer reported.
+    # each generation rewrites the roles file, then appends its event to the log and deletes the one five back
+    problems = []
+    store = bot.ModerationStore([bot.ROLES_FILE])
+    try:
+        store.load()
+    except json.JSONDecodeError as e:
+        return [f"{bot.ROLES_FILE} does not parse: {e}"]
+    roles = store.get(bot.ROLES_FILE)
+    generation = roles.get("generation", 0)
+    if roles.get("members") != {str(member_id): [generation, member_id] for member_id in range(members)}:
+        problems.append(f"{bot.ROLES_FILE} mixes generations or is missing members")
+
+    modlog = bot.ModerationLog(bot.MODLOG_DIR)
+    modlog.load()
+    live = {event.member_id for event in modlog.events.values()}
+    newest = max(live, default=0)
+    if newest not in (acked, acked + 1):
+        problems.append(f"the log ends at generation {newest}, the writer had finished {acked}")
+    if generation not in (newest, newest + 1):
+        problems.append(f"{bot.ROLES_FILE} is at generation {generation}, the log at {newest}")
+    # the newest append and its delete go out in one write, so a torn write may keep one extra old event
+    expected = set(range(max(1, newest - 4), newest + 1))
+    if not expected <= live <= expected | {newest - 5}:
+        problems.append(f"the log holds generations {sorted(live)}, expected {sorted(expected)}")
+    return problems
+
+async def bench_crash(bot, args):
+    rng = random.Random(args.seed)
+    workdir = os.getcwd()
+    modes = ["kill", "log", "store", "compact"]
+    failures = dict.fromkeys(modes, 0)
+    rounds = dict.fromkeys(modes, 0)
+    acked = 0
+    print(f"{args.rounds} restarts of a writer that rewrites {bot.ROLES_FILE} ({args.members} members) and appends to the log")
+    print("kill: killed at a random moment; store/log/compact: killed halfway through that write")
+    for round_number in range(args.rounds):
+        mode = modes[round_number % len(modes)]
+        rounds[mode] += 1
+        command = [sys.executable, __file__, "crash-writer", "--workdir", workdir, "--members", str(args.members)]
+        if mode != "kill":
+            command += ["--tear", mode, "--tear-at", str(acked + rng.randint(2, 6))]
+        writer = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if mode == "kill":
+            # let it get going before pulling the plug
+            output = await writer.stdout.readline()
+            await asyncio.sleep(rng.uniform(0, args.window / 1000))
+            writer.kill()
+        else:
+            output = b""
+        try:
+            output += await asyncio.wait_for(writer.stdout.read(), 60)
+        except asyncio.TimeoutError:
+            writer.kill()
+            output += await writer.stdout.read()
+            print(f"round {round_number + 1}: the {mode} write never came up; compaction may need a lower COMPACT_MIN_DEAD")
+        await writer.wait()
+        acked = max([acked] + [int(generation) for generation in output.split()])
+        problems = check_recovered(bot, acked, args.members)
+        if problems:
+            failures[mode] += 1
+            print(f"round {round_number + 1} ({mode}), killed after generation {acked}: " + "; ".join(problems))
+    print(" ".join(f"{mode}: {failures[mode]}/{rounds[mode]} inconsistent" for mode in modes) + f"; {acked} generations written")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for moderatorbot against fake guilds and interactions.")
+    parser.add_argument("--seed", type=int, default=0)
+    scenarios = parser.add_subparsers(dest="scenario", required=True)
+
+    whois = scenarios.add_parser("whois", help="/whois latency with a large warnings file")
+    whois.add_argument("--members", type=int, default=100000)
+    whois.add_argument("--lookups", type=int, default=50)
+    whois.add_argument("--hot", type=int, default=20, help="members under investigation in the triage run")
+    whois.add_argument("--triage", type=int, default=5000, help="/whois lookups in the triage run")
+    whois.set_defaults(run=bench_whois)
+
+    automod = scenarios.add_parser("automod", help="banned word filter throughput")
+    automod.add_argument("--words", type=int, default=10000)
+    automod.add_argument("--messages", type=int, default=50000)
+    automod.add_argument("--legacy-sample", type=int, default=200)
+    automod.set_defaults(run=bench_automod)
+
+    spam = scenarios.add_parser("spam", help="spam and raid detector cost per event")
+    spam.add_argument("--members", type=int, default=500000)
+    spam.add_argument("--events", type=int, default=1000000)
+    spam.add_argument("--rate", type=int, default=2000, help="simulated messages per second")
+    spam.add_argument("--joins", type=int, default=10000)
+    spam.set_defaults(run=bench_spam)
+
+    stars = scenarios.add_parser("starboard", help="REST calls per star reaction")
+    stars.add_argument("--messages", type=int, default=20000)
+    stars.add_argument("--reactions", type=int, default=100000)
+    stars.add_argument("--debounce", type=float, default=10, help="debounce window in ms")
+    stars.add_argument("--kept", type=int, default=1000, help="posted message ids remembered")
+    stars.set_defaults(run=bench_starboard)
+
+    logs = scenarios.add_parser("logs", help="log capture cost and /serverstatus lookups")
+    logs.add_argument("--records", type=int, default=200000)
+    logs.add_argument("--retention", type=int, default=100000)
+    logs.set_defaults(run=bench_logs)
+
+    bulk = scenarios.add_parser("bulk", help="mass ban/timeout/role against a raid on a fake guild")
+    bulk.add_argument("--members", type=int, default=5000)
+    bulk.add_argument("--raiders", type=int, default=500)
+    bulk.add_argument("--delay", type=float, default=50, help="simulated REST latency in ms")
+    bulk.add_argument("--rate-limited", type=float, default=0.02, help="share of requests answered with a 429")
+    bulk.add_argument("--forbidden", type=float, default=0.005, help="share of requests answered with a 403")
+    bulk.add_argument("--broken", type=float, default=0.005, help="share of requests raising something other than an HTTP error")
+    bulk.set_defaults(run=bench_bulk)
+
+    purge = scenarios.add_parser("purge", help="filtered /purge against a fake channel")
+    purge.add_argument("--messages", type=int, default=50000)
+    purge.add_argument("--members", type=int, default=200)
+    purge.add_argument("--days", type=float, default=16, help="age of the oldest message")
+    purge.add_argument("--delay", type=float, default=5, help="simulated REST latency in ms")
+    purge.set_defaults(run=bench_purge)
+
+    crash = scenarios.add_parser("crash", help="kill the store mid-write and check what a restart reads back")
+    crash.add_argument("--rounds", type=int, default=30)
+    crash.add_argument("--members", type=int, default=20000, help="size of the file being rewritten")
+    crash.add_argument("--window", type=float, default=300, help="kill within this many ms of the first write")
+    crash.set_defaults(run=bench_crash)
+
+    writer = scenarios.add_parser("crash-writer", help="writer process for the crash scenario")
+    writer.add_argument("--workdir", required=True)
+    writer.add_argument("--members", type=int, default=20000)
+    writer.add_argument("--tear", choices=["store", "log", "compact"])
+    writer.add_argument("--tear-at", type=int, default=0, help="generation to tear the write at")
+    writer.set_defaults(run=crash_writer)
+
+    args = parser.parse_args()
+    if args.scenario == "crash-writer":
+        bot = load_bot(args.workdir)
+        asyncio.run(args.run(bot, args))
+        return
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = load_bot(workdir)
+        asyncio.run(args.run(bot, args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+import asyncio
+import bisect
+import importlib
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from discord.utils import time_snowflake
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_bot(workdir):
+    # main.py creates and reads its json files relative to the working directory on import
+    os.chdir(workdir)
+    if BOT_DIR not in sys.path:
+        sys.path.insert(0, BOT_DIR)
+    return importlib.import_module("main")
+
+class FakePermissions:
+    def __init__(self, allowed=True):
+        self.allowed = allowed
+
+    def __getattr__(self, name):
+        return self.allowed
+
+class FakeAsset:
+    def __init__(self, url):
+        self.url = url
+
+class FakeRole:
+    def __init__(self, role_id, name=None):
+        self.id = role_id
+        self.name = name or f"role{role_id}"
+
+    @property
+    def mention(self):
+        return f"<@&{self.id}>"
+
+class FakeMember:
+    def __init__(self, user_id, name=None, roles=(), joined_at=None, bot=False, moderator=False):
+        self.id = user_id
+        self.name = name or f"user{user_id}"
+        self.display_name = self.name
+        self.discriminator = "0"
+        self.bot = bot
+        self.roles = list(roles)
+        self.created_at = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        self.joined_at = joined_at or datetime(2022, 1, 1, tzinfo=timezone.utc)
+        self.guild_permissions = FakePermissions(moderator)
+        self.avatar = None
+        self.display_avatar = FakeAsset(f"https://cdn.example/avatars/{user_id}.png")
+        self.timed_out_until = None
+        self.dms = []
+        self.guild = None
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    async def send(self, content=None, **kwargs):
+        self.dms.append(content)
+
+    async def add_roles(self, *roles, reason=None):
+        if self.guild is not None:
+            await self.guild.call("add_roles")
+        for role in roles:
+            if role not in self.roles:
+                self.roles.append(role)
+
+    async def edit(self, *, timed_out_until=None, reason=None, **kwargs):
+        if self.guild is not None:
+            await self.guild.call("edit_member")
+        self.timed_out_until = timed_out_until
+
+    def __repr__(self):
+        return f"<FakeMember id={self.id}>"
+
+class FakeGuild:
+    def __init__(self, guild_id=0, members=(), delay=0):
+        self.id = guild_id
+        self.name = f"guild{guild_id}"
+        self.default_role = FakeRole(guild_id, "@everyone")
+        self.by_id = {}
+        self.delay = delay
+        self.bans = set()
+        self.calls = {}
+        # hook for benchmarks to inject errors: called with the request name, may raise
+        self.fail = None
+        for member in members:
+            self.add_member(member)
+
+    @property
+    def members(self):
+        return list(self.by_id.values())
+
+    @property
+    def member_count(self):
+        return len(self.by_id)
+
+    def add_member(self, member):
+        member.guild = self
+        self.by_id[member.id] = member
+
+    def get_member(self, user_id):
+        return self.by_id.get(user_id)
+
+    async def call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail is not None:
+            self.fail(name)
+
+    async def ban(self, user, *, reason=None, **kwargs):
+        await self.call("ban")
+        self.bans.add(user.id)
+        self.by_id.pop(user.id, None)
+
+    async def unban(self, user, *, reason=None):
+        await self.call("unban")
+        self.bans.discard(user.id)
+
+class FakeReaction:
+    def __init__(self, emoji, count):
+        self.emoji = emoji
+        self.count = count
+
+class FakeMessage:
+    def __init__(self, message_id, author, content="", channel=None, created_at=None):
+        self.id = message_id
+        self.author = author
+        self.content = content
+        self.channel = channel
+        self.created_at = created_at or datetime.now(timezone.utc)
+        self.attachments = []
+        self.reactions = []
+        self.jump_url = f"https://discord.com/channels/0/{channel.id if channel else 0}/{message_id}"
+
+    async def delete(self):
+        await self.channel.call("delete_message")
+        self.channel.remove([self])
+
+def snowflake(value):
+    # history bounds may be a message, a discord.Object or a datetime
+    if isinstance(value, datetime):
+        return time_snowflake(value)
+    return value.id
+
+class FakeChannel:
+    # counts the REST calls a real channel would make
+    def __init__(self, channel_id, name=None, delay=0):
+        self.id = channel_id
+        self.name = name or f"channel{channel_id}"
+        self.delay = delay
+        self.messages = {}
+        self.ids = []
+        self.sent = []
+        self.calls = {}
+        self.guild = None
+        self.slowmode_delay = 0
+
+    async def edit(self, *, slowmode_delay=None, reason=None, **kwargs):
+        await self.call("edit")
+        if slowmode_delay is not None:
+            self.slowmode_delay = slowmode_delay
+
+    def add_message(self, message):
+        message.channel = self
+        self.messages[message.id] = message
+        bisect.insort(self.ids, message.id)
+
+    def remove(self, messages):
+        for message in messages:
+            if self.messages.pop(message.id, None) is not None:
+                del self.ids[bisect.bisect_left(self.ids, message.id)]
+
+    async def call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+    async def fetch_message(self, message_id):
+        await self.call("fetch_message")
+        return self.messages[message_id]
+
+    async def send(self, content=None, *, embed=None, **kwargs):
+        await self.call("send")
+        self.sent.append(content if embed is None else embed)
+
+    async def history(self, *, limit=100, before=None, after=None, oldest_first=None):
+        # pages of 100 like the real endpoint, in the order discord.py gives them: oldest first when
+        # `after` is set unless told otherwise, and `limit` counts from whichever end it starts at
+        upper = snowflake(before) if before is not None else None
+        lower = snowflake(after) if after is not None else None
+        reverse = lower is not None if oldest_first is None else oldest_first
+        remaining = limit
+        while remaining is None or remaining > 0:
+            retrieve = 100 if remaining is None else min(100, remaining)
+            if reverse:
+                # the `retrieve` oldest messages after `lower`, kept only if they are before `upper`
+                start = bisect.bisect_right(self.ids, lower) if lower is not None else 0
+                raw = self.ids[start:start + retrieve]
+                if raw:
+                    lower = raw[-1]
+                page = [message_id for message_id in raw if upper is None or message_id < upper]
+            else:
+                # the `retrieve` newest messages before `upper`, kept only if they are after `lower`
+                end = bisect.bisect_left(self.ids, upper) if upper is not None else len(self.ids)
+                raw = self.ids[max(0, end - retrieve):end][::-1]
+                if raw:
+                    upper = raw[-1]
+                page = [message_id for message_id in raw if lower is None or message_id > lower]
+            await self.call("history")
+            if remaining is not None:
+                remaining -= len(raw)
+            for message_id in page:
+                yield self.messages[message_id]
+            if len(page) < 100:
+                return
+
+    async def delete_messages(self, messages):
+        if len(messages) > 100:
+            raise ValueError("Can only bulk delete messages up to 100 messages")
+        if len(messages) > 1 and min(message.created_at for message in messages) < datetime.now(timezone.utc) - timedelta(days=14):
+            raise ValueError("Bulk delete of a message older than 14 days")
+        await self.call("delete_messages" if len(messages) > 1 else "delete_message")
+        self.remove(messages)
+
+class FakeResponse:
+    # stands in for discord.InteractionResponse and keeps the last reply
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.done = False
+        self.content = None
+        self.embed = None
+        self.ephemeral = False
+
+    def is_done(self):
+        return self.done
+
+    async def reply(self, content=None, embed=None, ephemeral=False):
+        if self.done:
+            raise RuntimeError("This interaction has already been responded to before")
+        self.done = True
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.content = content
+        self.embed = embed
+        self.ephemeral = ephemeral
+
+    async def send_message(self, content=None, *, embed=None, ephemeral=False, **kwargs):
+        await self.reply(content, embed, ephemeral)
+
+    async def defer(self, *, ephemeral=False, **kwargs):
+        await self.reply(ephemeral=ephemeral)
+
+class FakeInteraction:
+    def __init__(self, user, guild, channel=None, delay=0):
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id if guild is not None else None
+        self.channel = channel
+        self.channel_id = channel.id if channel is not None else 0
+        self.id = time_snowflake(datetime.now(timezone.utc))
+        self.response = FakeResponse(delay)
+        self.edits = []
+
+    async def edit_original_response(self, *, content=None, embed=None, **kwargs):
+        self.edits.append(content if embed is None else embed)
+
+async def invoke(command, interaction, *args, **kwargs):
+    # app_commands.Command keeps the undecorated coroutine in .callback
+    await command.callback(interaction, *args, **kwargs)
+    return interaction.response
@@ -8,6 +8,9 @@ import asyncio
 from typing import Optional
 import re
 import time
+import bisect
+import heapq
+from collections import OrderedDict, deque
 
 logging.basicConfig(level=logging.INFO)
 
@@ -17,8 +20,22 @@ intents.message_content = True
 intents.reactions = True
 
 activity = discord.Activity(type=discord.ActivityType.watching, name="Lorem Ipsum")
-client = discord.Client(intents=intents, activity=activity)
-starred_messages = set()
+
+class ModeratorClient(discord.Client):
+    async def setup_hook(self):
+        store.load()
+        modlog.load()
+        word_filter.load()
+        expiries.load()
+        store.start()
+        expiries.start()
+
+    async def close(self):
+        await expiries.stop()
+        await store.stop()
+        await super().close()
+
+client = ModeratorClient(intents=intents, activity=activity)
 tree = discord.app_commands.CommandTree(client)
 
 GUILD_ID = 0
@@ -28,78 +45,837 @@ MUTES_FILE = "mutes.json"
 WARNINGS_FILE = "warnings.json"
 BANNED_WORDS = "banned_words.json"
 NOTES_FILE = "notes.json"
+SLOWMODE_FILE = "slowmode.json"
+MODLOG_DIR = "modlog"
+FLUSH_INTERVAL_MS = 500
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+COMPACT_MIN_DEAD = 1000 # compact once this many dead lines (deleted events and their tombstones) pile up...
+COMPACT_DEAD_RATIO = 0.25 # ...and they make up this share of the log
+WORDS_RELOAD_INTERVAL = 5 # seconds between checks of the banned words file for edits
+SPAM_MESSAGES, SPAM_SECONDS = 8, 5 # per member
+FLOOD_MESSAGES, FLOOD_SECONDS = 40, 5 # per channel
+RAID_JOINS, RAID_SECONDS = 10, 10 # per guild
+SPAM_TIMEOUT = timedelta(minutes=10)
+SPAM_PURGE_SCAN = 50 # recent channel messages searched for the spammer's messages
+FLOOD_SLOWMODE = 10 # seconds
+FLOOD_SLOWMODE_DURATION = timedelta(minutes=10) # slowmode from a flood is turned off again after this long
+RAID_MODE_SECONDS = 300 # members joining this long after a raid is detected are timed out on join
+UNBAN_RETRY_SECONDS = 300 # first retry of a failed unban or slowmode revert; doubles on every further failure
+UNBAN_RETRY_MAX_SECONDS = 6 * 3600
+UNBAN_FORBIDDEN_ATTEMPTS = 3 # tries before an expiry the bot lacks permission for is dropped
+BULK_CONCURRENCY = 5 # requests a bulk action keeps in flight
+BULK_RETRIES = 3 # retries of a rate-limited request before the target counts as failed
+BULK_PROGRESS_INTERVAL = 2 # seconds between progress edits
+PURGE_BATCH = 100 # most messages one bulk delete takes
+PURGE_MAX_AGE = timedelta(days=14) - timedelta(minutes=5) # bulk delete rejects older messages; the margin covers clock skew
+LINK_PATTERN = re.compile(r"https?://\S+")
+RATE_TRACKED_KEYS = 100000 # members and channels with a live rate counter; the least recently active are dropped
 STAR_EMOJI = '⭐'
 STARBOARD_CHANNEL_ID = 0
+STARBOARD_FILE = "starboard.json"
+STAR_THRESHOLD = 3
+STAR_DEBOUNCE = 2 # seconds to let a burst of stars settle before the message is fetched
+STAR_TRACKED_MESSAGES = 10000
+STARBOARD_KEPT = 50000 # posted message ids remembered so nothing is posted twice; the earliest posts are forgotten first
+PROFILE_CACHE_SIZE = 5000 # rendered /whois embeds kept; the least recently viewed are dropped
 WELCOME_CHANNEL_ID = 0
 
-log_capture = []
+LOG_RETENTION = 1000 # recent entries kept per level
+LOG_RATE_WINDOWS = {"5m": (300, 1), "1h": (3600, 60)} # window seconds, slot seconds
+
+class WindowCounter:
+    # ring buffer of time slots with a running total; expired slots are subtracted as time moves on
+    def __init__(self, seconds, slot_seconds=1):
+        self.slot_seconds = slot_seconds
+        self.counts = [0] * (seconds // slot_seconds)
+        self.slot = 0
+        self.total = 0
+
+    def advance(self, now):
+        slot = int(now // self.slot_seconds)
+        if slot - self.slot >= len(self.counts):
+            self.counts = [0] * len(self.counts)
+            self.total = 0
+        else:
+            for expired in range(self.slot + 1, slot + 1):
+                index = expired % len(self.counts)
+                self.total -= self.counts[index]
+                self.counts[index] = 0
+        self.slot = max(self.slot, slot)
+
+    def add(self, now, amount=1):
+        self.advance(now)
+        self.counts[self.slot % len(self.counts)] += amount
+        self.total += amount
+        return self.total
+
+    def count(self, now):
+        self.advance(now)
+        return self.total
+
+class LogLevel:
+    def __init__(self):
+        self.recent = deque(maxlen=LOG_RETENTION)
+        self.total = 0
+        self.windows = {name: WindowCounter(seconds, slot_seconds) for name, (seconds, slot_seconds) in LOG_RATE_WINDOWS.items()}
+        # entries logged in the current second, handed to the windows in one go once the second is over or read
+        self.second = 0
+        self.pending = 0
+
+    def flush(self):
+        for window in self.windows.values():
+            window.add(self.second, self.pending)
+        self.pending = 0
+
+class LogCapture:
+    # recent entries and counters kept per level; CRITICAL is filed under ERROR
+    def __init__(self):
+        self.levels = {}
+
+    def level(self, name):
+        level = self.levels.get(name)
+        if level is None:
+            level = self.levels[name] = LogLevel()
+        return level
+
+    def add(self, record, entry):
+        level = self.level("ERROR" if record.levelno >= logging.ERROR else record.levelname)
+        level.recent.append(entry)
+        level.total += 1
+        second = int(time.monotonic())
+        if second != level.second:
+            if level.pending:
+                level.flush()
+            level.second = second
+        level.pending += 1
+
+    def recent(self, name, count):
+        entries = self.level(name).recent
+        entries = [entries[i] for i in range(max(0, len(entries) - count), len(entries))]
+        return [entry if isinstance(entry, str) else log_handler.format(entry) for entry in entries]
+
+    def rates(self, name):
+        level = self.level(name)
+        if level.pending:
+            level.flush()
+        now = time.monotonic()
+        return {window_name: window.count(now) for window_name, window in level.windows.items()}
+
+log_capture = LogCapture()
 
 class LogHandler(logging.Handler):
     def emit(self, record):
-        log_entry = self.format(record)
-        log_capture.append(log_entry)
-        # keep only the last 100 log entries for recent logs
-        if len(log_capture) > 100:
-            log_capture.pop(0)
+        # formatting waits until an entry is read; tracebacks are rendered now so their frames are not kept alive
+        log_capture.add(record, self.format(record) if record.exc_info else record)
 
 log_handler = LogHandler()
 log_handler.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
 logging.getLogger().addHandler(log_handler)
 
-banned_word_patterns = [re.compile(rf'\b{re.escape(word)}\b', re.IGNORECASE) for word in BANNED_WORDS]
-starred_messages = set()
-
 def load_data(file_name):
     if not os.path.exists(file_name):
         return {}
     with open(file_name, "r") as f:
         return json.load(f)
 
-def save_data(file_name, data):
-    with open(file_name, "w") as f:
-        json.dump(data, f, indent=4)
+def write_atomic(path, payload):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class ModerationStore:
+    # every moderation file is read once at startup and served from memory;
+    # changed files are rewritten in the background, off the event loop
+    def __init__(self, file_names):
+        self.file_names = list(file_names)
+        self.data = {file_name: {} for file_name in self.file_names}
+        self.dirty = set()
+        self.wakeup = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.stopping = False
+        self.stats = {
+            "flushes": 0,
+            "files_written": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0
+        }
+
+    def load(self):
+        for file_name in self.file_names:
+            self.data[file_name] = load_data(file_name)
+
+    def get(self, file_name):
+        return self.data[file_name]
+
+    def mark_dirty(self, file_name):
+        self.dirty.add(file_name)
+
+    def snapshot(self, file_name):
+        # copy the per-member lists and per-guild dicts so the dump in the worker thread can't race a command
+        return {key: list(value) if isinstance(value, list) else dict(value) if isinstance(value, dict) else value
+                for key, value in self.data[file_name].items()}
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.stopping = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+            self.stopping = False
+        await self.flush()
+        await modlog.flush()
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), FLUSH_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+                await modlog.flush()
+            except Exception as e:
+                logging.error(f"Failed to flush moderation data: {e}")
+
+    async def flush(self):
+        async with self.lock:
+            if not self.dirty:
+                return
+            file_names, self.dirty = self.dirty, set()
+            snapshots = {file_name: self.snapshot(file_name) for file_name in file_names}
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.write, snapshots)
+            except Exception:
+                self.dirty |= file_names
+                raise
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.stats["flushes"] += 1
+            self.stats["files_written"] += len(file_names)
+            self.stats["last_flush_ms"] = elapsed_ms
+            self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], elapsed_ms)
+
+    def write(self, snapshots):
+        for file_name, data in snapshots.items():
+            write_atomic(file_name, json.dumps(data))
+
+class ModEvent:
+    __slots__ = ('id', 'kind', 'guild_id', 'member_id', 'moderator_id', 'ts', 'reason')
+
+    def __init__(self, id, kind, guild_id, member_id, moderator_id, ts, reason=None):
+        self.id = id
+        self.kind = kind
+        self.guild_id = guild_id
+        self.member_id = member_id
+        self.moderator_id = moderator_id
+        self.ts = ts
+        self.reason = reason
+
+    def to_dict(self):
+        return {"id": self.id, "kind": self.kind, "guild": self.guild_id, "member": self.member_id,
+                "moderator": self.moderator_id, "ts": self.ts, "reason": self.reason}
+
+class ModerationLog:
+    # append-only jsonl segments; deletions are tombstone lines that compaction later drops.
+    # events are indexed by member (in time order) and globally by time
+    def __init__(self, path):
+        self.path = path
+        self.events = {}
+        self.by_member = {}
+        self.timeline = []
+        self.times = []
+        self.next_id = 1
+        self.segment = 0
+        self.segment_size = 0
+        self.dead = 0
+        self.lines = 0
+        self.pending = []
+        self.lock = asyncio.Lock()
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.path) if name.endswith(".jsonl"))
+
+    def load(self):
+        os.makedirs(self.path, exist_ok=True)
+        for name in self.segments():
+            path = os.path.join(self.path, name)
+            size = 0
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # a torn last line from a crash mid-append
+                        break
+                    size += len(line)
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.apply(record)
+            if size < os.path.getsize(path):
+                # cut the torn line off, or the next append would be glued onto it and lost too
+                os.truncate(path, size)
+            self.segment = int(name[:-len(".jsonl")])
+            self.segment_size = size
+        if not self.lines:
+            self.import_legacy()
+
+    def import_legacy(self):
+        # warnings and notes used to be pre-formatted strings in per-member json lists; notes had no timestamp
+        legacy = []
+        for member_id, entries in load_data(WARNINGS_FILE).items():
+            for entry in entries:
+                reason, _, stamp = entry.rpartition(" | ")
+                match = re.search(r"<t:(\d+)", stamp)
+                legacy.append((int(match.group(1)) if match else 0, "warn", int(member_id), reason or entry))
+        for member_id, entries in load_data(NOTES_FILE).items():
+            for entry in entries:
+                legacy.append((0, "note", int(member_id), entry))
+        # sorted so the time index is built by appending
+        legacy.sort(key=lambda entry: entry[0])
+        for ts, kind, member_id, reason in legacy:
+            self.append(kind, GUILD_ID, member_id, 0, reason, ts)
+
+    def apply(self, record):
+        self.lines += 1
+        self.next_id = max(self.next_id, record["id"] + 1)
+        if record["kind"] == "delete":
+            self.dead += 1
+            event = self.events.pop(record["target"], None)
+            if event is not None:
+                self.dead += 1
+                self.by_member[event.member_id].remove(event.id)
+            return
+        if record["id"] in self.events:
+            # a compaction that crashed before removing the old segments
+            self.lines -= 1
+            return
+        event = ModEvent(record["id"], record["kind"], record["guild"], record["member"], record["moderator"], record["ts"], record.get("reason"))
+        self.events[event.id] = event
+        ids = self.by_member.setdefault(event.member_id, [])
+        if ids and self.events[ids[-1]].ts > event.ts:
+            bisect.insort(ids, event.id, key=lambda event_id: (self.events[event_id].ts, event_id))
+        else:
+            ids.append(event.id)
+        if self.times and self.times[-1] > event.ts:
+            position = bisect.bisect_right(self.times, event.ts)
+            self.timeline.insert(position, event.id)
+            self.times.insert(position, event.ts)
+        else:
+            self.timeline.append(event.id)
+            self.times.append(event.ts)
+
+    def append(self, kind, guild_id, member_id, moderator_id, reason=None, ts=None):
+        record = {"id": self.next_id, "kind": kind, "guild": guild_id, "member": member_id,
+                  "moderator": moderator_id, "ts": int(time.time()) if ts is None else ts, "reason": reason}
+        self.apply(record)
+        self.pending.append(record)
+        profiles.invalidate(member_id)
+        return self.events[record["id"]]
+
+    def delete(self, event_id):
+        record = {"id": self.next_id, "kind": "delete", "target": event_id, "ts": int(time.time())}
+        event = self.events.get(event_id)
+        self.apply(record)
+        self.pending.append(record)
+        if event is not None:
+            profiles.invalidate(event.member_id)
+
+    def history(self, member_id, kind=None):
+        events = (self.events[event_id] for event_id in self.by_member.get(member_id, ()))
+        return [event for event in events if kind is None or event.kind == kind]
+
+    def count(self, member_id, kind, since=None):
+        # the member's events are kept in time order, so only the tail after `since` is looked at
+        ids = self.by_member.get(member_id, ())
+        start = 0 if since is None else bisect.bisect_left(ids, since, key=lambda event_id: self.events[event_id].ts)
+        return sum(1 for event_id in ids[start:] if self.events[event_id].kind == kind)
+
+    def between(self, start, end):
+        lo = bisect.bisect_left(self.times, start)
+        hi = bisect.bisect_right(self.times, end)
+        return [self.events[event_id] for event_id in self.timeline[lo:hi] if event_id in self.events]
+
+    async def flush(self):
+        async with self.lock:
+            if self.pending:
+                records, self.pending = self.pending, []
+                try:
+                    await asyncio.to_thread(self.write, records)
+                except Exception:
+                    self.pending = records + self.pending
+                    raise
+            if self.dead >= COMPACT_MIN_DEAD and self.dead >= COMPACT_DEAD_RATIO * self.lines:
+                await self.compact()
+
+    def write(self, records):
+        payload = "".join(json.dumps(record) + "\n" for record in records)
+        if self.segment == 0 or self.segment_size >= SEGMENT_MAX_BYTES:
+            self.segment += 1
+            self.segment_size = 0
+        with open(os.path.join(self.path, f"{self.segment:08d}.jsonl"), "a") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self.segment_size += len(payload)
+
+    async def compact(self):
+        # live events go into one fresh segment; older segments are removed only after it is in place
+        old_segments = self.segments()
+        live = [event.to_dict() for event in sorted(self.events.values(), key=lambda event: event.id)]
+        lines, dead = self.lines, self.dead
+        self.segment += 1
+        path = os.path.join(self.path, f"{self.segment:08d}.jsonl")
+        payload = "".join(json.dumps(record) + "\n" for record in live)
+        await asyncio.to_thread(write_atomic, path, payload)
+        for name in old_segments:
+            await asyncio.to_thread(os.remove, os.path.join(self.path, name))
+        self.segment_size = len(payload)
+        # anything appended or deleted while the segment was being written still counts
+        self.lines += len(live) - lines
+        self.dead -= dead
+        self.timeline = sorted(self.events, key=lambda event_id: (self.events[event_id].ts, event_id))
+        self.times = [self.events[event_id].ts for event_id in self.timeline]
+
+class ProfileCache:
+    # rendered /whois embeds by member, dropped whenever the member, their roles or their history change
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.counts = {}
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+    def get(self, guild_id, member_id):
+        entry = self.entries.get(member_id)
+        if entry is None or entry[0] != guild_id:
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(member_id)
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def put(self, guild_id, member_id, embed):
+        self.entries[member_id] = (guild_id, embed)
+        self.entries.move_to_end(member_id)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, member_id):
+        if self.entries.pop(member_id, None) is not None:
+            self.stats["invalidations"] += 1
+
+    def member_count(self, guild):
+        # the count embed only changes when the count does
+        entry = self.counts.get(guild.id)
+        if entry is None or entry[0] != guild.member_count:
+            embed = discord.Embed(
+                title="Member Count",
+                description=f"**{guild.member_count}**",
+                color=discord.Color.dark_red()
+            )
+            entry = self.counts[guild.id] = (guild.member_count, embed)
+        return entry[1]
+
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+def format_warning(event):
+    return f"{event.reason} | <t:{event.ts}:R>"
+
+def trie_pattern(words):
+    # one alternation shaped like a trie, so the regex engine never retries a shared prefix
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        alternatives = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not alternatives:
+            return ""
+        optional = "" in node
+        if len(alternatives) == 1 and not optional:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")" + ("?" if optional else "")
+
+    return build(trie)
+
+class WordFilter:
+    # the banned words file is a json list of words or phrases; edits are picked up without a restart
+    def __init__(self, path):
+        self.path = path
+        self.pattern = None
+        self.words = 0
+        self.mtime = None
+        self.checked = 0
+        self.task = None
+
+    def load(self):
+        try:
+            self.mtime = os.stat(self.path).st_mtime
+            data = load_data(self.path)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Could not load banned words from {self.path}: {e}")
+            return
+        # the file used to be created as {}, which counts as an empty list
+        words = {word.strip().lower() for word in data if isinstance(word, str) and word.strip()}
+        if not words:
+            self.pattern = None
+        else:
+            # lookarounds rather than \b so words that start or end with punctuation still match whole
+            self.pattern = re.compile(rf"(?<!\w){trie_pattern(words)}(?!\w)", re.IGNORECASE)
+        self.words = len(words)
+        logging.info(f"Loaded {self.words} banned words.")
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self.checked < WORDS_RELOAD_INTERVAL:
+            return
+        self.checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self.mtime:
+            # compiling a large list takes a while; keep matching with the old pattern meanwhile
+            self.start_reload()
+
+    def start_reload(self):
+        # one reload at a time; asking again while it runs shares it
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(asyncio.to_thread(self.load))
+        return self.task
+
+    async def reload(self):
+        await asyncio.shield(self.start_reload())
+
+    def search(self, text):
+        self.maybe_reload()
+        if self.pattern is None:
+            return None
+        match = self.pattern.search(text)
+        return match.group(0) if match else None
+
+class TokenBuckets:
+    # one token bucket per key in an LRU, so memory stays bounded however many members post
+    def __init__(self, capacity, per_seconds, max_keys):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+
+    def hit(self, key, now):
+        # takes a token and returns False once the key is out of them
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.capacity, now]
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def reset(self, key):
+        self.buckets.pop(key, None)
+
+class SpamGuard:
+    def __init__(self):
+        self.members = TokenBuckets(SPAM_MESSAGES, SPAM_SECONDS, RATE_TRACKED_KEYS)
+        self.channels = TokenBuckets(FLOOD_MESSAGES, FLOOD_SECONDS, RATE_TRACKED_KEYS)
+        self.joins = {}
+        self.raid_until = {}
+
+    def message(self, member_id, channel_id, now):
+        # returns "spam", "flood" or None; each trips once, then its counter starts over
+        if not self.members.hit(member_id, now):
+            self.members.reset(member_id)
+            return "spam"
+        if not self.channels.hit(channel_id, now):
+            self.channels.reset(channel_id)
+            return "flood"
+        return None
+
+    def join(self, guild_id, now):
+        # returns "raid" when the join rate first crosses the threshold, "raid_mode" while it lasts
+        if now < self.raid_until.get(guild_id, 0):
+            return "raid_mode"
+        counter = self.joins.get(guild_id)
+        if counter is None:
+            counter = self.joins[guild_id] = WindowCounter(RAID_SECONDS)
+        if counter.add(now) >= RAID_JOINS:
+            self.raid_until[guild_id] = now + RAID_MODE_SECONDS
+            return "raid"
+        return None
+
+class ExpiryScheduler:
+    # temp-bans, mutes and flood slowmodes live in BANS_FILE/MUTES_FILE/SLOWMODE_FILE as {guild_id: {user_id: iso time}}
+    # (channel ids for slowmode); one task sleeps until the earliest of them and handles everything due at that point together
+    KINDS = {"ban": BANS_FILE, "mute": MUTES_FILE, "slowmode": SLOWMODE_FILE}
+
+    def __init__(self):
+        # min-heap of (timestamp, kind, guild_id, user_id); entries whose record changed since are skipped
+        self.heap = []
+        # (kind, guild_id, user_id) -> failed attempts at lifting it so far
+        self.attempts = {}
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.stopping = False
+
+    def load(self):
+        for kind, file_name in self.KINDS.items():
+            data = store.get(file_name)
+            if any(isinstance(value, str) for value in data.values()):
+                # the files used to hold {user_id: iso time} for GUILD_ID only
+                legacy = {key: value for key, value in data.items() if isinstance(value, str)}
+                for key in legacy:
+                    del data[key]
+                data.setdefault(str(GUILD_ID), {}).update(legacy)
+                store.mark_dirty(file_name)
+            for guild_id, entries in data.items():
+                for user_id, iso_time in entries.items():
+                    self.heap.append((datetime.fromisoformat(iso_time).timestamp(), kind, int(guild_id), int(user_id)))
+        heapq.heapify(self.heap)
+
+    def schedule(self, kind, guild_id, user_id, until):
+        self.attempts.pop((kind, guild_id, user_id), None)
+        data = store.get(self.KINDS[kind])
+        data.setdefault(str(guild_id), {})[str(user_id)] = until.isoformat()
+        store.mark_dirty(self.KINDS[kind])
+        heapq.heappush(self.heap, (until.timestamp(), kind, guild_id, user_id))
+        self.wakeup.set()
+
+    def cancel(self, kind, guild_id, user_id):
+        # the heap entry is dropped when it comes due
+        self.attempts.pop((kind, guild_id, user_id), None)
+        data = store.get(self.KINDS[kind])
+        entries = data.get(str(guild_id), {})
+        if entries.pop(str(user_id), None) is not None:
+            if not entries:
+                del data[str(guild_id)]
+            store.mark_dirty(self.KINDS[kind])
+
+    def scheduled(self, kind, guild_id, user_id):
+        return str(user_id) in store.get(self.KINDS[kind]).get(str(guild_id), {})
+
+    def current(self, kind, guild_id, user_id, timestamp):
+        iso_time = store.get(self.KINDS[kind]).get(str(guild_id), {}).get(str(user_id))
+        return iso_time is not None and datetime.fromisoformat(iso_time).timestamp() == timestamp
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.stopping = True
+            self.wakeup.set()
+            if not client.is_ready():
+                # still parked in wait_until_ready, which nothing else will wake
+                self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+            self.stopping = False
+
+    async def run(self):
+        await client.wait_until_ready()
+        while not self.stopping:
+            self.wakeup.clear()
+            delay = self.heap[0][0] - time.time() if self.heap else None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # everything overdue goes out in one batch, which is also how downtime is caught up on
+            now = time.time()
+            due = []
+            while self.heap and self.heap[0][0] <= now:
+                entry = heapq.heappop(self.heap)
+                if self.current(*entry[1:], entry[0]):
+                    due.append(entry)
+            try:
+                await self.expire(due)
+            except Exception as e:
+                logging.error(f"Failed to process expiries: {e}")
+
+    async def expire(self, due):
+        actions = {"ban": self.unban, "slowmode": self.end_slowmode}
+        lifted = [entry for entry in due if entry[1] in actions]
+        results = await asyncio.gather(*(actions[kind](guild_id, user_id) for _, kind, guild_id, user_id in lifted), return_exceptions=True)
+        bans = 0
+        for (timestamp, kind, guild_id, user_id), result in zip(lifted, results):
+            # NotFound means it is already gone; anything else but success leaves the record in place
+            if result is None or isinstance(result, discord.NotFound):
+                self.cancel(kind, guild_id, user_id)
+                if kind == "ban":
+                    bans += 1
+                continue
+            attempts = self.attempts.get((kind, guild_id, user_id), 0) + 1
+            if isinstance(result, discord.Forbidden):
+                # retrying won't help until someone fixes the bot's permissions, so only a few tries
+                if attempts >= UNBAN_FORBIDDEN_ATTEMPTS:
+                    logging.warning(f"Giving up on lifting the {kind} on {user_id} in {guild_id} after {attempts} attempts: {result}")
+                    self.cancel(kind, guild_id, user_id)
+                    continue
+            else:
+                logging.error(f"Could not lift the {kind} on {user_id} in {guild_id}, retrying later: {result!r}")
+            delay = min(UNBAN_RETRY_SECONDS * 2 ** (attempts - 1), UNBAN_RETRY_MAX_SECONDS)
+            self.schedule(kind, guild_id, user_id, datetime.now().astimezone() + timedelta(seconds=delay))
+            self.attempts[(kind, guild_id, user_id)] = attempts
+        if bans:
+            logging.info(f"Lifted {bans} expired bans.")
+
+        # discord ends timeouts by itself; expired mutes only need to be dropped from the record
+        for _, kind, guild_id, user_id in due:
+            if kind == "mute":
+                self.cancel(kind, guild_id, user_id)
+
+    async def unban(self, guild_id, user_id):
+        guild = client.get_guild(guild_id)
+        if guild is None:
+            logging.warning(f"Dropping the ban expiry for {user_id} in {guild_id}, which the bot is no longer in.")
+            return
+        await guild.unban(discord.Object(id=user_id), reason="Temporary ban expired")
+
+    async def end_slowmode(self, guild_id, channel_id):
+        channel = client.get_channel(channel_id)
+        # leave it alone if a moderator changed the slowmode since
+        if channel is None or channel.slowmode_delay != FLOOD_SLOWMODE:
+            return
+        await channel.edit(slowmode_delay=0, reason="Flood slowmode expired")
+        logging.info(f"AutoMod turned slowmode off again in {channel.name}.")
+
+class Starboard:
+    # star counts come from the raw gateway events, so the message is only fetched once it may qualify
+    def __init__(self):
+        self.counts = OrderedDict()
+        self.pending = {}
+        self.stats = {"reactions": 0, "fetches": 0, "posts": 0}
+
+    def starred(self, message_id):
+        return str(message_id) in store.get(STARBOARD_FILE)
+
+    def add(self, channel_id, message_id):
+        self.stats["reactions"] += 1
+        if self.starred(message_id):
+            return
+        count = self.counts.pop(message_id, 0) + 1
+        self.counts[message_id] = count
+        if len(self.counts) > STAR_TRACKED_MESSAGES:
+            self.counts.popitem(last=False)
+        if count >= STAR_THRESHOLD and message_id not in self.pending:
+            self.pending[message_id] = asyncio.create_task(self.settle(channel_id, message_id))
+
+    def remove(self, message_id):
+        count = self.counts.get(message_id)
+        if count:
+            self.counts[message_id] = count - 1
+
+    async def settle(self, channel_id, message_id):
+        try:
+            await asyncio.sleep(STAR_DEBOUNCE)
+            channel = client.get_channel(channel_id)
+            if channel is None or self.starred(message_id):
+                return
+            self.stats["fetches"] += 1
+            message = await channel.fetch_message(message_id)
+            # the message may have had stars from before we started counting, or lost some since
+            reaction = discord.utils.get(message.reactions, emoji=STAR_EMOJI)
+            count = reaction.count if reaction else 0
+            if message_id in self.counts:
+                self.counts[message_id] = count
+            if count < STAR_THRESHOLD:
+                return
+            await post_to_starboard(message)
+            # only recorded once it is posted, so a failed post is tried again on the next star
+            starred = store.get(STARBOARD_FILE)
+            starred[str(message_id)] = int(time.time())
+            while len(starred) > STARBOARD_KEPT:
+                del starred[next(iter(starred))]
+            store.mark_dirty(STARBOARD_FILE)
+            self.counts.pop(message_id, None)
+            self.stats["posts"] += 1
+        except Exception as e:
+            logging.error(f"Could not post message {message_id} to the starboard: {e}")
+        finally:
+            del self.pending[message_id]
+
+async def post_to_starboard(message):
+    starboard_channel = client.get_channel(STARBOARD_CHANNEL_ID)
+
+    embed = discord.Embed(description=message.content, color=discord.Color.gold())
+    embed.set_author(name=message.author.display_name, icon_url=message.author.display_avatar.url)
+    embed.add_field(name="Jump to message", value=f"[Click here]({message.jump_url})", inline=False)
+
+    if message.attachments:
+        if any(attachment.url.endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')) for attachment in message.attachments):
+            for attachment in message.attachments:
+                if attachment.url.endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
+                    embed.set_image(url=attachment.url)
+                    await starboard_channel.send(embed=embed)
+                    return
+        else:
+            await starboard_channel.send(embed=embed)
+            for attachment in message.attachments:
+                await starboard_channel.send(attachment.url)
+            return
+    await starboard_channel.send(embed=embed)
 
-for file_name in [ROLES_FILE, BANS_FILE, MUTES_FILE, WARNINGS_FILE, BANNED_WORDS, NOTES_FILE]:
+for file_name in [ROLES_FILE, BANS_FILE, MUTES_FILE, STARBOARD_FILE, SLOWMODE_FILE]:
     if not os.path.exists(file_name):
         with open(file_name, "w") as f:
             json.dump({}, f)
+if not os.path.exists(BANNED_WORDS):
+    with open(BANNED_WORDS, "w") as f:
+        json.dump([], f)
+
+store = ModerationStore([ROLES_FILE, BANS_FILE, MUTES_FILE, STARBOARD_FILE, SLOWMODE_FILE])
+modlog = ModerationLog(MODLOG_DIR)
+word_filter = WordFilter(BANNED_WORDS)
+expiries = ExpiryScheduler()
+starboard = Starboard()
+spam_guard = SpamGuard()
+profiles = ProfileCache(PROFILE_CACHE_SIZE)
 
 @client.event
 async def on_ready():
     await tree.sync()
     logging.info("Bot is ready and commands are synced globally!")
-    await schedule_unbans()
-
-async def schedule_unbans():
-    bans_data = load_data(BANS_FILE)
-    for user_id, unban_time_str in bans_data.items():
-        unban_time = datetime.fromisoformat(unban_time_str)
-        now = datetime.now()
-        if unban_time > now:
-            delay = (unban_time - now).total_seconds()
-            client.loop.create_task(unban_user(user_id, delay))
-
-async def unban_user(user_id, delay):
-    await asyncio.sleep(delay)
-    guild = client.get_guild(GUILD_ID)
-    user = await client.fetch_user(user_id)
-    await guild.unban(user)
-    bans_data = load_data(BANS_FILE)
-    if str(user_id) in bans_data:
-        del bans_data[str(user_id)]
-        save_data(BANS_FILE, bans_data)
 
 @tree.command(name="roleadd", description="Add a role to a member")
 @app_commands.describe(member="The member to add a role to", role="The role to add")
 async def roleadd(interaction: discord.Interaction, member: discord.Member, role: discord.Role):
     if interaction.user.guild_permissions.manage_roles:
         await member.add_roles(role)
-        roles_data = load_data(ROLES_FILE)
+        roles_data = store.get(ROLES_FILE)
         if str(member.id) not in roles_data:
             roles_data[str(member.id)] = []
         if role.id not in roles_data[str(member.id)]:
             roles_data[str(member.id)].append(role.id)
-        save_data(ROLES_FILE, roles_data)
+        store.mark_dirty(ROLES_FILE)
+        modlog.append("role_add", interaction.guild_id, member.id, interaction.user.id, role.name)
         await interaction.response.send_message(f"Role {role.name} added to {member.mention}")
     else:
         await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
@@ -117,19 +893,18 @@ async def ban(interaction: discord.Interaction, member: discord.Member, duration
         await member.send(f"You have been banned for: {duration.value} because of {reason}\n-# To appeal, click [here](<https://example.com>)") # input your appeals form here
         await member.ban(reason=reason)
         await interaction.response.send_message(f"{member.mention} has been banned for: {reason} ({duration.name})")
+        modlog.append("ban", interaction.guild_id, member.id, interaction.user.id, f"{reason} ({duration.name})")
         if duration.value != "Permanent":
-            now = datetime.now()
+            now = datetime.now().astimezone()
             if duration.value == "1d":
                 unban_time = now + timedelta(days=1)
             elif duration.value == "7d":
                 unban_time = now + timedelta(days=7)
             elif duration.value == "14d":
                 unban_time = now + timedelta(days=14)
-            bans_data = load_data(BANS_FILE)
-            bans_data[str(member.id)] = unban_time.isoformat()
-            save_data(BANS_FILE, bans_data)
-            delay = (unban_time - now).total_seconds()
-            client.loop.create_task(unban_user(member.id, delay))
+            expiries.schedule("ban", interaction.guild_id, member.id, unban_time)
+        else:
+            expiries.cancel("ban", interaction.guild_id, member.id)
     else:
         await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
 
@@ -139,6 +914,7 @@ async def kick(interaction: discord.Interaction, member: discord.Member, reason:
     if interaction.user.guild_permissions.kick_members:
         await member.kick(reason=reason)
         await interaction.response.send_message(f"{member.mention} has been kicked for: {reason}")
+        modlog.append("kick", interaction.guild_id, member.id, interaction.user.id, reason)
     else:
         await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
 
@@ -146,15 +922,7 @@ async def kick(interaction: discord.Interaction, member: discord.Member, reason:
 @app_commands.describe(member="The member to warn", reason="The reason for the warning")
 async def warn(interaction: discord.Interaction, member: discord.Member, reason: str):
     if interaction.user.guild_permissions.manage_messages:
-        current_timestamp = int(time.time())
-
-        warnings_data = load_data(WARNINGS_FILE)
-        if str(member.id) not in warnings_data:
-            warnings_data[str(member.id)] = []
-
-        warnings_data[str(member.id)].append(f"{reason} | <t:{current_timestamp}:R>")
-
-        save_data(WARNINGS_FILE, warnings_data)
+        modlog.append("warn", interaction.guild_id, member.id, interaction.user.id, reason)
 
         try:
             await member.send(f"You have been warned for: {reason}")
@@ -169,8 +937,7 @@ async def warn(interaction: discord.Interaction, member: discord.Member, reason:
 @tree.command(name="warns", description="View warnings for a member")
 @app_commands.describe(member="The member to view warnings for")
 async def warns(interaction: discord.Interaction, member: discord.Member):
-    warnings_data = load_data(WARNINGS_FILE)
-    user_warnings = warnings_data.get(str(member.id), [])
+    user_warnings = modlog.history(member.id, "warn")
 
     if not user_warnings:
         await interaction.response.send_message(f"{member.display_name} has no warnings.", ephemeral=True)
@@ -178,8 +945,8 @@ async def warns(interaction: discord.Interaction, member: discord.Member):
 
     embed = discord.Embed(title=f"Warnings for {member.display_name}", color=discord.Color.dark_red())
     for i, warning in enumerate(user_warnings, 1):
-        reason, timestamp = warning.rsplit(' | ', 1)
-        embed.add_field(name=f"Warning {i}", value=f"**Reason:** {reason}\n**Timestamp:** {timestamp}", inline=False)
+        embed.add_field(name=f"Warning {i}", value=f"**Reason:** {warning.reason}\n**Timestamp:** <t:{warning.ts}:R>", inline=False)
+    embed.set_footer(text=f"{modlog.count(member.id, 'warn', since=int(time.time()) - 30 * 86400)} in the last 30 days")
 
     await interaction.response.send_message(embed=embed)
 
@@ -187,8 +954,7 @@ async def warns(interaction: discord.Interaction, member: discord.Member):
 @app_commands.describe(member="The member to delete a warning from", warning_index="The index of the warning to delete")
 async def delwarn(interaction: discord.Interaction, member: discord.Member, warning_index: int):
     if interaction.user.guild_permissions.manage_messages:
-        warnings_data = load_data(WARNINGS_FILE)
-        user_warnings = warnings_data.get(str(member.id), [])
+        user_warnings = modlog.history(member.id, "warn")
 
         if not user_warnings:
             await interaction.response.send_message(f"{member.display_name} has no warnings.", ephemeral=True)
@@ -198,31 +964,150 @@ async def delwarn(interaction: discord.Interaction, member: discord.Member, warn
             await interaction.response.send_message(f"Invalid warning index. Please provide a number between 1 and {len(user_warnings)}.", ephemeral=True)
             return
 
-        removed_warning = user_warnings.pop(warning_index - 1)
-        save_data(WARNINGS_FILE, warnings_data)
+        removed_warning = user_warnings[warning_index - 1]
+        modlog.delete(removed_warning.id)
 
-        await interaction.response.send_message(f"Removed warning {warning_index} from {member.mention}: {removed_warning}")
+        await interaction.response.send_message(f"Removed warning {warning_index} from {member.mention}: {format_warning(removed_warning)}")
     else:
         await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
 
+async def purge_messages(channel, limit, check=None, before=None, after=None, results=None):
+    # history is streamed newest first (asked for explicitly: with `after` set, discord.py defaults to oldest first
+    # and `limit` would count from the old end) and filtered as it arrives; matches go out in bulk deletes
+    # of up to PURGE_BATCH while the next page is fetched. bulk delete refuses messages older than
+    # two weeks, and since history is newest first everything after the first such message goes one by one
+    results = {"checked": 0, "deleted": 0} if results is None else results
+    cutoff = discord.utils.utcnow() - PURGE_MAX_AGE
+    deleted = []
+    batch = []
+    pending = None
+
+    async def delete(messages):
+        await channel.delete_messages(messages)
+        deleted.extend(messages)
+        results["deleted"] += len(messages)
+
+    async def submit():
+        nonlocal pending, batch
+        if pending is not None:
+            await pending
+        pending = asyncio.create_task(delete(batch))
+        batch = []
+
+    try:
+        async for message in channel.history(limit=limit, before=before, after=after, oldest_first=False):
+            results["checked"] += 1
+            if check is not None and not check(message):
+                continue
+            if message.created_at >= cutoff:
+                batch.append(message)
+                if len(batch) == PURGE_BATCH:
+                    await submit()
+                continue
+            if batch:
+                await submit()
+            if pending is not None:
+                await pending
+                pending = None
+            try:
+                await message.delete()
+            except discord.NotFound:
+                continue
+            deleted.append(message)
+            results["deleted"] += 1
+        if batch:
+            await submit()
+        if pending is not None:
+            await pending
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+    return deleted
+
+def purge_filter(author, bots_only, contains_links, pattern):
+    def check(message):
+        if author is not None and message.author.id != author.id:
+            return False
+        if bots_only and not message.author.bot:
+            return False
+        if contains_links and not LINK_PATTERN.search(message.content):
+            return False
+        if pattern is not None and not pattern.search(message.content):
+            return False
+        return True
+    return check
+
+def parse_message_id(text):
+    # message links and raw ids both end in the message id
+    match = re.search(r"(\d{15,20})\s*$", text or "")
+    return discord.Object(id=int(match.group(1))) if match else None
+
 @tree.command(name="purge", description="Bulk delete messages")
-@app_commands.describe(number_of_messages="The number of messages to delete")
-async def purge(interaction: discord.Interaction, number_of_messages: int):
+@app_commands.describe(
+    number_of_messages="How many recent messages to go through",
+    author="Only delete messages from this member",
+    bots_only="Only delete messages from bots",
+    contains_links="Only delete messages with links",
+    pattern="Only delete messages matching this regular expression",
+    before="Only delete messages before this message (ID or link)",
+    after="Only delete messages after this message (ID or link)"
+)
+async def purge(interaction: discord.Interaction, number_of_messages: int, author: Optional[discord.Member] = None, bots_only: Optional[bool] = False,
+                contains_links: Optional[bool] = False, pattern: Optional[str] = None, before: Optional[str] = None, after: Optional[str] = None):
     if interaction.user.guild_permissions.manage_messages:
         if number_of_messages <= 0:
             await interaction.response.send_message("Please specify a positive number of messages to delete.", ephemeral=True)
             return
 
-        await interaction.response.defer(ephemeral=False)
+        compiled = None
+        if pattern:
+            try:
+                compiled = re.compile(pattern, re.IGNORECASE)
+            except re.error as e:
+                await interaction.response.send_message(f"Invalid pattern: {e}", ephemeral=True)
+                return
+        before_message = parse_message_id(before)
+        after_message = parse_message_id(after)
+        if (before and before_message is None) or (after and after_message is None):
+            await interaction.response.send_message("Please give a message ID or link for before/after.", ephemeral=True)
+            return
+        # the deferred reply lands in this channel too; starting from the interaction keeps it out of the purge
+        if before_message is None or before_message.id > interaction.id:
+            before_message = discord.Object(id=interaction.id)
+
+        results = {"checked": 0, "deleted": 0}
 
-        deleted = await interaction.channel.purge(limit=number_of_messages + 1)
+        def summary():
+            return f"{results['deleted']} messages deleted of {results['checked']} checked."
 
-        num_deleted = len(deleted)
+        async def report_progress():
+            while True:
+                await asyncio.sleep(BULK_PROGRESS_INTERVAL)
+                await interaction.edit_original_response(content=f":hourglass: | {summary()} Working...")
+
+        await interaction.response.defer(ephemeral=False)
+        progress = asyncio.create_task(report_progress())
+        try:
+            await purge_messages(interaction.channel, number_of_messages, purge_filter(author, bots_only, contains_links, compiled),
+                                 before=before_message, after=after_message, results=results)
+        except discord.Forbidden:
+            await interaction.edit_original_response(content=f":x: | Missing permissions. {summary()}")
+            return
+        finally:
+            progress.cancel()
 
-        await interaction.channel.send(f":white_check_mark: | {num_deleted - 1} messages have been deleted.")
+        await interaction.edit_original_response(content=f":white_check_mark: | {summary()}")
+        logging.info(f"Purge in {interaction.channel.name}: {summary()} Run by {interaction.user}.")
     else:
         await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
 
+async def timeout_member(guild_id, member, duration, reason, moderator_id):
+    unmute_time = datetime.now().astimezone() + duration
+    await member.edit(timed_out_until=unmute_time)
+
+    expiries.schedule("mute", guild_id, member.id, unmute_time)
+    modlog.append("mute", guild_id, member.id, moderator_id, f"{reason} ({duration})")
+
 @tree.command(name="mute", description="Mute a member")
 @app_commands.describe(member="The member to mute", reason="The reason for the mute", days="Days to mute", hours="Hours to mute", minutes="Minutes to mute")
 async def mute(interaction: discord.Interaction, member: discord.Member, reason: Optional[str] = "No reason provided", days: Optional[int] = 0, hours: Optional[int] = 0, minutes: Optional[int] = 0):
@@ -242,15 +1127,134 @@ async def mute(interaction: discord.Interaction, member: discord.Member, reason:
             await interaction.response.send_message("Maximum mute duration is 30 days.", ephemeral=True)
             return
 
-        now = datetime.now().astimezone()
-        unmute_time = now + total_duration
-
-        await member.edit(timed_out_until=unmute_time)
+        await timeout_member(interaction.guild_id, member, total_duration, reason, interaction.user.id)
         await interaction.response.send_message(f"{member.mention} has been muted for: {reason} (Duration: `{total_duration}`)")
+    else:
+        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+
+def resolve_targets(interaction, members_text, joined_within):
+    # mentions or raw ids in free text, plus everyone who joined in the last `joined_within` minutes
+    target_ids = {int(user_id) for user_id in re.findall(r"\d{15,20}", members_text or "")}
+    if joined_within:
+        cutoff = datetime.now().astimezone() - timedelta(minutes=joined_within)
+        target_ids.update(member.id for member in interaction.guild.members if member.joined_at and member.joined_at >= cutoff)
+    target_ids.discard(interaction.user.id)
+    if client.user:
+        target_ids.discard(client.user.id)
+    return sorted(target_ids)
+
+async def run_bulk(interaction, label, target_ids, action):
+    # action(user_id) returns False to skip a target; requests run BULK_CONCURRENCY at a time
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    results = {"done": 0, "skipped": 0, "failed": 0}
+    failures = []
+
+    async def worker(user_id):
+        async with semaphore:
+            for attempt in range(BULK_RETRIES + 1):
+                try:
+                    results["done" if await action(user_id) is not False else "skipped"] += 1
+                    return
+                except Exception as e:
+                    if isinstance(e, discord.HTTPException) and e.status == 429 and attempt < BULK_RETRIES:
+                        await asyncio.sleep(getattr(e, "retry_after", None) or 2 ** attempt)
+                        continue
+                    # one bad target must not take the rest of the batch down with it
+                    logging.error(f"{label} failed for {user_id}: {e!r}")
+                    results["failed"] += 1
+                    failures.append(user_id)
+                    return
+
+    def summary():
+        return f"{label}: {results['done']} done, {results['skipped']} skipped, {results['failed']} failed of {len(target_ids)}."
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(BULK_PROGRESS_INTERVAL)
+            try:
+                await interaction.edit_original_response(content=summary() + " Working...")
+            except discord.HTTPException as e:
+                # a missed progress update is fine, the final summary still goes out
+                logging.warning(f"Could not update the {label} progress: {e}")
+
+    await interaction.response.defer()
+    progress = asyncio.create_task(report_progress())
+    try:
+        await asyncio.gather(*(worker(user_id) for user_id in target_ids))
+    finally:
+        progress.cancel()
+        text = summary()
+        if failures:
+            text += "\nFailed: " + " ".join(f"<@{user_id}>" for user_id in failures[:50])
+        await interaction.edit_original_response(content=text[:2000])
+        logging.info(f"{summary()} Run by {interaction.user}.")
+    return results
+
+@tree.command(name="massban", description="Ban many members at once")
+@app_commands.describe(members="Mentions or IDs of the members to ban", joined_within="Also ban everyone who joined in the last N minutes", reason="The reason for the ban")
+async def massban(interaction: discord.Interaction, members: Optional[str] = None, joined_within: Optional[int] = None, reason: Optional[str] = "No reason provided"):
+    if interaction.user.guild_permissions.ban_members:
+        target_ids = resolve_targets(interaction, members, joined_within)
+        if not target_ids:
+            await interaction.response.send_message("No members matched.", ephemeral=True)
+            return
+
+        async def ban_one(user_id):
+            # by id, so accounts that already left are banned too
+            await interaction.guild.ban(discord.Object(id=user_id), reason=reason)
+            expiries.cancel("ban", interaction.guild_id, user_id)
+            modlog.append("ban", interaction.guild_id, user_id, interaction.user.id, f"{reason} (Permanent)")
+
+        await run_bulk(interaction, "Mass ban", target_ids, ban_one)
+    else:
+        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+
+@tree.command(name="masstimeout", description="Time out many members at once")
+@app_commands.describe(members="Mentions or IDs of the members to time out", joined_within="Also time out everyone who joined in the last N minutes", minutes="Minutes to time out", reason="The reason for the timeout")
+async def masstimeout(interaction: discord.Interaction, members: Optional[str] = None, joined_within: Optional[int] = None, minutes: Optional[int] = 60, reason: Optional[str] = "No reason provided"):
+    if interaction.user.guild_permissions.mute_members:
+        duration = timedelta(minutes=minutes)
+        if duration < timedelta(minutes=5) or duration > timedelta(days=30):
+            await interaction.response.send_message("Timeouts must be between 5 minutes and 30 days.", ephemeral=True)
+            return
+        target_ids = resolve_targets(interaction, members, joined_within)
+        if not target_ids:
+            await interaction.response.send_message("No members matched.", ephemeral=True)
+            return
+
+        async def timeout_one(user_id):
+            member = interaction.guild.get_member(user_id)
+            if member is None:
+                return False
+            await timeout_member(interaction.guild_id, member, duration, reason, interaction.user.id)
+
+        await run_bulk(interaction, "Mass timeout", target_ids, timeout_one)
+    else:
+        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+
+@tree.command(name="massrole", description="Add a role to many members at once")
+@app_commands.describe(role="The role to add", members="Mentions or IDs of the members", joined_within="Also include everyone who joined in the last N minutes")
+async def massrole(interaction: discord.Interaction, role: discord.Role, members: Optional[str] = None, joined_within: Optional[int] = None):
+    if interaction.user.guild_permissions.manage_roles:
+        target_ids = resolve_targets(interaction, members, joined_within)
+        if not target_ids:
+            await interaction.response.send_message("No members matched.", ephemeral=True)
+            return
+
+        roles_data = store.get(ROLES_FILE)
+
+        async def add_role(user_id):
+            member = interaction.guild.get_member(user_id)
+            if member is None:
+                return False
+            await member.add_roles(role)
+            role_ids = roles_data.setdefault(str(user_id), [])
+            if role.id not in role_ids:
+                role_ids.append(role.id)
+            store.mark_dirty(ROLES_FILE)
+            modlog.append("role_add", interaction.guild_id, user_id, interaction.user.id, role.name)
 
-        mutes_data = load_data(MUTES_FILE)
-        mutes_data[str(member.id)] = unmute_time.isoformat()
-        save_data(MUTES_FILE, mutes_data)
+        await run_bulk(interaction, "Mass role", target_ids, add_role)
     else:
         await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
 
@@ -258,12 +1262,8 @@ async def mute(interaction: discord.Interaction, member: discord.Member, reason:
 @app_commands.describe(member="The member to add a note to", note="The note to add")
 async def note(interaction: discord.Interaction, member: discord.Member, note: str):
     if interaction.user.guild_permissions.manage_messages:
-        notes_data = load_data(NOTES_FILE)
-        if str(member.id) not in notes_data:
-            notes_data[str(member.id)] = []
         formatted_note = f'{note} - {interaction.user.name}#{interaction.user.discriminator}'
-        notes_data[str(member.id)].append(formatted_note)
-        save_data(NOTES_FILE, notes_data)
+        modlog.append("note", interaction.guild_id, member.id, interaction.user.id, formatted_note)
         await interaction.response.send_message(f"Note added to {member.mention}")
     else:
         await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
@@ -271,8 +1271,7 @@ async def note(interaction: discord.Interaction, member: discord.Member, note: s
 @tree.command(name="notes", description="View notes for a member")
 @app_commands.describe(member="The member to view notes for")
 async def notes(interaction: discord.Interaction, member: discord.Member):
-    notes_data = load_data(NOTES_FILE)
-    user_notes = notes_data.get(str(member.id), [])
+    user_notes = [event.reason for event in modlog.history(member.id, "note")]
 
     if not user_notes:
         await interaction.response.send_message(f"{member.display_name} has no notes.", ephemeral=True)
@@ -284,45 +1283,50 @@ async def notes(interaction: discord.Interaction, member: discord.Member):
 
     await interaction.response.send_message(embed=embed)
 
+def render_profile(guild, member):
+    nickname = member.display_name
+    username = member.name
+    user_id = member.id
+    roles = [role.mention for role in member.roles if role != guild.default_role]
+
+    history = modlog.history(member.id)
+    user_warnings = [format_warning(event) for event in history if event.kind == "warn"]
+    user_notes = [event.reason for event in history if event.kind == "note"]
+
+    discord_join_date = member.created_at.strftime("%d-%m-%Y")
+    server_join_date = member.joined_at.strftime("%d-%m-%Y")
+
+    embed = discord.Embed(
+        title=f"Information for {nickname}",
+        color=discord.Color.dark_red()
+    )
+    embed.add_field(name="Username", value=f"**{nickname}** `(@{username})`", inline=False)
+    embed.add_field(name="User ID", value=f"```{user_id}```", inline=False)
+    embed.add_field(name="Roles", value=", ".join(roles) if roles else "No roles", inline=False)
+
+    if user_warnings:
+        embed.add_field(name="Warnings", value="\n".join(user_warnings), inline=False)
+    else:
+        embed.add_field(name="Warnings", value="No warnings", inline=False)
+
+    if user_notes:
+        embed.add_field(name="Notes", value="\n".join(user_notes), inline=False)
+    else:
+        embed.add_field(name="Notes", value="No notes", inline=False)
+
+    embed.add_field(name="Discord Join Date", value=discord_join_date, inline=True)
+    embed.add_field(name="Server Join Date", value=server_join_date, inline=True)
+    return embed
+
 @tree.command(name="whois", description="Get information about a member")
 @app_commands.describe(member="The member to get information about")
 async def whois(interaction: discord.Interaction, member: discord.Member):
     if interaction.user.guild_permissions.manage_messages:
 
-        nickname = member.display_name
-        username = member.name
-        user_id = member.id
-        roles = [role.mention for role in member.roles if role != interaction.guild.default_role]
-
-        warnings_data = load_data(WARNINGS_FILE)
-        user_warnings = warnings_data.get(str(member.id), [])
-
-        notes_data = load_data(NOTES_FILE)
-        user_notes = notes_data.get(str(member.id), [])
-
-        discord_join_date = member.created_at.strftime("%d-%m-%Y")
-        server_join_date = member.joined_at.strftime("%d-%m-%Y")
-
-        embed = discord.Embed(
-            title=f"Information for {nickname}",
-            color=discord.Color.dark_red()
-        )
-        embed.add_field(name="Username", value=f"**{nickname}** `(@{username})`", inline=False)
-        embed.add_field(name="User ID", value=f"```{user_id}```", inline=False)
-        embed.add_field(name="Roles", value=", ".join(roles) if roles else "No roles", inline=False)
-
-        if user_warnings:
-            embed.add_field(name="Warnings", value="\n".join(user_warnings), inline=False)
-        else:
-            embed.add_field(name="Warnings", value="No warnings", inline=False)
-
-        if user_notes:
-            embed.add_field(name="Notes", value="\n".join(user_notes), inline=False)
-        else:
-            embed.add_field(name="Notes", value="No notes", inline=False)
-
-        embed.add_field(name="Discord Join Date", value=discord_join_date, inline=True)
-        embed.add_field(name="Server Join Date", value=server_join_date, inline=True)
+        embed = profiles.get(interaction.guild_id, member.id)
+        if embed is None:
+            embed = render_profile(interaction.guild, member)
+            profiles.put(interaction.guild_id, member.id, embed)
 
         await interaction.response.send_message(embed=embed)
     else:
@@ -332,58 +1336,101 @@ async def whois(interaction: discord.Interaction, member: discord.Member):
 async def membercount(interaction: discord.Interaction):
     guild = interaction.guild
     if guild:
-        total_members = guild.member_count
-        embed = discord.Embed(
-            title="Member Count",
-            description=f"**{total_members}**",
-            color=discord.Color.dark_red()
-        )
-        await interaction.response.send_message(embed=embed)
+        await interaction.response.send_message(embed=profiles.member_count(guild))
     else:
         await interaction.response.send_message("Could not retrieve the member count.", ephemeral=True)
 
-# @client.event
-# async def on_message(message):
-#     if message.author.bot:
-#         return
-#     if any(pattern.search(message.content) for pattern in banned_word_patterns):
-#         try:
-#             await message.delete()
-#             await message.channel.send(f"{message.author.mention}, your message contained banned words and has been deleted.")
-#         except discord.Forbidden:
-#             logging.error(f"Could not delete message in {message.channel.name} by {message.author.display_name}.")
-#         return
+@client.event
+async def on_message(message):
+    if message.author.bot or message.guild is None:
+        return
+    if word_filter.search(message.content):
+        try:
+            await message.delete()
+            await message.channel.send(f"{message.author.mention}, your message contained banned words and has been deleted.")
+        except discord.Forbidden:
+            logging.error(f"Could not delete message in {message.channel.name} by {message.author.display_name}.")
+        return
+
+    verdict = spam_guard.message(message.author.id, message.channel.id, time.monotonic())
+    if verdict == "spam":
+        await handle_spam(message)
+    elif verdict == "flood":
+        await handle_flood(message.channel)
+
+def automod_user_id():
+    return client.user.id if client.user else 0
+
+async def handle_spam(message):
+    member = message.author
+    try:
+        await timeout_member(message.guild.id, member, SPAM_TIMEOUT, "AutoMod: message spam", automod_user_id())
+        deleted = await purge_messages(message.channel, SPAM_PURGE_SCAN, lambda m: m.author.id == member.id)
+        await message.channel.send(f"{member.mention} has been muted for spamming ({len(deleted)} messages removed).")
+    except discord.Forbidden:
+        logging.error(f"Could not act on spam by {member.display_name} in {message.channel.name}.")
+        return
+    logging.warning(f"AutoMod muted {member} for spamming in {message.channel.name}.")
+
+async def handle_flood(channel):
+    until = datetime.now().astimezone() + FLOOD_SLOWMODE_DURATION
+    if channel.slowmode_delay == FLOOD_SLOWMODE and expiries.scheduled("slowmode", channel.guild.id, channel.id):
+        # still on from an earlier flood; only push back when it ends
+        expiries.schedule("slowmode", channel.guild.id, channel.id, until)
+        return
+    if channel.slowmode_delay:
+        # a moderator already set slowmode here
+        return
+    try:
+        await channel.edit(slowmode_delay=FLOOD_SLOWMODE, reason="AutoMod: message flood")
+    except discord.Forbidden:
+        logging.error(f"Could not enable slowmode in {channel.name}.")
+        return
+    expiries.schedule("slowmode", channel.guild.id, channel.id, until)
+    logging.warning(f"AutoMod enabled {FLOOD_SLOWMODE}s slowmode in {channel.name} for {FLOOD_SLOWMODE_DURATION} after a message flood.")
+
+@tree.command(name="reloadwords", description="Reload the banned words list")
+async def reloadwords(interaction: discord.Interaction):
+    if interaction.user.guild_permissions.manage_messages:
+        await word_filter.reload()
+        await interaction.response.send_message(f"Loaded {word_filter.words} banned words.", ephemeral=True)
+    else:
+        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
 
 @client.event
 async def on_raw_reaction_add(payload):
     if payload.emoji.name == STAR_EMOJI:
-        channel = client.get_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
-        if message.id not in starred_messages:
-            reaction = discord.utils.get(message.reactions, emoji=STAR_EMOJI)
-            if reaction and reaction.count >= 3:
-                starred_messages.add(message.id)
-                starboard_channel = client.get_channel(STARBOARD_CHANNEL_ID)
-
-                embed = discord.Embed(description=message.content, color=discord.Color.gold())
-                embed.set_author(name=message.author.display_name, icon_url=message.author.avatar.url)
-                embed.add_field(name="Jump to message", value=f"[Click here]({message.jump_url})", inline=False)
-
-                if message.attachments:
-                    if any(attachment.url.endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')) for attachment in message.attachments):
-                        for attachment in message.attachments:
-                            if attachment.url.endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp')):
-                                embed.set_image(url=attachment.url)
-                                await starboard_channel.send(embed=embed)
-                                return
-                    else:
-                        await starboard_channel.send(embed=embed)
-                        for attachment in message.attachments:
-                            await starboard_channel.send(attachment.url)
-                        return
-                await starboard_channel.send(embed=embed)
+        starboard.add(payload.channel_id, payload.message_id)
+
+@client.event
+async def on_raw_reaction_remove(payload):
+    if payload.emoji.name == STAR_EMOJI:
+        starboard.remove(payload.message_id)
+
+@client.event
+async def on_member_update(before, after):
+    profiles.invalidate(after.id)
+
+@client.event
+async def on_user_update(before, after):
+    profiles.invalidate(after.id)
+
+@client.event
+async def on_member_remove(member):
+    profiles.invalidate(member.id)
+
 @client.event
 async def on_member_join(member):
+    verdict = spam_guard.join(member.guild.id, time.monotonic())
+    if verdict == "raid":
+        logging.warning(f"AutoMod detected a join raid in {member.guild.name}; timing out new members for {RAID_MODE_SECONDS}s.")
+    if verdict is not None:
+        try:
+            await timeout_member(member.guild.id, member, SPAM_TIMEOUT, "AutoMod: join raid", automod_user_id())
+        except discord.Forbidden:
+            logging.error(f"Could not time out {member.display_name} during a join raid.")
+        return
+
     welcome_channel = client.get_channel(WELCOME_CHANNEL_ID)
 
     if welcome_channel:
@@ -406,14 +1453,17 @@ async def on_member_join(member):
 @tree.command(name="serverstatus", description="Get the current status of the server")
 async def serverstatus(interaction: discord.Interaction):
     if interaction.user.guild_permissions.manage_messages:
-        # count recent errors and warnings
-        recent_errors = [log for log in log_capture if 'ERROR' in log][:100]
-        recent_warnings = [log for log in log_capture if 'WARNING' in log][:100]
+        error_rates = log_capture.rates("ERROR")
+        warning_rates = log_capture.rates("WARNING")
+        recent_errors = log_capture.recent("ERROR", 5)
+        recent_warnings = log_capture.recent("WARNING", 5)
 
+        # "recent" is whatever the shortest configured window covers
+        window = min(LOG_RATE_WINDOWS, key=lambda name: LOG_RATE_WINDOWS[name][0], default=None)
         status = "🟢 All systems operational"
-        if recent_errors:
+        if error_rates.get(window):
             status = "🔴 There are recent errors"
-        elif recent_warnings:
+        elif warning_rates.get(window):
             status = "🟠 There are recent warnings"
 
         embed = discord.Embed(
@@ -421,9 +1471,11 @@ async def serverstatus(interaction: discord.Interaction):
             color=discord.Color.green() if status == "🟢 All systems operational" else discord.Color.red() if status == "🔴 There are recent errors" else discord.Color.orange()
         )
         embed.add_field(name="Status", value=status, inline=False)
+        embed.add_field(name="Errors", value=" | ".join(f"{count} in {window}" for window, count in error_rates.items()), inline=True)
+        embed.add_field(name="Warnings", value=" | ".join(f"{count} in {window}" for window, count in warning_rates.items()), inline=True)
 
         if recent_warnings:
-            warnings_text = "\n".join(recent_warnings[-5:])
+            warnings_text = "\n".join(recent_warnings)
             if len(warnings_text) > 1024:
                 warnings_text = warnings_text[:1021] + "..."
             embed.add_field(name="Recent Warnings", value=warnings_text, inline=False)
@@ -431,16 +1483,18 @@ async def serverstatus(interaction: discord.Interaction):
             embed.add_field(name="Recent Warnings", value="No recent warnings", inline=False)
 
         if recent_errors:
-            errors_text = "\n".join(recent_errors[-5:])
+            errors_text = "\n".join(recent_errors)
             if len(errors_text) > 1024:
                 errors_text = errors_text[:1021] + "..."
             embed.add_field(name="Recent Errors", value=errors_text, inline=False)
         else:
             embed.add_field(name="Recent Errors", value="No recent errors", inline=False)
 
+        embed.set_footer(text=f"Profile cache: {len(profiles.entries)} members, {profiles.hit_rate():.0%} hits")
         await interaction.response.send_message(embed=embed)
     else:
         await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
 
-token = os.getenv("TOKEN")
-client.run(token)
+if __name__ == "__main__":
+    token = os.getenv("TOKEN")
+    client.run(token)
@@ -0,0 +1,376 @@
+import argparse
+import asyncio
+import gc
+import itertools
+import random
+import tempfile
+import time
+import tracemalloc
+import weakref
+
+from harness import FakeAudio, FakeGuild, FakeInteraction, FakeMember, FakeRole, FakeVoiceClient, FakeYoutubeDL, invoke, load_bot
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+async def bench_soak(bot, args):
+    bot.PLAYER_IDLE_TIMEOUT = args.idle / 1000
+    bot.discord.FFmpegPCMAudio = FakeAudio
+    ytdl = FakeYoutubeDL([])
+
+    def track(guild_id, i):
+        # already extracted, so the soak measures the players and not yt-dlp
+        entry = bot.track_entry(ytdl.info(f"v{i:010d}"))
+        entry["title"] = f"{guild_id}:{i}"
+        return bot.Track.from_entry(entry, entry["webpage_url"])
+    tracemalloc.start()
+    gc.collect()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    for round_number in range(args.rounds):
+        voice_clients = {}
+        refs = []
+        start = time.perf_counter()
+        for guild_id in range(args.guilds):
+            voice_client = voice_clients[guild_id] = FakeVoiceClient(guild_id, args.track / 1000)
+            player = bot.players.get_or_create(guild_id)
+            player.voice_client = voice_client
+            player.enqueue(track(guild_id, i) for i in range(args.tracks))
+            refs.append(weakref.ref(player))
+            if guild_id % 100 == 0:
+                await asyncio.sleep(0)
+        live = len(bot.players.players)
+        tasks = len(asyncio.all_tasks())
+        peak = tracemalloc.get_traced_memory()[0]
+
+        # every track ends up on its own guild's voice client, in order
+        while any(len(voice_client.played) < args.tracks for voice_client in voice_clients.values()):
+            await asyncio.sleep(args.track / 1000)
+        played = time.perf_counter() - start
+        misrouted = sum(1 for guild_id, voice_client in voice_clients.items()
+                        if [source.title for source in voice_client.played] != [f"{guild_id}:{i}" for i in range(args.tracks)])
+
+        while bot.players.players:
+            await asyncio.sleep(args.idle / 1000)
+        idle = time.perf_counter() - start
+        del player, voice_client, voice_clients
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+        alive = sum(1 for ref in refs if ref() is not None)
+
+        print(f"round {round_number + 1}: {args.guilds} guilds x {args.tracks} tracks played in {played:.2f}s, all players idle and dropped after {idle:.2f}s")
+        print(f"  {live} players and {tasks} tasks while playing, {len(bot.players.players)} players and {len(asyncio.all_tasks())} tasks after")
+        print(f"  memory: {(peak - baseline) / 1024:.0f} KiB while playing, {(after - baseline) / 1024:.0f} KiB after idle; {alive} players not collected, {misrouted} guilds heard another guild's tracks")
+    stats = bot.players.stats
+    print(f"registry: {stats['created']} players created, {stats['closed']} closed; {FakeAudio.live} audio sources still open")
+
+async def bench_playlist(bot, args):
+    bot.discord.FFmpegPCMAudio = FakeAudio
+    tracks = [f"v{i:010d}" for i in range(args.size)]
+    bot.ytdl = bot.ytdl_flat = FakeYoutubeDL(tracks, args.extract / 1000, page=100, page_delay=args.page / 1000)
+    voice_client = FakeVoiceClient(1, args.track / 1000)
+    guild = FakeGuild(1, voice_client)
+    user = FakeMember(2, roles=[FakeRole(bot.allowed_role_id)])
+    interaction = FakeInteraction(user, guild)
+
+    start = time.perf_counter()
+    command = asyncio.create_task(invoke(bot.play, interaction, f"https://www.youtube.com/playlist?list=PL{args.size}"))
+    most_open = 0
+    first_play = None
+
+    async def sample():
+        nonlocal most_open, first_play
+        if first_play is None and voice_client.played:
+            first_play = time.perf_counter() - start
+        most_open = max(most_open, FakeAudio.live)
+        await asyncio.sleep(0.005)
+
+    while not command.done():
+        await sample()
+    await command
+    listed = time.perf_counter() - start
+    # the first track may still be extracting once the listing is done
+    while first_play is None and time.perf_counter() - start < listed + args.extract / 1000 + 5:
+        await sample()
+    player = bot.players.get(1)
+
+    pages = -(-args.size // 100)
+    print(f"{args.size} track playlist, {args.page:.0f} ms per page of 100, {args.extract:.0f} ms per track extraction")
+    print(f"before: nothing plays until the playlist and every track are extracted, ~{(pages * args.page + args.size * args.extract) / 1000:.1f}s, then {args.size} ffmpeg sources sit in the queue")
+    print(f"after: first track playing after {first_play:.2f}s, whole playlist queued after {listed:.2f}s ({player.queue.qsize() + 1 if player else 0} tracks)")
+    for at, message in interaction.followup.messages:
+        print(f"  {at:6.2f}s  {message}")
+    print(f"at most {most_open} ffmpeg sources open at once, {FakeAudio.created} created, {bot.ytdl.calls} yt-dlp calls")
+    if player:
+        await player.stop()
+
+    # the player goes away while a second playlist is still being listed: the listing has to stop with it
+    listed = bot.ytdl.listed
+    interaction = FakeInteraction(user, guild)
+    command = asyncio.create_task(invoke(bot.play, interaction, f"https://www.youtube.com/playlist?list=PL{args.size}"))
+    while not interaction.followup.messages:
+        await asyncio.sleep(0.005)
+    await bot.players.close(1)
+    await command
+    await asyncio.sleep(pages * args.page / 1000)
+    print(f"player closed after the first page: {bot.ytdl.listed - listed} of {args.size} entries listed")
+
+async def bench_gapless(bot, args):
+    bot.discord.FFmpegPCMAudio = FakeAudio
+    tracks = [f"v{i:010d}" for i in range(args.tracks)]
+    bot.ytdl = FakeYoutubeDL(tracks, args.extract / 1000)
+
+    print(f"{args.tracks} tracks of {args.track:.0f} ms back to back, {args.extract:.0f} ms to extract each")
+    for prefetch in (0, 1, 2):
+        bot.PREFETCH_TRACKS = prefetch
+        bot.extractions = bot.ExtractionCache(None)
+        bot.players.gaps.clear()
+        voice_client = FakeVoiceClient(prefetch, args.track / 1000)
+        player = bot.players.get_or_create(prefetch)
+        player.voice_client = voice_client
+        # as queued from a playlist listing: nothing extracted yet
+        player.enqueue(bot.Track(f"Track {video_id}", f"https://www.youtube.com/watch?v={video_id}") for video_id in tracks)
+        start = time.perf_counter()
+        while len(voice_client.played) < args.tracks or voice_client.is_playing():
+            await asyncio.sleep(args.track / 1000)
+        elapsed = time.perf_counter() - start
+        gaps = bot.players.gap_percentiles()
+        print(f"prefetch {prefetch}: played in {elapsed:.2f}s, gap p50 {gaps[50]:.1f} ms, p99 {gaps[99]:.1f} ms, max {gaps[100]:.1f} ms over {len(bot.players.gaps)} handoffs, "
+              f"{FakeAudio.live} ffmpeg sources left open")
+        await player.stop()
+
+    # /leave while the next track is still being looked up
+    bot.ytdl.delay = 2
+    voice_client = FakeVoiceClient(3, args.track / 1000)
+    player = bot.players.get_or_create(3)
+    player.voice_client = voice_client
+    player.enqueue([bot.Track("Slow track", "https://www.youtube.com/watch?v=v9999999999")])
+    await asyncio.sleep(0.1)
+    interaction = FakeInteraction(FakeMember(2, roles=[FakeRole(bot.allowed_role_id)]), FakeGuild(3, voice_client))
+    start = time.perf_counter()
+    command = asyncio.create_task(invoke(bot.leave, interaction))
+    while not interaction.response.is_done():
+        await asyncio.sleep(0.001)
+    answered = time.perf_counter() - start
+    await command
+    print(f"/leave during a {bot.ytdl.delay * 1000:.0f} ms lookup: answered after {answered * 1000:.1f} ms, player gone after {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # a voice client that refuses one track, then a player task that dies with sources prefetched
+    bot.ytdl.delay = args.extract / 1000
+    voice_client = FakeVoiceClient(4, args.track / 1000)
+    play = voice_client.play
+    def refuse_third(source, *, after=None):
+        if len(voice_client.played) == 2 and not getattr(voice_client, "refused", False):
+            voice_client.refused = True
+            raise bot.discord.ClientException("Not connected to voice.")
+        play(source, after=after)
+    voice_client.play = refuse_third
+    player = bot.players.get_or_create(4)
+    player.voice_client = voice_client
+    batch = [f"v{i:010d}" for i in range(100, 110)]
+    player.enqueue(bot.Track(f"Track {video_id}", f"https://www.youtube.com/watch?v={video_id}") for video_id in batch[:5])
+    while len(voice_client.played) < 4 or voice_client.is_playing():
+        await asyncio.sleep(args.track / 1000)
+    print(f"one of 5 tracks refused by the voice client: {len(voice_client.played)} played, player still running: {not player.task.done()}, {FakeAudio.live} ffmpeg sources left open")
+    player.enqueue(bot.Track(f"Track {video_id}", f"https://www.youtube.com/watch?v={video_id}") for video_id in batch[5:])
+    while voice_client.played[-1].title != f"Track {batch[5]}" or FakeAudio.live < 1 + bot.PREFETCH_TRACKS:
+        await asyncio.sleep(0.01)
+    voice_client.stop()
+    player.task.cancel()
+    await asyncio.gather(player.task, return_exceptions=True)
+    print(f"player task killed with {bot.PREFETCH_TRACKS} tracks prefetched: {FakeAudio.live} ffmpeg sources left open")
+
+async def probe_default_executor(samples):
+    # how long unrelated work waits for the default executor
+    loop = asyncio.get_running_loop()
+    while True:
+        start = time.perf_counter()
+        await loop.run_in_executor(None, time.sleep, 0)
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+
+async def bench_extract(bot, args):
+    tracks = [f"v{i:010d}" for i in range(1000)]
+    bot.ytdl = FakeYoutubeDL(tracks, args.extract / 1000)
+    bot.EXTRACT_WORKERS = args.workers
+    url = "https://www.youtube.com/watch?v={}".format
+
+    async def timed(coro):
+        start = time.perf_counter()
+        try:
+            await coro
+            return (time.perf_counter() - start) * 1000
+        except (bot.ExtractionBusy, bot.ExtractionTimeout):
+            return None
+
+    print(f"{args.extract:.0f} ms per extraction, {args.workers} extraction workers")
+
+    # the same song asked for by many guilds at once
+    calls = bot.ytdl.calls
+    await asyncio.gather(*(bot.extractor.extract(url(tracks[0]), guild_id) for guild_id in range(args.guilds)))
+    print(f"{args.guilds} guilds playing the same new song: {bot.ytdl.calls - calls} extraction, {bot.extractor.stats['coalesced']} requests shared it")
+
+    # one guild queues a whole album by hand while others each play one song
+    flood = [asyncio.create_task(timed(bot.extractor.extract(url(tracks[1 + i]), 0))) for i in range(args.flood)]
+    await asyncio.sleep(0.01)
+    others = [asyncio.create_task(timed(bot.extractor.extract(url(tracks[500 + guild_id]), guild_id))) for guild_id in range(1, 6)]
+    flood_ms = [ms for ms in await asyncio.gather(*flood) if ms is not None]
+    other_ms = await asyncio.gather(*others)
+    # served in arrival order, the other guilds would wait behind everything guild 0 got in
+    fifo_ms = (-(-(len(flood_ms) + 5) // args.workers)) * args.extract
+    print(f"guild 0 queues {args.flood} songs: {len(flood_ms)} accepted, {args.flood - len(flood_ms)} turned away, done after up to {max(flood_ms):.0f} ms")
+    print(f"5 other guilds queue one song each right after: done after {min(other_ms):.0f}-{max(other_ms):.0f} ms (first come first served: up to ~{fifo_ms:.0f} ms)")
+
+    # the default executor stays free for everything else while extraction is saturated
+    for label, extract in [
+        ("default executor", lambda video_id: asyncio.get_running_loop().run_in_executor(None, lambda: bot.ytdl.extract_info(url(video_id), download=False))),
+        ("extraction pool", lambda video_id: bot.extractor.extract(url(video_id), video_id)),
+    ]:
+        samples = []
+        probe = asyncio.create_task(probe_default_executor(samples))
+        results = await asyncio.gather(*(timed(extract(video_id)) for video_id in tracks[100:100 + args.burst]))
+        probe.cancel()
+        done = [ms for ms in results if ms is not None]
+        print(f"{args.burst} different songs through the {label}: {len(done)} done, p50 {percentile(done, 50):.0f} ms; "
+              f"other executor work waited p50 {percentile(samples, 50):.1f} ms, max {max(samples, default=0):.1f} ms")
+
+    # a guild's queued songs still play while other guilds keep the pool full and /play is being turned away
+    bot.discord.FFmpegPCMAudio = FakeAudio
+    limit, bot.EXTRACT_QUEUE_LIMIT = bot.EXTRACT_QUEUE_LIMIT, 3
+    rejected = bot.extractor.stats["rejected"]
+    saturating = True
+
+    async def saturate(guild_id):
+        for i in itertools.count():
+            video_id = f"v{guild_id:03d}{i:07d}"
+            if not saturating:
+                return
+            if await timed(bot.extractor.extract(url(video_id), guild_id)) is None:
+                await asyncio.sleep(args.extract / 4000)
+
+    busy = [asyncio.create_task(saturate(guild_id)) for guild_id in range(10, 10 + args.workers * 2)]
+    voice_client = FakeVoiceClient(2, 0.01)
+    player = bot.players.get_or_create(2)
+    player.voice_client = voice_client
+    player.enqueue(bot.Track(f"Track {video_id}", url(video_id)) for video_id in tracks[950:956])
+    deadline = time.perf_counter() + 6 * args.extract / 1000 * 4 + 5
+    while (len(voice_client.played) < 6 or voice_client.is_playing()) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    saturating = False
+    await asyncio.gather(*busy)
+    await player.stop()
+    bot.EXTRACT_QUEUE_LIMIT = limit
+    print(f"6 queued songs with the pool full and a queue limit of 3: {len(voice_client.played)} played, "
+          f"{bot.extractor.stats['rejected'] - rejected} /play requests from other guilds turned away meanwhile")
+
+    # an extraction that hangs
+    bot.EXTRACT_TIMEOUT = args.extract / 2000
+    start = time.perf_counter()
+    result = await timed(bot.extractor.extract(url(tracks[900]), 0))
+    print(f"with a {bot.EXTRACT_TIMEOUT * 1000:.0f} ms timeout: caller gave up after {(time.perf_counter() - start) * 1000:.0f} ms ({'timed out' if result is None else 'finished'}), {bot.extractor.stats['timeouts']} timeouts")
+    bot.extractor.shutdown()
+
+async def bench_cache(bot, args):
+    rng = random.Random(args.seed)
+    tracks = [f"v{i:010d}" for i in range(args.tracks)]
+    bot.ytdl = FakeYoutubeDL(tracks, args.extract / 1000)
+    # as setup_hook opens it
+    bot.extractions = bot.ExtractionCache(bot.EXTRACT_CACHE_DB)
+    links = [
+        "https://www.youtube.com/watch?v={}",
+        "https://youtu.be/{}",
+        "https://www.youtube.com/watch?v={}&t=42s",
+        "https://music.youtube.com/watch?v={}&list=RDAMVM",
+    ]
+    # a few songs get most of the plays
+    weights = [1 / (rank + 1) for rank in range(args.tracks)]
+
+    async def replay(label, requests):
+        calls = bot.ytdl.calls
+        stats = dict(bot.extractions.stats)
+        latencies = []
+
+        async def worker(guild_id, chunk):
+            for url in chunk:
+                start = time.perf_counter()
+                entries = await bot.resolve(url, guild_id=guild_id)
+                latencies.append((time.perf_counter() - start) * 1000)
+                assert entries and entries[0]["url"]
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i, requests[i::args.concurrency]) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        delta = {name: bot.extractions.stats[name] - stats[name] for name in stats}
+        lookups = delta["hits"] + delta["stale"] + delta["misses"]
+        print(f"{label:<22} {len(requests):>6} plays in {elapsed:6.2f}s, {bot.ytdl.calls - calls:>5} extractions, "
+              f"hit rate {delta['hits'] / lookups:.0%} ({delta['stale']} expired, {delta['misses']} misses, {delta['disk_hits']} from disk), "
+              f"p50 {percentile(latencies, 50):.2f} ms, p99 {percentile(latencies, 99):.2f} ms")
+
+    def plays(count):
+        picks = rng.choices(tracks, weights=weights, k=count)
+        return [rng.choice(links).format(video_id) for video_id in picks]
+
+    print(f"{args.tracks} tracks, {args.extract:.0f} ms per extraction on {bot.EXTRACT_WORKERS} workers, {args.concurrency} guilds playing at once")
+    print(f"{'without cache':<22} {args.requests:>6} plays would take ~{args.requests * args.extract / 1000 / bot.EXTRACT_WORKERS:.2f}s with {args.requests} extractions")
+    await replay("cold", plays(args.requests))
+    await replay("warm", plays(args.requests))
+
+    # a restart empties memory; the sqlite tier still has everything
+    bot.extractions = bot.ExtractionCache(bot.EXTRACT_CACHE_DB)
+    await replay("after restart", plays(args.requests))
+
+    # once the stream urls are about to expire only the metadata is reused
+    bot.STREAM_URL_MARGIN = bot.ytdl.expire + 60
+    await replay("expired stream urls", plays(args.requests // 10))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for musicbot against fake voice clients.")
+    scenarios = parser.add_subparsers(dest="scenario", required=True)
+
+    soak = scenarios.add_parser("soak", help="many guilds playing at once, then going idle")
+    soak.add_argument("--guilds", type=int, default=5000)
+    soak.add_argument("--tracks", type=int, default=3, help="tracks queued per guild")
+    soak.add_argument("--track", type=float, default=50, help="track length in ms")
+    soak.add_argument("--idle", type=float, default=2000, help="idle timeout in ms")
+    soak.add_argument("--rounds", type=int, default=3)
+    soak.set_defaults(run=bench_soak)
+
+    playlist = scenarios.add_parser("playlist", help="time to first song for a long playlist")
+    playlist.add_argument("--size", type=int, default=500)
+    playlist.add_argument("--page", type=float, default=400, help="simulated time to list a page of 100 tracks, in ms")
+    playlist.add_argument("--extract", type=float, default=1000, help="simulated extraction time per track in ms")
+    playlist.add_argument("--track", type=float, default=60000, help="track length in ms")
+    playlist.set_defaults(run=bench_playlist)
+
+    gapless = scenarios.add_parser("gapless", help="gap between tracks with and without prefetching")
+    gapless.add_argument("--tracks", type=int, default=20)
+    gapless.add_argument("--track", type=float, default=500, help="track length in ms")
+    gapless.add_argument("--extract", type=float, default=300, help="simulated extraction time in ms")
+    gapless.set_defaults(run=bench_gapless)
+
+    extract = scenarios.add_parser("extract", help="extraction pool fairness, coalescing and backpressure")
+    extract.add_argument("--extract", type=float, default=300, help="simulated extraction time in ms")
+    extract.add_argument("--workers", type=int, default=4)
+    extract.add_argument("--guilds", type=int, default=50)
+    extract.add_argument("--flood", type=int, default=30, help="songs queued at once by one guild")
+    extract.add_argument("--burst", type=int, default=40, help="songs from different guilds at once")
+    extract.set_defaults(run=bench_extract)
+
+    cache = scenarios.add_parser("cache", help="/play resolution through the extraction cache")
+    cache.add_argument("--tracks", type=int, default=2000)
+    cache.add_argument("--requests", type=int, default=5000)
+    cache.add_argument("--extract", type=float, default=50, help="simulated extraction time in ms")
+    cache.add_argument("--concurrency", type=int, default=20)
+    cache.add_argument("--seed", type=int, default=0)
+    cache.set_defaults(run=bench_cache)
+
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = load_bot(workdir)
+        asyncio.run(args.run(bot, args))
+
+if __name__ == "__main__":
+    main()
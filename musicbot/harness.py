@@ -0,0 +1,184 @@
+import asyncio
+import importlib
+import os
+import re
+import sys
+import threading
+import time
+
+import discord
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def load_bot(workdir):
+    # main.py keeps its cache database relative to the working directory; benches that want it open it themselves
+    os.chdir(workdir)
+    if BOT_DIR not in sys.path:
+        sys.path.insert(0, BOT_DIR)
+    return importlib.import_module("main")
+
+class FakeAudio(discord.AudioSource):
+    # stands in for discord.FFmpegPCMAudio without starting ffmpeg; counts how many are alive
+    live = 0
+    created = 0
+
+    def __init__(self, source, **kwargs):
+        self.source = source
+        self.closed = False
+        FakeAudio.live += 1
+        FakeAudio.created += 1
+
+    def read(self):
+        return b""
+
+    def cleanup(self):
+        if not self.closed:
+            self.closed = True
+            FakeAudio.live -= 1
+
+class FakeVoiceClient:
+    # plays a source for `track` seconds, then calls `after` like the voice thread does
+    def __init__(self, guild_id, track=0.01):
+        self.guild_id = guild_id
+        self.track = track
+        self.connected = True
+        self.source = None
+        self.handle = None
+        self.after = None
+        self.played = []
+
+    def is_connected(self):
+        return self.connected
+
+    def is_playing(self):
+        return self.source is not None
+
+    def is_paused(self):
+        return False
+
+    def play(self, source, *, after=None):
+        if self.source is not None:
+            raise RuntimeError("Already playing audio.")
+        self.source = source
+        self.after = after
+        self.played.append(source)
+        self.handle = asyncio.get_running_loop().call_later(self.track, self.finish)
+
+    def finish(self):
+        after, self.after = self.after, None
+        source, self.source = self.source, None
+        self.handle = None
+        source.cleanup()
+        if after is not None:
+            after(None)
+
+    def stop(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.finish()
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self.connected = False
+
+class FakeRole:
+    def __init__(self, role_id):
+        self.id = role_id
+
+class FakeMember:
+    def __init__(self, user_id, roles=(), voice=True):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.roles = list(roles)
+        self.voice = object() if voice else None
+
+class FakeGuild:
+    def __init__(self, guild_id, voice_client=None):
+        self.id = guild_id
+        self.voice_client = voice_client
+
+class FakeResponse:
+    def __init__(self):
+        self.done = False
+        self.messages = []
+
+    def is_done(self):
+        return self.done
+
+    async def send_message(self, content=None, *, embed=None, ephemeral=False, **kwargs):
+        self.done = True
+        self.messages.append(content if embed is None else embed)
+
+    async def defer(self, *, ephemeral=False, **kwargs):
+        self.done = True
+
+class FakeFollowup:
+    # records when each followup was sent, relative to the interaction
+    def __init__(self, start):
+        self.start = start
+        self.messages = []
+
+    async def send(self, content=None, *, embed=None, ephemeral=False, **kwargs):
+        self.messages.append((time.perf_counter() - self.start, content if embed is None else embed))
+
+class FakeInteraction:
+    def __init__(self, user, guild):
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id
+        self.response = FakeResponse()
+        self.followup = FakeFollowup(time.perf_counter())
+
+async def invoke(command, interaction, *args, **kwargs):
+    # app_commands.Command keeps the undecorated coroutine in .callback
+    await command.callback(interaction, *args, **kwargs)
+    return interaction
+
+class FakeYoutubeDL:
+    # answers extract_info from a made-up catalog after `delay` seconds of blocking, like yt-dlp in an executor.
+    # playlist urls (list=PL...) list `page` entries per `page_delay` seconds
+    def __init__(self, tracks, delay=0.2, expire=21600, page=100, page_delay=0.5):
+        self.tracks = tracks
+        self.delay = delay
+        self.expire = expire
+        self.page = page
+        self.page_delay = page_delay
+        self.calls = 0
+        self.listed = 0
+        self.lock = threading.Lock()
+
+    def info(self, video_id):
+        return {
+            "id": video_id,
+            "title": f"Track {video_id}",
+            "duration": 180 + int(video_id[1:]) % 120,
+            "thumbnail": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+            "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+            "url": f"https://rr1.googlevideo.com/videoplayback?id={video_id}&expire={int(time.time()) + self.expire}",
+        }
+
+    def listing(self, size):
+        for start in range(0, size, self.page):
+            time.sleep(self.page_delay)
+            for video_id in self.tracks[start:min(size, start + self.page)]:
+                self.listed += 1
+                yield {"_type": "url", "id": video_id, "title": f"Track {video_id}", "url": f"https://www.youtube.com/watch?v={video_id}"}
+
+    def extract_info(self, url, download=False, process=True):
+        with self.lock:
+            self.calls += 1
+        playlist = re.search(r"list=PL(\d+)", url)
+        if playlist and "v=" not in url:
+            size = min(int(playlist.group(1)), len(self.tracks))
+            if not process:
+                return {"_type": "playlist", "entries": self.listing(size)}
+            # a full extraction lists the playlist and then extracts every entry
+            entries = list(self.listing(size))
+            time.sleep(self.delay * len(entries))
+            return {"_type": "playlist", "entries": [self.info(entry["id"]) for entry in entries]}
+        time.sleep(self.delay)
+        match = re.search(r"(?:v=|youtu\.be/)([\w-]{11})", url)
+        if match:
+            return self.info(match.group(1))
+        # anything else is treated as a search and returns the first hit
+        return {"_type": "playlist", "entries": [self.info(self.tracks[hash(url) % len(self.tracks)])]}
@@ -2,10 +2,20 @@ import discord
 from discord.app_commands import CommandTree
 import yt_dlp as youtube_dl
 import asyncio
+import contextlib
 import logging
 import os
 from discord.ui import Button, View
 import math
+import itertools
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
 
 logging.basicConfig(level=logging.INFO)
 
@@ -13,11 +23,37 @@ intents = discord.Intents.default()
 intents.voice_states = True 
 
 activity = discord.Activity(type=discord.ActivityType.listening, name="La Grenadière")
-client = discord.Client(intents=intents, activity=activity)
+
+class MusicClient(discord.Client):
+    async def setup_hook(self):
+        global extractions
+        extractions = ExtractionCache(EXTRACT_CACHE_DB)
+
+    async def close(self):
+        await players.shutdown()
+        extractor.shutdown()
+        await super().close()
+
+client = MusicClient(intents=intents, activity=activity)
 tree = CommandTree(client)
 
 allowed_role_id = 1
 booster_role_id = 1
+PLAYER_IDLE_TIMEOUT = 300 # seconds a player waits with nothing queued before it is dropped
+EXTRACT_CACHE_SIZE = 1000 # tracks kept in memory
+EXTRACT_CACHE_DB = "extract_cache.db" # None keeps the cache in memory only
+METADATA_TTL = 7 * 86400 # seconds before a cached title/duration is looked up again
+STREAM_URL_TTL = 1800 # for stream urls that don't say when they expire
+STREAM_URL_MARGIN = 600 # a stream url this close to expiring is re-extracted; a song has to finish before it runs out
+PREFETCH_TRACKS = 2 # queued tracks resolved and opened in ffmpeg while the current one plays
+GAP_SAMPLES = 1000 # recent gaps between tracks kept for /musicstats
+EXTRACT_POOL = "thread" # "thread" or "process"; a process pool keeps yt-dlp's parsing off the bot's GIL
+EXTRACT_WORKERS = 4 # extractions running at once
+EXTRACT_QUEUE_LIMIT = 100 # extractions waiting for a worker before /play is turned away...
+EXTRACT_GUILD_LIMIT = 10 # ...and per guild
+EXTRACT_TIMEOUT = 60 # seconds an extraction may run before its callers give up on it
+EXTRACT_RETRIES = 2 # times a queued track is looked up again after timing out before it is skipped
+LISTING_WORKERS = 2 # threads listing playlists, which can take minutes each
 
 class QueueView(View):
     def __init__(self, songs, current_song, user):
@@ -96,11 +132,241 @@ ytdl_format_options = {
 }
 
 ffmpeg_options = {
+    # a prefetched source opens its stream a whole song early; let ffmpeg reconnect if the server drops it meanwhile
+    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
     'options': '-vn',
     'executable': 'ffmpeg'
 }
 
 ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
+# playlists are only listed (id, title, page url), a page at a time; each track is extracted when it comes up
+ytdl_flat = youtube_dl.YoutubeDL({**ytdl_format_options, 'extract_flat': 'in_playlist', 'lazy_playlist': True, 'noplaylist': False})
+
+YOUTUBE_PLAYLIST = re.compile(r"youtube\.com/(?:playlist\?|watch\?(?!.*\bv=).*\blist=)")
+YOUTUBE_ID = re.compile(r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)([\w-]{11})")
+
+def cache_key(url):
+    # the same video reached through different links should share one entry
+    match = YOUTUBE_ID.search(url)
+    if match:
+        return f"youtube:{match.group(1)}"
+    if not re.match(r"https?://", url):
+        return "search:" + " ".join(url.lower().split())
+    parts = urlsplit(url.strip())
+    return f"{parts.netloc.lower()}{parts.path.rstrip('/')}?{parts.query}"
+
+def stream_expiry(stream_url):
+    # youtube stream urls carry their expiry as a unix time in the query string
+    expire = parse_qs(urlsplit(stream_url).query).get("expire")
+    if expire and expire[0].isdigit():
+        return int(expire[0])
+    return int(time.time()) + STREAM_URL_TTL
+
+def track_entry(data):
+    return {
+        "id": data.get("id"),
+        "title": data.get("title"),
+        "duration": data.get("duration"),
+        "thumbnail": data.get("thumbnail"),
+        "webpage_url": data.get("webpage_url") or data.get("original_url"),
+        "url": data.get("url"),
+        "expires": stream_expiry(data["url"]) if data.get("url") else 0
+    }
+
+class ExtractionCache:
+    # extraction results by cache_key: an LRU in memory in front of an optional sqlite table.
+    # metadata is kept for METADATA_TTL; the stream url only until shortly before it expires
+    def __init__(self, path):
+        self.entries = OrderedDict()
+        self.conn = None
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "stale": 0, "misses": 0, "disk_hits": 0}
+        if path:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS tracks (key TEXT PRIMARY KEY, data TEXT NOT NULL, stored_at INTEGER NOT NULL)")
+            self.conn.commit()
+
+    def read(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT data, stored_at FROM tracks WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time() - METADATA_TTL:
+            return None
+        return json.loads(row[0])
+
+    def write(self, rows):
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO tracks (key, data, stored_at) VALUES (?, ?, ?)", rows)
+
+    async def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry["stored_at"] < time.time() - METADATA_TTL:
+            del self.entries[key]
+            entry = None
+        if entry is None and self.conn is not None:
+            entry = await asyncio.to_thread(self.read, key)
+            if entry is not None:
+                self.stats["disk_hits"] += 1
+                self.remember(key, entry)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats["hits" if self.playable(entry) else "stale"] += 1
+        return entry
+
+    def playable(self, entry):
+        return entry["url"] is not None and entry["expires"] - STREAM_URL_MARGIN > time.time()
+
+    def remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > EXTRACT_CACHE_SIZE:
+            self.entries.popitem(last=False)
+
+    async def put(self, items):
+        now = int(time.time())
+        for key, entry in items:
+            entry["stored_at"] = now
+            self.remember(key, entry)
+        if self.conn is not None and items:
+            await asyncio.to_thread(self.write, [(key, json.dumps(entry), now) for key, entry in items])
+
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["stale"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+extractions = ExtractionCache(None) # setup_hook swaps in the one backed by EXTRACT_CACHE_DB, so importing touches no files
+
+class ExtractionBusy(Exception):
+    pass
+
+class ExtractionTimeout(Exception):
+    pass
+
+process_ytdl = None
+
+def extract_in_process(url):
+    # runs in a pool process, which builds its own YoutubeDL the first time
+    global process_ytdl
+    if process_ytdl is None:
+        process_ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
+    return process_ytdl.sanitize_info(process_ytdl.extract_info(url, download=False))
+
+def extract_in_thread(url):
+    return ytdl.extract_info(url, download=False)
+
+class ExtractionService:
+    # yt-dlp runs on its own pool so it never queues behind (or in front of) other executor work.
+    # waiting requests are kept per guild and started round-robin, so one guild queueing a lot
+    # doesn't hold up everyone else; identical requests in flight share one extraction
+    def __init__(self):
+        self.executor = None
+        self.listings = None
+        self.waiting = OrderedDict()
+        self.queued = 0
+        self.running = 0
+        self.inflight = {}
+        self.stats = {"started": 0, "coalesced": 0, "rejected": 0, "timeouts": 0, "failed": 0, "max_wait_ms": 0.0}
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(EXTRACT_WORKERS) if EXTRACT_POOL == "process" else ThreadPoolExecutor(EXTRACT_WORKERS, thread_name_prefix="extract")
+            self.listings = ThreadPoolExecutor(LISTING_WORKERS, thread_name_prefix="listing")
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.listings.shutdown(wait=False, cancel_futures=True)
+            self.executor = self.listings = None
+
+    async def extract(self, url, guild_id=None, *, admit=True):
+        # admit=False is for tracks already in a queue: the limits only turn away new /play requests,
+        # and a player never has more than 1 + PREFETCH_TRACKS of its own tracks waiting anyway
+        key = cache_key(url)
+        future = self.inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+        queue = self.waiting.get(guild_id)
+        if admit and (self.queued >= EXTRACT_QUEUE_LIMIT or (queue is not None and len(queue) >= EXTRACT_GUILD_LIMIT)):
+            self.stats["rejected"] += 1
+            raise ExtractionBusy("Too many songs are being looked up right now, try again in a moment.")
+
+        self.start()
+        future = self.inflight[key] = asyncio.get_running_loop().create_future()
+        if queue is None:
+            queue = self.waiting[guild_id] = deque()
+        queue.append((key, url, time.perf_counter()))
+        self.queued += 1
+        self.dispatch()
+        return await asyncio.shield(future)
+
+    def dispatch(self):
+        while self.running < EXTRACT_WORKERS and self.waiting:
+            # the guild at the front gets one extraction, then goes to the back if it has more waiting
+            guild_id, queue = self.waiting.popitem(last=False)
+            job = queue.popleft()
+            if queue:
+                self.waiting[guild_id] = queue
+            self.queued -= 1
+            self.running += 1
+            asyncio.get_running_loop().create_task(self.run(*job))
+
+    async def run(self, key, url, queued_at):
+        future = self.inflight[key]
+        self.stats["started"] += 1
+        self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], (time.perf_counter() - queued_at) * 1000)
+        work = asyncio.get_running_loop().run_in_executor(self.executor, extract_in_process if EXTRACT_POOL == "process" else extract_in_thread, url)
+        try:
+            try:
+                future.set_result(await asyncio.wait_for(asyncio.shield(work), EXTRACT_TIMEOUT))
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                future.set_exception(ExtractionTimeout("Looking up that song took too long."))
+                del self.inflight[key]
+                # a running extraction can't be interrupted; its worker only frees up once it returns
+                await asyncio.gather(work, return_exceptions=True)
+            except Exception as e:
+                self.stats["failed"] += 1
+                future.set_exception(e)
+        finally:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+            # nobody may be waiting any more, so make sure the exception counts as retrieved
+            if future.done() and not future.cancelled():
+                future.exception()
+            self.running -= 1
+            self.dispatch()
+
+    def listing(self, walk):
+        self.start()
+        return asyncio.get_running_loop().run_in_executor(self.listings, walk)
+
+extractor = ExtractionService()
+
+async def resolve(url, *, guild_id=None, queued=False):
+    # the tracks behind a /play argument; a cached track with a live stream url needs no extraction,
+    # and one whose url ran out is re-extracted from its canonical page. queued tracks skip the admission limits
+    key = cache_key(url)
+    entry = await extractions.get(key)
+    if entry is not None and extractions.playable(entry):
+        return [entry]
+    target = entry["webpage_url"] if entry is not None and entry["webpage_url"] else url
+
+    data = await extractor.extract(target, guild_id, admit=not queued)
+    if 'entries' in data:
+        entries = [track_entry(item) for item in data['entries'] if item]
+        items = [(cache_key(entry["webpage_url"]), entry) for entry in entries if entry["webpage_url"]]
+        if key.startswith("search:") and len(entries) == 1:
+            items.append((key, entries[0]))
+    else:
+        entries = [track_entry(data)]
+        items = [(key, entries[0])]
+        if entries[0]["webpage_url"] and cache_key(entries[0]["webpage_url"]) != key:
+            items.append((cache_key(entries[0]["webpage_url"]), entries[0]))
+    await extractions.put(items)
+    return entries
 
 class YTDLSource(discord.PCMVolumeTransformer):
     def __init__(self, source, *, data, volume=0.5):
@@ -110,20 +376,67 @@ class YTDLSource(discord.PCMVolumeTransformer):
         self.url = data.get('url')
 
     @classmethod
-    async def from_url(cls, url, *, loop=None, stream=False):
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
-
-        if 'entries' in data:
-            entries = data['entries']
-            playlist = []
-            for entry in entries:
-                filename = entry['url'] if stream else ytdl.prepare_filename(entry)
-                playlist.append(cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=entry))
-            return playlist
-        else:
-            filename = data['url'] if stream else ytdl.prepare_filename(data)
-            return [cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data)]
+    async def from_track(cls, track, *, guild_id=None):
+        entry = track.entry
+        if entry is None or not extractions.playable(entry):
+            for attempt in range(EXTRACT_RETRIES + 1):
+                try:
+                    entry = (await resolve(track.url, guild_id=guild_id, queued=True))[0]
+                    break
+                except ExtractionTimeout:
+                    if attempt == EXTRACT_RETRIES:
+                        raise
+                    logging.warning(f"Looking up {track.title} in guild {guild_id} timed out, trying again.")
+        return cls(discord.FFmpegPCMAudio(entry['url'], **ffmpeg_options), data=entry)
+
+class Track:
+    # what sits in a queue: enough to show and find the song. the audio source is only made
+    # once the track is within PREFETCH_TRACKS of playing, and kept in `prepared` until then
+    __slots__ = ('title', 'url', 'entry', 'prepared')
+
+    def __init__(self, title, url, entry=None):
+        self.title = title
+        self.url = url
+        self.entry = entry
+        self.prepared = None
+
+    @classmethod
+    def from_entry(cls, entry, url):
+        return cls(entry["title"], entry["webpage_url"] or url, entry)
+
+def is_playlist(url):
+    return YOUTUBE_PLAYLIST.search(url) is not None
+
+async def stream_playlist(url):
+    # the listing runs on its own threads and hands tracks over as each page of it arrives
+    loop = asyncio.get_running_loop()
+    tracks = asyncio.Queue()
+    # set once nobody reads the tracks any more, so the listing thread stops after the page it is on
+    stopped = threading.Event()
+
+    def walk():
+        try:
+            info = ytdl_flat.extract_info(url, download=False, process=False)
+            for item in info.get('entries') or ():
+                if stopped.is_set():
+                    break
+                if item and item.get('url'):
+                    loop.call_soon_threadsafe(tracks.put_nowait, Track(item.get('title') or item['url'], item['url']))
+        finally:
+            loop.call_soon_threadsafe(tracks.put_nowait, None)
+
+    listing = extractor.listing(walk)
+    try:
+        while True:
+            track = await tracks.get()
+            if track is None:
+                break
+            yield track
+    finally:
+        stopped.set()
+        # closed early, the listing is left to wind down; nobody awaits it, so its exception counts as retrieved
+        listing.add_done_callback(lambda future: future.cancelled() or future.exception())
+    await listing
 
 def has_allowed_role(interaction, playlist=False):
     if playlist:
@@ -132,29 +445,183 @@ def has_allowed_role(interaction, playlist=False):
         return discord.utils.get(interaction.user.roles, id=allowed_role_id) is not None
 
 class MusicPlayer:
-    def __init__(self):
+    # one per guild: its own queue, the voice client it plays into and the task feeding it
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
         self.queue = asyncio.Queue()
         self.current = None
-
-    async def play_next(self, voice_client):
-        if not self.queue.empty():
-            self.current = await self.queue.get()
-            voice_client.play(self.current, after=lambda e: self.play_next_after(e, voice_client))
-            return True
-        return False
-
-    def play_next_after(self, error, voice_client):
+        self.voice_client = None
+        self.finished = asyncio.Event()
+        self.stopping = False
+        self.ended_at = None
+        self.loop = asyncio.get_running_loop()
+        self.task = self.loop.create_task(self.run())
+
+    async def run(self):
+        track = source = None
+        try:
+            while not self.stopping:
+                try:
+                    track = await asyncio.wait_for(self.queue.get(), PLAYER_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if self.queue.empty():
+                        return
+                    continue
+                if track is None:
+                    continue
+                if self.voice_client is None or not self.voice_client.is_connected():
+                    logging.warning(f"Dropped {track.title} in guild {self.guild_id}: not connected to voice.")
+                    self.release(track)
+                    continue
+                self.current = track
+                try:
+                    source = await self.load(track)
+                except Exception as e:
+                    logging.error(f"Could not load {track.title} in guild {self.guild_id}: {e}")
+                    self.release(track)
+                    self.current = None
+                    continue
+                if self.stopping:
+                    break
+                self.current = source
+                self.finished.clear()
+                if self.ended_at is not None:
+                    players.record_gap(time.perf_counter() - self.ended_at)
+                try:
+                    self.voice_client.play(source, after=self.after)
+                except Exception as e:
+                    logging.error(f"Could not play {track.title} in guild {self.guild_id}: {e}")
+                    source.cleanup()
+                    source = self.current = None
+                    continue
+                # the voice client cleans the source up once it stops playing
+                source = None
+                self.prefetch()
+                await self.finished.wait()
+                self.current = None
+                if self.queue.empty():
+                    # nothing was waiting, so the next song starting later isn't a gap
+                    self.ended_at = None
+        finally:
+            # whatever was loaded but never handed to the voice client still has an ffmpeg process
+            if source is not None:
+                source.cleanup()
+            self.release(track)
+            while not self.queue.empty():
+                self.release(self.queue.get_nowait())
+            self.current = None
+            players.discard(self)
+
+    def after(self, error):
+        # called from the voice thread
+        self.ended_at = time.perf_counter()
         if error:
             logging.error(f'Player error: {error}')
-        asyncio.run_coroutine_threadsafe(self.play_next(voice_client), client.loop)
-
-music_player = MusicPlayer()
+        self.loop.call_soon_threadsafe(self.finished.set)
+
+    def prefetch(self):
+        # the next few tracks are resolved and their ffmpeg started now, so the handoff doesn't wait on either
+        for track in itertools.islice(self.queue._queue, PREFETCH_TRACKS):
+            if track is not None and track.prepared is None:
+                track.prepared = self.loop.create_task(YTDLSource.from_track(track, guild_id=self.guild_id))
+
+    async def load(self, track):
+        # the task stays on the track until it has handed over its source, so release() can clean up after it
+        if track.prepared is None:
+            track.prepared = self.loop.create_task(YTDLSource.from_track(track, guild_id=self.guild_id))
+        source = await track.prepared
+        track.prepared = None
+        return source
+
+    def release(self, track):
+        # a dropped track may already have an ffmpeg process waiting
+        if track is None or track.prepared is None:
+            return
+        prepared, track.prepared = track.prepared, None
+        if not prepared.done():
+            prepared.cancel()
+        elif not prepared.cancelled() and prepared.exception() is None:
+            prepared.result().cleanup()
+
+    def enqueue(self, tracks):
+        for track in tracks:
+            self.queue.put_nowait(track)
+        if self.current is not None:
+            self.prefetch()
+
+    def skip(self, count):
+        # drops count - 1 queued songs, then stopping the current one moves on to the next
+        for _ in range(min(count - 1, self.queue.qsize())):
+            self.release(self.queue.get_nowait())
+        if self.voice_client is not None:
+            self.voice_client.stop()
+
+    async def stop(self):
+        self.stopping = True
+        while not self.queue.empty():
+            self.release(self.queue.get_nowait())
+        self.queue.put_nowait(None)
+        if self.voice_client is not None:
+            self.voice_client.stop()
+        self.finished.set()
+        # the task may be waiting on a lookup that takes up to EXTRACT_TIMEOUT; there is nothing left to play it for
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+class PlayerRegistry:
+    # players are made on the first /play in a guild and drop themselves after PLAYER_IDLE_TIMEOUT idle
+    def __init__(self):
+        self.players = {}
+        self.gaps = deque(maxlen=GAP_SAMPLES)
+        self.stats = {"created": 0, "closed": 0, "handoffs": 0}
+
+    def get(self, guild_id):
+        return self.players.get(guild_id)
+
+    def get_or_create(self, guild_id):
+        player = self.players.get(guild_id)
+        if player is None or player.stopping:
+            player = self.players[guild_id] = MusicPlayer(guild_id)
+            self.stats["created"] += 1
+        return player
+
+    def record_gap(self, seconds):
+        self.gaps.append(seconds * 1000)
+        self.stats["handoffs"] += 1
+
+    def gap_percentiles(self):
+        # milliseconds between one track ending and the next starting, over the last GAP_SAMPLES handoffs
+        gaps = sorted(self.gaps)
+        if not gaps:
+            return None
+        return {pct: gaps[min(len(gaps) - 1, int(len(gaps) * pct / 100))] for pct in (50, 99, 100)}
+
+    def discard(self, player):
+        if self.players.get(player.guild_id) is player:
+            del self.players[player.guild_id]
+            self.stats["closed"] += 1
+
+    async def close(self, guild_id):
+        player = self.players.get(guild_id)
+        if player is not None:
+            await player.stop()
+
+    async def shutdown(self):
+        await asyncio.gather(*(player.stop() for player in list(self.players.values())))
+
+players = PlayerRegistry()
 
 @client.event
 async def on_ready():
     await tree.sync()
     logging.info(f'Logged in as {client.user}!')
 
+@client.event
+async def on_voice_state_update(member, before, after):
+    # the bot was disconnected or moved out of voice by someone else
+    if client.user and member.id == client.user.id and after.channel is None:
+        await players.close(member.guild.id)
+
 @tree.command(name="join", description="Tells the bot to join the voice channel")
 async def join(interaction: discord.Interaction):
     if not has_allowed_role(interaction):
@@ -184,8 +651,9 @@ async def leave(interaction: discord.Interaction):
 
     voice_client = interaction.guild.voice_client
     if voice_client and voice_client.is_connected():
-        await voice_client.disconnect()
         await interaction.response.send_message("Disconnected from the voice channel")
+        await players.close(interaction.guild.id)
+        await voice_client.disconnect()
     else:
         await interaction.response.send_message("The bot is not connected to a voice channel.", ephemeral=True)
 
@@ -206,17 +674,40 @@ async def play(interaction: discord.Interaction, url: str):
             return
 
         await interaction.response.defer(ephemeral=False) 
-        playlist = await YTDLSource.from_url(url, loop=client.loop, stream=True)
 
-        for player in playlist:
-            await music_player.queue.put(player)
+        if is_playlist(url):
+            player = players.get_or_create(interaction.guild.id)
+            player.voice_client = voice_client
+            starting = player.current is None and player.queue.empty()
+            queued = 0
+            async with contextlib.aclosing(stream_playlist(url)) as playlist:
+                async for track in playlist:
+                    if player.stopping:
+                        break
+                    player.enqueue([track])
+                    queued += 1
+                    if queued == 1:
+                        if starting:
+                            await interaction.followup.send(f'**Now playing:** `{track.title}` (loading the rest of the playlist...)')
+                        else:
+                            await interaction.followup.send(f"Adding the playlist to the queue, starting with `{track.title}` at position {player.queue.qsize()}...")
+            if queued:
+                await interaction.followup.send(f"Queued {queued} songs from the playlist.")
+            else:
+                await interaction.followup.send("That playlist is empty.", ephemeral=True)
+            return
+
+        entries = await resolve(url, guild_id=interaction.guild.id)
+        player = players.get_or_create(interaction.guild.id)
+        player.voice_client = voice_client
+        starting = player.current is None and player.queue.empty()
+        player.enqueue(Track.from_entry(entry, url) for entry in entries)
 
-        if not voice_client.is_playing():
-            await music_player.play_next(voice_client)
-            await interaction.followup.send(f'**Now playing:** `{playlist[0].title}`')
+        if starting:
+            await interaction.followup.send(f'**Now playing:** `{entries[0]["title"]}`')
         else:
-            queue_position = music_player.queue.qsize()
-            await interaction.followup.send(f"Added `{playlist[0].title}` to the queue. Currently at queue position {queue_position}")
+            queue_position = player.queue.qsize()
+            await interaction.followup.send(f"Added `{entries[0]['title']}` to the queue. Currently at queue position {queue_position}")
     except Exception as e:
         await interaction.followup.send(f'An error occurred: {e}', ephemeral=True)
 
@@ -266,7 +757,8 @@ async def current(interaction: discord.Interaction):
         await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
         return
 
-    current_song = music_player.current
+    player = players.get(interaction.guild.id)
+    current_song = player.current if player else None
 
     if not current_song:
         await interaction.response.send_message("No song is currently playing.", ephemeral=True)
@@ -278,8 +770,9 @@ async def current(interaction: discord.Interaction):
 @tree.command(name="queue", description="Show the song queue")
 async def queue(interaction: discord.Interaction):
 
-    songs = list(music_player.queue._queue)
-    current_song = music_player.current
+    player = players.get(interaction.guild.id)
+    songs = [song for song in player.queue._queue if song is not None] if player else []
+    current_song = player.current if player else None
 
     if not songs:
         await interaction.response.send_message("The queue is currently empty.", ephemeral=True)
@@ -294,6 +787,26 @@ async def queue(interaction: discord.Interaction):
     view = QueueView(songs, current_song, interaction.user)
     await interaction.response.send_message(embed=view.generate_embed(0), view=view)
 
+@tree.command(name="musicstats", description="Show extraction cache and playback statistics")
+async def musicstats(interaction: discord.Interaction):
+    if not has_allowed_role(interaction):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+
+    stats = extractions.stats
+    embed = discord.Embed(title="Music Stats", color=0x808000)
+    embed.add_field(name="Hit rate", value=f"{extractions.hit_rate():.0%}", inline=False)
+    embed.add_field(name="Lookups", value=f"{stats['hits']} hits, {stats['stale']} expired streams, {stats['misses']} misses", inline=False)
+    work = extractor.stats
+    embed.add_field(name="Extractions", value=f"{work['started']} run, {work['coalesced']} shared, {work['rejected']} turned away, {work['timeouts']} timed out", inline=False)
+    embed.add_field(name="Extraction queue", value=f"{extractor.running}/{EXTRACT_WORKERS} running, {extractor.queued} waiting, longest wait {work['max_wait_ms']:.0f} ms", inline=False)
+    embed.add_field(name="Cached", value=f"{len(extractions.entries)} in memory, {stats['disk_hits']} loaded from disk", inline=True)
+    gaps = players.gap_percentiles()
+    if gaps:
+        embed.add_field(name="Gap between tracks", value=f"p50 {gaps[50]:.0f} ms, p99 {gaps[99]:.0f} ms, max {gaps[100]:.0f} ms over {len(players.gaps)} handoffs", inline=False)
+    embed.add_field(name="Players", value=f"{len(players.players)} active", inline=True)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 @tree.command(name="skip", description="Skip the currently playing song")
 async def skip(interaction: discord.Interaction, count: int = 1):
     if not has_allowed_role(interaction):
@@ -301,10 +814,9 @@ async def skip(interaction: discord.Interaction, count: int = 1):
         return
 
     voice_client = interaction.guild.voice_client
-    if voice_client and voice_client.is_playing():
-        for _ in range(count):
-            voice_client.stop()
-            await asyncio.sleep(1) 
+    player = players.get(interaction.guild.id)
+    if voice_client and voice_client.is_playing() and player:
+        player.skip(count)
 
         if count == 1:
             await interaction.response.send_message(f"Skipped {count} song")
@@ -313,5 +825,6 @@ async def skip(interaction: discord.Interaction, count: int = 1):
     else:
         await interaction.response.send_message("Currently no audio is playing.", ephemeral=True)
 
-token = os.getenv("TOKEN")
-client.run(token)
+if __name__ == "__main__":
+    token = os.getenv("TOKEN")
+    client.run(token)